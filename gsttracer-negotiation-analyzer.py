@@ -1,11 +1,51 @@
+import argparse
+import collections
+import heapq
+import itertools
+import re
 import sys
+import time
 
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import GObject, Gst
+import gsttracercache
+import gsttracercaps
+import gsttracerengine
+import gsttracerinput
+import gsttracerparser
+import gsttracersketch
+import gsttracerstats
+import gsttracerwindow
+
+# Seconds to wait for a followed file to grow
+FOLLOW_POLL_INTERVAL = 0.5
+
+# Only loaded when the GObject based structure parser is requested
+Gst = None
 
 class GstTracerLineParsingException(Exception): pass
 
+def _python_structure_from_string(string):
+    try:
+        return gsttracerparser.parse_structure(string)
+    except gsttracerparser.GstStructureParsingException, e:
+        raise GstTracerLineParsingException, str(e)
+
+def _gst_structure_from_string(string):
+    structure = Gst.Structure.from_string(string)[0]
+    if structure is None:
+        raise GstTracerLineParsingException, 'failed to parse structure'
+    return structure
+
+structure_from_string = _python_structure_from_string
+
+def use_gst_backend():
+    ''' Parse the tracer structures with GStreamer instead of the python parser '''
+    global Gst, structure_from_string
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    structure_from_string = _gst_structure_from_string
+
 global element_names
 element_names = {}
 
@@ -82,15 +122,49 @@ def element_is_pipeline(line, elements):
 
 # An accept-caps has ended up doing a downstream caps query
 PERFORMANCE_ACCEPT_CAPS = 'performance/accept-caps'
+# The same query was made more than once on a pad in a single tree
+PERFORMANCE_REPEATED_QUERY = 'performance/repeated-query'
+# A query made too many queries itself, or a tree went too deep
+PERFORMANCE_QUERY_FANOUT = 'performance/query-fanout'
+PERFORMANCE_QUERY_DEPTH = 'performance/query-depth'
+# A caps query from a streaming thread once the pipeline is prerolled
+PERFORMANCE_STREAMING_QUERY = 'performance/streaming-thread-query'
+# Too many accept-caps on a pad in one second
+PERFORMANCE_ACCEPT_CAPS_STORM = 'performance/accept-caps-storm'
+# A caps query whose result is emptied by its filter
+PERFORMANCE_FILTERED_RESULT = 'performance/filtered-result'
+
+# Events on a pad and messages of an element after which the caps queries
+# on them may get different results
+INVALIDATING_EVENTS = frozenset(['caps', 'reconfigure'])
+INVALIDATING_MESSAGES = frozenset(['state-changed'])
+
+# Number of leading whitespace separated tokens to look at when locating
+# the TRACE level; the structure itself is kept as a single unsplit token
+_MAX_PREFIX_TOKENS = 16
+
+# 'name' field of the tracer structures (query, message, event...), picked
+# from the raw text so that lines can be discarded without a GstStructure
+_NAME_FIELD_RE = re.compile(r'[ ,]name=\(string\)("(?:[^"\\]|\\.)*"|[^,;\s]*)')
+
+# 'thread-id' field, to tell the streaming threads from the buffer lines
+# without parsing them
+_THREAD_ID_RE = re.compile(r'[ ,]thread-id=\(guint64\)(\d+)')
 
 class GstTracerLine(object):
-    def __init__(self, line):
+    __slots__ = ('line', 'offset', 'time', 'structure_string', 'name',
+                 '_type_name', '_structure', '_record')
+
+    def __init__(self, line, offset=None):
         self.line = line
-        tokens = line.split()
+        self.offset = offset
+        if 'GST_TRACER' not in line:
+            raise GstTracerLineParsingException, 'not a GST_TRACER line'
+        tokens = line.split(None, _MAX_PREFIX_TOKENS)
         if len(tokens) < 9:
             raise GstTracerLineParsingException, 'Not enough tokens'
         base_index = -1
-        for i in range(len(tokens)):
+        for i in range(len(tokens) - 1):
             if 'TRACE' in tokens[i]:
                 base_index = i
                 break
@@ -101,26 +175,71 @@ class GstTracerLine(object):
 
         self.time = tokens[0]
 
-        #FIXME some structures fail parsing
-        self.structure = Gst.Structure.from_string(' '.join(tokens[base_index+5:]))[0]
+        # The GstStructure is only built when a field is read, the name
+        # and the 'name' field are enough to classify the line
+        self.structure_string = ' '.join(tokens[base_index+5:]).rstrip()
+        self.name = self.structure_string.split(',', 1)[0].rstrip(';')
+        self._type_name = None
+        self._structure = None
+        self._record = None
+
+    @classmethod
+    def from_structure(cls, time, structure, offset=None):
+        ''' Creates a line from an already decoded structure '''
+        self = cls.__new__(cls)
+        self.line = ''
+        self.offset = offset
+        self.time = time
+        self.structure_string = None
+        self.name = structure.get_name()
+        self._type_name = structure.get_value('name') or ''
+        self._structure = structure
+        self._record = None
+        return self
+
+    @property
+    def structure(self):
+        if self._structure is None:
+            self._structure = structure_from_string(self.structure_string)
+        return self._structure
+
+    @property
+    def type_name(self):
+        if self._type_name is None:
+            m = _NAME_FIELD_RE.search(self.structure_string)
+            self._type_name = m.group(1).strip('"') if m else ''
+        return self._type_name
 
     def get_thread(self):
         return self.structure.get_value('thread-id')
 
+    def get_raw_thread(self):
+        ''' get_thread() without building the structure '''
+        if self._structure is not None or self.structure_string is None:
+            return self.get_thread()
+        m = _THREAD_ID_RE.search(self.structure_string)
+        return int(m.group(1)) if m else None
+
     def get_element_ix(self):
         return self.structure.get_value('element-ix')
 
     def is_query(self):
-        return self.structure and self.structure.get_name() == 'query'
+        return self.name == 'query'
 
     def is_new_element(self):
-        return self.structure and self.structure.get_name() == 'new-element'
+        return self.name == 'new-element'
 
     def is_new_pad(self):
-        return self.structure and self.structure.get_name() == 'new-pad'
+        return self.name == 'new-pad'
 
     def is_message(self):
-        return self.structure and self.structure.get_name() == 'message'
+        return self.name == 'message'
+
+    def is_event(self):
+        return self.name == 'event'
+
+    def is_buffer(self):
+        return self.name == 'buffer' or self.name == 'buffer-list'
 
     @property
     def ts(self):
@@ -128,7 +247,7 @@ class GstTracerLine(object):
 
     # QUERY RELATED FUNCTIONS
     def is_query_type(self, name):
-        return self.structure.get_value('name') == name
+        return self.type_name == name
 
     def query_between_elements(self):
         return self.structure.get_value('element-ix') != 4294967295 and \
@@ -157,14 +276,212 @@ class GstTracerLine(object):
     # MESSAGE RELATED FUNCTIONS
 
     def is_message_type(self, name):
-        return self.structure.get_value('name') == name
+        return self.type_name == name
 
     # END OF MESSAGE_RELATED_FUNCTIONS
 
+    def is_event_type(self, name):
+        return self.type_name == name
+
+    def is_invalidation(self):
+        ''' Whether the line is a caps query invalidating event or message '''
+        if self.is_event():
+            return self.type_name in INVALIDATING_EVENTS
+        if self.is_message():
+            return self.type_name in INVALIDATING_MESSAGES
+        return False
+
+    def get_record(self):
+        ''' The fields of the line GstCapsNegoProcessor uses, as the
+        negotiation_events row of CACHE_SCHEMA with the caps as caps_table
+        ids '''
+        if self._record is not None:
+            return self._record
+        structure = self.structure
+        # interned, the names of the records are shared
+        name = intern(self.name)
+        type_name = intern(self.type_name)
+        if self.is_new_element() or self.is_new_pad():
+            record = (self.offset, name, self.time, structure.get_value('name'),
+                      structure.get_value('ix')) + (None,) * 11
+        elif self.is_message() or self.is_buffer():
+            record = (self.offset, name, self.time, type_name, None,
+                      structure.get_value('thread-id'), structure.get_value('ts'),
+                      structure.get_value('element-ix')) + (None,) * 8
+        elif self.is_event():
+            record = (self.offset, name, self.time, type_name, None,
+                      structure.get_value('thread-id'), structure.get_value('ts'),
+                      structure.get_value('element-ix'),
+                      structure.get_value('pad-ix')) + (None,) * 7
+        else:
+            query = structure.get_value('structure')
+            if query is None or type_name not in ('caps', 'accept-caps'):
+                filtercaps = querycaps = result = None
+            else:
+                filtercaps = caps_table.get_id(query.get_value('filter'))
+                querycaps = caps_table.get_id(query.get_value('caps'))
+                result = query.get_value('result')
+            record = (self.offset, name, self.time, type_name, None,
+                      structure.get_value('thread-id'), structure.get_value('ts'),
+                      structure.get_value('element-ix'), structure.get_value('pad-ix'),
+                      structure.get_value('peer-element-ix'),
+                      structure.get_value('peer-pad-ix'),
+                      structure.get_value('have-res'), structure.get_value('res'),
+                      filtercaps, querycaps, None if result is None else bool(result))
+        self._record = record
+        return record
+
     def __str__(self):
         return self.line
 
+# Caps of all the query lines, referred to by id
+caps_table = gsttracercaps.CapsTable()
+
+def _structure_from_record(record, get_caps):
+    ''' Rebuilds the structure of a line from its record, see
+    GstTracerLine.get_record(), get_caps returns the caps of a caps id '''
+    offset, kind, time, name, ix, thread, ts, element, pad, peer_element, peer_pad, \
+        have_res, res, filtercaps, querycaps, result = record
+    Structure = gsttracerparser.Structure
+    structure = Structure(kind)
+    structure['name'] = name
+    if ix is not None:
+        structure['ix'] = ix
+    else:
+        structure['thread-id'] = thread
+        structure['ts'] = ts
+        structure['element-ix'] = element
+    if kind == 'event':
+        structure['pad-ix'] = pad
+    elif kind == 'query':
+        structure['pad-ix'] = pad
+        structure['peer-element-ix'] = peer_element
+        structure['peer-pad-ix'] = peer_pad
+        structure['have-res'] = bool(have_res)
+        structure['res'] = bool(res)
+        query = Structure('query-' + name)
+        if name == 'caps':
+            query['filter'] = get_caps(filtercaps)
+        query['caps'] = get_caps(querycaps)
+        if result is not None:
+            query['result'] = bool(result)
+        structure['structure'] = query
+    return structure
+
+def _get_table_caps(caps_id):
+    if caps_id is None:
+        return None
+    return gsttracerparser.Caps(caps_table.get_string(caps_id))
+
+class GstTracerRecordLine(GstTracerLine):
+    ''' A GstTracerLine rebuilt from its record, as the --jobs workers
+    send them back. The fields GstCapsNegoProcessor reads come from the
+    record, the structure is only built for the others. '''
+    __slots__ = ()
+
+    def __init__(self, record):
+        self.line = ''
+        self.offset = record[0]
+        self.time = record[2]
+        self.structure_string = None
+        self.name = record[1]
+        self._type_name = record[3] or ''
+        self._structure = None
+        self._record = record
+
+    @property
+    def structure(self):
+        if self._structure is None:
+            self._structure = _structure_from_record(self._record, _get_table_caps)
+        return self._structure
+
+    def get_thread(self):
+        return self._record[5]
+
+    def get_raw_thread(self):
+        return self._record[5]
+
+    def get_element_ix(self):
+        return self._record[7]
+
+    @property
+    def ts(self):
+        return int(self._record[6])
+
+def _parse_debug_time(time):
+    ''' Returns the h:mm:ss.nnnnnnnnn debug timestamp in ns, so it can be
+    stored as an int, or the string itself if it would not print back '''
+    try:
+        h, m, s = time.split(':')
+        s, ns = s.split('.')
+        value = ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000000000 + int(ns)
+    except ValueError:
+        return time
+    if _format_debug_time(value) != time:
+        return time
+    return value
+
+def _format_debug_time(value):
+    if not isinstance(value, (int, long)):
+        return value
+    return '%u:%02u:%02u.%09u' % (value / 3600000000000, value / 60000000000 % 60,
+                                 value / 1000000000 % 60, value % 1000000000)
+
+class GstCapsQueryLine(object):
+    ''' The fields of a caps or accept-caps query line kept in the trees
+
+    The original text can be read back from plain log files with
+    get_line(). '''
+    __slots__ = ('offset', '_time', 'ts', 'thread', 'kind', 'element', 'pad',
+                 'peer_element', 'peer_pad', 'have_res', 'res', 'filter',
+                 'caps', 'result')
+
+    def __init__(self, tracer_line):
+        self.offset, kind, time, name, ix, self.thread, ts, self.element, self.pad, \
+            self.peer_element, self.peer_pad, have_res, res, self.filter, self.caps, \
+            self.result = tracer_line.get_record()
+        self._time = _parse_debug_time(time)
+        self.ts = int(ts)
+        self.kind = intern(name)
+        self.have_res = bool(have_res)
+        self.res = bool(res)
+
+    @property
+    def time(self):
+        return _format_debug_time(self._time)
+
+    def get_line(self, input_file):
+        # the offsets of compressed logs are in the decompressed text
+        if self.offset is None or not gsttracerinput.is_seekable(input_file):
+            return None
+        with open(input_file, 'rb') as f:
+            f.seek(self.offset)
+            return f.readline()
+
+    def get_element_ix(self):
+        return self.element
+
+    def is_query_type(self, name):
+        return self.kind == name
+
+    def get_query_origin(self):
+        return self.element
+
+    def get_query_origin_pad(self):
+        return self.pad
+
+    def get_query_peer(self):
+        return self.peer_element
+
+    def get_query_peer_pad(self):
+        return self.peer_pad
+
+    def is_post_query(self):
+        return self.have_res
+
 class GstCapsQueryTree(object):
+    __slots__ = ('root', 'current')
+
     def __init__(self, root):
         self.root = root
         self.current = root
@@ -199,12 +516,16 @@ class GstCapsQueryTree(object):
         return []
 
 class GstCapsQueryTreeNode(object):
+    __slots__ = ('children', 'queryline', 'res_queryline', 'parent', 'issues')
+
     def __init__(self, queryline):
-        self.children = []
+        # most nodes are leaves without issues, they share the empty tuple
+        # until they get a list
+        self.children = ()
         self.queryline = queryline
         self.res_queryline = None
         self.parent = None
-        self.issues = []
+        self.issues = ()
 
     def close(self, queryline):
         self.res_queryline = queryline
@@ -212,6 +533,11 @@ class GstCapsQueryTreeNode(object):
     def get_total_time(self):
         return self.res_queryline.ts - self.queryline.ts
 
+    def get_self_time(self):
+        ''' The time spent in the query itself and not in the queries it
+        made to other pads '''
+        return self.get_total_time() - sum([c.get_total_time() for c in self.children])
+
     @property
     def node_count(self):
         return 1 + sum([x.node_count for x in self.children])
@@ -228,10 +554,19 @@ class GstCapsQueryTreeNode(object):
             elif self.parent and self.parent.queryline.is_query_type('accept-caps'):
                 parent_accept = self.parent
             if parent_accept and child.queryline.get_element_ix() != parent_accept.queryline.get_element_ix():
-                child.issues.append(PERFORMANCE_ACCEPT_CAPS)
+                child.add_issue(PERFORMANCE_ACCEPT_CAPS)
+
+    def add_issue(self, issue):
+        if self.issues:
+            self.issues.append(issue)
+        else:
+            self.issues = [issue]
 
     def add_child(self, node):
-        self.children.append(node)
+        if self.children:
+            self.children.append(node)
+        else:
+            self.children = [node]
         node.parent = self
 
         self._check_child(node)
@@ -256,11 +591,8 @@ class GstCapsQueryTreeNode(object):
                 yield c_node
 
     def get_pretty_string(self, lines, indent=0):
-        structure = self.queryline.get_query_structure()
-        if self.res_queryline:
-            res_structure = self.res_queryline.get_query_structure()
-        else:
-            res_structure = None
+        query = self.queryline
+        res = self.res_queryline
         x = '%s%s : %s : %s(%s):%s(%s) ' % (
             ' ' * indent, str(self.queryline.time),
             self.query_name,
@@ -270,13 +602,12 @@ class GstCapsQueryTreeNode(object):
             str(self.queryline.get_query_origin_pad()))
         if self.is_caps_query():
             x += '- filter: %s : res: %s' % (
-                structure.get_value('filter').to_string(),
-                res_structure.get_value('caps').to_string() if res_structure else \
-                structure.get_value('caps').to_string())
+                caps_table.to_string(query.filter),
+                caps_table.to_string(res.caps if res else query.caps))
         else:
             x += '- caps: %s : res: %s' % (
-                structure.get_value('caps').to_string(),
-                res_structure.get_value('result') if res_structure else '')
+                caps_table.to_string(query.caps),
+                res.result if res else '')
 
         if self.issues:
             x += ' : Issues:%s' % str(self.issues)
@@ -292,26 +623,17 @@ class GstCapsQueryTreeNode(object):
         lines.append(end)
 
 class GstCapsQueryPadStats(object):
-    class QueryMapKey(object):
-        def __init__(self, filtercaps, caps, result):
-            self.filtercaps = filtercaps
-            self.caps = caps
-            self.result = result
-
-        def __hash__(self):
-            return hash(0) #TODO always collide
-
-        def __eq__(self, o):
-            return self.filtercaps.is_equal(o.filtercaps) and \
-                   self.caps.is_equal(o.caps) and \
-                   self.result == o.result
-
     def __init__(self, elem, pad):
         self.elem = elem
         self.pad = pad
-        self.queries_map = {} #the key is the filter/result
+        self.queries_map = collections.OrderedDict()
+                              #the key is the filter/caps/result
                               #to know how many time the same caps
                               #query was repeated on this pad
+        # all the closed queries of the pad, caps and accept-caps
+        self.count = 0
+        self.total_time = 0
+        self.self_time = 0
 
     def add_node(self, node):
         # TODO verify this node belongs to the stats
@@ -320,24 +642,33 @@ class GstCapsQueryPadStats(object):
         if not node.res_queryline:
             return
 
+        self.count += 1
+        self.total_time += node.get_total_time()
+        self.self_time += node.get_self_time()
+
         if not node.is_caps_query():
             return
 
-        structure = node.res_queryline.structure.get_value('structure')
-        key = GstCapsQueryPadStats.QueryMapKey(structure.get_value('filter'), \
-               structure.get_value('caps'), node.res_queryline.structure.get_value('res'))
-        data = self.queries_map.get(key, [])
-        data.append(node)
-        self.queries_map[key] = data
+        res = node.res_queryline
+        key = (caps_table.get_class(res.filter), caps_table.get_class(res.caps),
+               res.res)
+        data = self.queries_map.get(key)
+        if data is None:
+            # the first caps seen are kept to print the entry, the nodes
+            # themselves are only counted so they can be released
+            data = [res.filter, res.caps, res.res, 0, 0]
+            self.queries_map[key] = data
+        data[3] += 1
+        data[4] += node.get_total_time()
 
     def get_pretty_string(self, indent):
         lines = []
-        for k,v in self.queries_map.iteritems():
-            lines.append(indent * ' ' + 'filter: ' + (k.filtercaps.to_string() if k.filtercaps else '--'))
-            lines.append(indent * ' ' + 'caps: ' + k.caps.to_string())
-            lines.append(indent * ' ' + 'res: ' + str(k.result))
+        for filtercaps, caps, result, count, total_time in self.queries_map.itervalues():
+            lines.append(indent * ' ' + 'filter: ' + (caps_table.get_string(filtercaps) or '--'))
+            lines.append(indent * ' ' + 'caps: ' + caps_table.to_string(caps))
+            lines.append(indent * ' ' + 'res: ' + str(result))
             lines.append(indent * ' ' + 'Repeated: %d (total time: %dns)' % \
-                         (len(v), sum([x.get_total_time() for x in v])))
+                         (count, total_time))
             lines.append('')
         return '\n'.join(lines)
 
@@ -346,88 +677,1470 @@ def gen_element_pad_name(elem,pad):
             get_element_name(elem), str(elem),
             get_pad_name(pad), str(pad))
 
-def process_file(input_file):
+def is_relevant_line(tracer_line):
+    ''' Whether the line is used by GstCapsNegoProcessor, without parsing it '''
+    if tracer_line.is_query():
+        return tracer_line.is_query_type('caps') or \
+               tracer_line.is_query_type('accept-caps')
+    if tracer_line.is_message():
+        return tracer_line.is_message_type('async-done') or \
+               tracer_line.is_invalidation()
+    if tracer_line.is_event():
+        return tracer_line.is_invalidation()
+    return tracer_line.is_new_element() or tracer_line.is_new_pad()
+
+# ns after which a query tree still open is taken for one that will never
+# close, its post query missing from the log, see get_replay_ts()
+STALE_TREE_TIME = 10 * 1000000000
+
+class GstCapsNegoProcessor(object):
+    ''' Builds the caps query trees from tracer lines fed in log order
+
+    Closed trees are kept in query_trees, or passed to tree_callback
+    instead when one is given. Trees for which tree_filter returns False
+    are dropped. The events and messages after which caps queries can get
+    different results are passed to event_callback. '''
+
+    def __init__(self, tree_callback=None, event_callback=None):
+        self.tree_callback = tree_callback
+        self.event_callback = event_callback
+        self.tree_filter = None
+        # Each thread will maintain the current GstCapsQueryTree running in it
+        # until it is closed, then it is removed
+        self.threads = {}
+        # ts of the last caps query
+        self.last_query_ts = None
+        self.query_trees = []
+        self.elements = {}
+        self.pads = {}
+        self.preroll_time = 0
+        self.preroll_times = []
+        # thread -> ts of the first buffer it pushed
+        self.streaming_threads = {}
+
+    def is_new_streaming_thread(self, tracer_line):
+        ''' Whether the line is the first buffer pushed by its thread '''
+        return tracer_line.is_buffer() and \
+               tracer_line.get_raw_thread() not in self.streaming_threads
+
+    def add_line(self, tracer_line):
+        if tracer_line.is_new_element():
+            self.elements[tracer_line.structure.get_value('ix')] = \
+                tracer_line.structure.get_value('name')
+        elif tracer_line.is_new_pad():
+            self.pads[tracer_line.structure.get_value('ix')] = \
+                tracer_line.structure.get_value('name')
+        elif tracer_line.is_query():
+            if not (tracer_line.is_query_type('caps') or \
+                    tracer_line.is_query_type('accept-caps')): return
+
+            thread = tracer_line.get_thread()
+            node = GstCapsQueryTreeNode(GstCapsQueryLine(tracer_line))
+            self.last_query_ts = node.queryline.ts
+            if thread in self.threads:
+                tree = self.threads[thread]
+                tree.add_node(node)
+                if tree.is_closed():
+                    del self.threads[thread]
+                    if self.tree_filter and not self.tree_filter(tree):
+                        pass
+                    elif self.tree_callback:
+                        self.tree_callback(tree)
+                    else:
+                        self.query_trees.append(tree)
+            elif node.queryline.is_post_query():
+                # the result of a query made before the part of the log
+                # being read, it can't be paired
+                pass
+            else:
+                tree = GstCapsQueryTree(node)
+                self.threads[thread] = tree
+
+        elif tracer_line.is_message():
+            if tracer_line.is_message_type('async-done') and \
+               element_is_pipeline(tracer_line, self.elements):
+                self.preroll_time = tracer_line.ts
+                self.preroll_times.append(self.preroll_time)
+            elif self.event_callback and tracer_line.is_invalidation():
+                self.event_callback(tracer_line)
+
+        elif tracer_line.is_event():
+            if self.event_callback and tracer_line.is_invalidation():
+                self.event_callback(tracer_line)
+
+        elif tracer_line.is_buffer():
+            thread = tracer_line.get_raw_thread()
+            if thread not in self.streaming_threads:
+                self.streaming_threads[thread] = tracer_line.ts
+
+    def get_open_trees_start(self):
+        ''' The ts of the oldest query tree still open, None if there are none '''
+        if not self.threads:
+            return None
+        return min([t.root.queryline.ts for t in self.threads.itervalues()])
+
+    def get_replay_ts(self):
+        ''' The ts before which the closed trees can be replayed in ts
+        order, None for all of them
+
+        It is the start of the oldest open tree, unless that one is stale:
+        the trees and events waiting for it are not held for more than
+        STALE_TREE_TIME. Should it still close, its queries come after
+        newer ones. '''
+        start = self.get_open_trees_start()
+        if start is None:
+            return None
+        return max(start, self.last_query_ts - STALE_TREE_TIME)
+
+    def get_data(self):
+        return {'elements' : self.elements, 'pads' : self.pads,
+                'queries' : self.query_trees,
+                'preroll-time' : self.preroll_time}
+
+class GstTracerLineFormat(gsttracerengine.LineFormat):
+    ''' The GST_TRACER lines, named after their structure
+
+    Only the first buffer of each thread is decoded, the rest are of no
+    use to GstCapsNegoProcessor and are most of the lines of a log. The
+    --jobs workers send the records of the lines back, with the strings
+    of the caps they refer to once per chunk. '''
+
+    marker = 'GST_TRACER'
+
+    def __init__(self):
+        self.streaming_threads = set()
+        # caps_table id -> string of the caps in the records of the chunk
+        self.chunk_caps = {}
+        # caps id of the worker -> caps_table id, for the current chunk
+        self.caps_ids = {}
+
+    def decode(self, line, offset):
+        try:
+            tracer_line = GstTracerLine(line, offset)
+        except GstTracerLineParsingException, e:
+            return None
+        if tracer_line.is_buffer():
+            thread = tracer_line.get_raw_thread()
+            if thread in self.streaming_threads:
+                return None
+            self.streaming_threads.add(thread)
+        return tracer_line.name, tracer_line
+
+    def pack(self, tracer_line):
+        try:
+            record = tracer_line.get_record()
+        except GstTracerLineParsingException, e:
+            # raised again by the handlers, as in a serial pass
+            return tracer_line
+        for caps_id in record[13:15]:
+            if caps_id is not None:
+                self.chunk_caps[caps_id] = caps_table.get_string(caps_id)
+        return record
+
+    def get_chunk_state(self):
+        return self.chunk_caps
+
+    def set_chunk_state(self, chunk_caps):
+        self.caps_ids = dict([(caps_id, caps_table.get_string_id(string))
+                              for caps_id, string in chunk_caps.iteritems()])
+
+    def unpack(self, record):
+        if isinstance(record, GstTracerLine):
+            return record
+        filtercaps, querycaps = record[13:15]
+        if filtercaps is not None or querycaps is not None:
+            record = record[:13] + (self.caps_ids.get(filtercaps),
+                                    self.caps_ids.get(querycaps), record[15])
+        return GstTracerRecordLine(record)
+
+# Structure names of the lines GstCapsNegoProcessor is fed
+TRACER_LINE_NAMES = ('new-element', 'new-pad', 'query', 'message', 'event',
+                     'buffer', 'buffer-list')
+
+# Bumped whenever the cached rows change
+CACHE_VERSION = 5
+
+CACHE_SCHEMA = {
+    'negotiation_events' : 'offset INTEGER, kind TEXT, time TEXT, name TEXT, ix INTEGER, '
+                           'thread INTEGER, ts INTEGER, element INTEGER, '
+                           'pad INTEGER, peer_element INTEGER, peer_pad INTEGER, '
+                           'have_res INTEGER, res INTEGER, filter INTEGER, '
+                           'caps INTEGER, result INTEGER',
+    'negotiation_caps' : 'id INTEGER, string TEXT',
+    # the sparse index, see GstTracerLogIndexWriter
+    'negotiation_index' : 'offset INTEGER, resume INTEGER, resume_row INTEGER, '
+                          'min_ts INTEGER, max_ts INTEGER',
+    'negotiation_names' : 'kind TEXT, ix INTEGER, name TEXT',
+    'negotiation_prerolls' : 'ts INTEGER, row INTEGER',
+    'negotiation_threads' : 'thread INTEGER, ts INTEGER',
+}
 
-    # Each thread will maintain the current GstCapsQueryTree running in it
-    # until it is closed, then it is removed
-    threads = {}
-    query_trees = []
-    elements = {}
-    pads = {}
-    preroll_time = 0
+# Bytes of log between the checkpoints of the sparse index
+INDEX_SEGMENT_BYTES = 1 << 20
+
+class GstTracerLineCacheWriter(object):
+    ''' Stores the lines fed to a GstCapsNegoProcessor in the event cache '''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.caps_count = 0
+
+    def _store_caps(self, caps_id):
+        # new caps are stored the first time they are referred to
+        while caps_id is not None and self.caps_count <= caps_id:
+            self.writer.add('negotiation_caps',
+                            (self.caps_count, caps_table.get_string(self.caps_count)))
+            self.caps_count += 1
+
+    def add_line(self, tracer_line):
+        row = tracer_line.get_record()
+        self._store_caps(row[13])
+        self._store_caps(row[14])
+        self.writer.add('negotiation_events', row)
+
+    def commit(self):
+        self.writer.commit()
+
+class GstTracerLogIndexWriter(object):
+    ''' Builds the sparse index of a log while it is cached
+
+    The log is split in segments of about INDEX_SEGMENT_BYTES, each stored
+    with the range of ts of its lines and the offset and cache row of the
+    oldest query tree still open when it starts: a window is read from
+    there so the lines of each thread are paired as in a full pass. The
+    element and pad names, the pipeline prerolls and the streaming threads
+    are stored for the whole log, as the lines they come from are usually
+    before the window. '''
+
+    def __init__(self, writer, processor):
+        self.writer = writer
+        self.processor = processor
+        # cached lines so far, the rowid of the next one is row + 1
+        self.row = 0
+        # thread -> (offset, row) of the root of its open tree
+        self.roots = {}
+        self.segment = None
+        self.next_offset = 0
+        # (ts, row) of the pipeline prerolls
+        self.prerolls = []
+
+    def add_line(self, tracer_line, cached):
+        ''' Called for every line after the processor, cached tells whether
+        it was stored in the event cache '''
+        if tracer_line.offset >= self.next_offset:
+            self._start_segment(tracer_line.offset)
+        if not cached:
+            return
+        if tracer_line.is_query():
+            thread = tracer_line.get_thread()
+            tree = self.processor.threads.get(thread)
+            if tree is None:
+                self.roots.pop(thread, None)
+            elif tree.root.queryline.offset == tracer_line.offset:
+                self.roots[thread] = (tracer_line.offset, self.row)
+        elif len(self.processor.preroll_times) > len(self.prerolls):
+            self.prerolls.append((self.processor.preroll_time, self.row))
+        if not (tracer_line.is_new_element() or tracer_line.is_new_pad()):
+            ts = tracer_line.ts
+            segment = self.segment
+            if segment[3] is None or ts < segment[3]:
+                segment[3] = ts
+            if segment[4] is None or ts > segment[4]:
+                segment[4] = ts
+        self.row += 1
+
+    def _start_segment(self, offset):
+        if self.segment:
+            self.writer.add('negotiation_index', tuple(self.segment))
+        resume, resume_row = min(self.roots.values()) if self.roots else (offset, self.row)
+        self.segment = [offset, resume, resume_row, None, None]
+        self.next_offset = offset + INDEX_SEGMENT_BYTES
+
+    def commit(self):
+        if self.segment:
+            self.writer.add('negotiation_index', tuple(self.segment))
+        for kind, names in (('element', self.processor.elements), ('pad', self.processor.pads)):
+            for ix, name in names.iteritems():
+                self.writer.add('negotiation_names', (kind, ix, name))
+        for preroll in self.prerolls:
+            self.writer.add('negotiation_prerolls', preroll)
+        for thread, ts in self.processor.streaming_threads.iteritems():
+            self.writer.add('negotiation_threads', (thread, ts))
+
+def load_cached_lines(cache, first_row=None):
+    ''' Rebuilds the GstTracerLines stored by GstTracerLineCacheWriter,
+    from the one with rowid first_row on if given '''
+    caps = {}
+    for caps_id, string in cache.rows('negotiation_caps'):
+        caps[caps_id] = gsttracerparser.Caps(string)
+
+    for row in cache.rows('negotiation_events', first_row):
+        yield GstTracerLine.from_structure(row[2], _structure_from_record(row, caps.get), row[0])
+
+def process_cached_window(cache, window, processor):
+    ''' Feeds processor with the cached lines needed for the trees that
+    start in window, located with the sparse index '''
+    segments = list(cache.rows('negotiation_index'))
+    first, end = gsttracerwindow.find_segments([x[3:] for x in segments], window)
+    end_offset = segments[end][0] if end < len(segments) else None
+
+    # the state built by the lines before the window
+    for kind, ix, name in cache.rows('negotiation_names'):
+        if kind == 'element':
+            processor.elements[ix] = name
+        else:
+            processor.pads[ix] = name
+    for thread, ts in cache.rows('negotiation_threads'):
+        processor.streaming_threads[thread] = ts
+    resume_row = segments[first][2] if segments else 0
+    for ts, row in cache.rows('negotiation_prerolls'):
+        if row < resume_row:
+            processor.preroll_times.append(ts)
+            processor.preroll_time = ts
+
+    if segments:
+        for tracer_line in load_cached_lines(cache, resume_row + 1):
+            if end_offset is not None and tracer_line.offset >= end_offset:
+                # only the trees that started in the window are completed
+                start = processor.get_open_trees_start()
+                if start is None or start > window.end:
+                    break
+            processor.add_line(tracer_line)
+
+class GstCapsNegoAnalyzer(object):
+    ''' Feeds processor from a gsttracerengine.GstTracerEngine
+
+    When the cache of the log is valid the lines are loaded from it once
+    the engine is done, only the part around window if it is bounded,
+    otherwise the lines the engine dispatches are cached as they are fed.
+    The data of the processor is in data after finish(). '''
+
+    def __init__(self, processor, window=None):
+        self.processor = processor
+        self.window = window
+        self.cache = None
+        self.cached = False
+        self.cache_writer = None
+        self.index_writer = None
+        self.data = None
+
+    def register(self, engine):
+        self.cache = engine.cache
+        if self.cache and self.cache.is_valid('negotiation', CACHE_VERSION):
+            self.cached = True
+            return
+        writer = self.cache.writer('negotiation', CACHE_VERSION, CACHE_SCHEMA) \
+                 if self.cache else None
+        if writer:
+            self.cache_writer = GstTracerLineCacheWriter(writer)
+            self.index_writer = GstTracerLogIndexWriter(writer, self.processor)
+        for name in TRACER_LINE_NAMES:
+            engine.add_handler(GstTracerLineFormat, name, self.add_line)
+
+    def add_line(self, tracer_line):
+        processor = self.processor
+        try:
+            new_thread = processor.is_new_streaming_thread(tracer_line)
+            processor.add_line(tracer_line)
+            if self.cache_writer:
+                cached = new_thread or is_relevant_line(tracer_line)
+                if cached:
+                    self.cache_writer.add_line(tracer_line)
+                self.index_writer.add_line(tracer_line, cached)
+        except GstTracerLineParsingException, e:
+            pass
+
+    def finish(self):
+        if self.cached:
+            if self.window and self.window.is_bounded():
+                process_cached_window(self.cache, self.window, self.processor)
+            else:
+                for tracer_line in load_cached_lines(self.cache):
+                    self.processor.add_line(tracer_line)
+        elif self.cache_writer:
+            self.index_writer.commit()
+            self.cache_writer.commit()
+        self.data = _window_data(self.processor, self.window)
+
+def process_file(input_file, jobs=1, use_cache=True, tree_callback=None, processor=None,
+                 window=None):
+    ''' Feeds the log to processor, a new GstCapsNegoProcessor with
+    tree_callback when not given, and returns its data
+
+    With a gsttracerwindow.TimeWindow and a valid cache only the part of
+    the log around the window is read, the trees outside of it are still
+    to be filtered out with processor.tree_filter. '''
+    if processor is None:
+        processor = GstCapsNegoProcessor(tree_callback)
+    analyzer = GstCapsNegoAnalyzer(processor, window)
+    engine = gsttracerengine.GstTracerEngine(input_file, jobs, use_cache)
+    engine.add_analyzer(analyzer)
+    engine.run()
+    return analyzer.data
+
+def _window_data(processor, window):
+    data = processor.get_data()
+    if window and window.end is not None:
+        # the preroll seen by the window is the last one before its end
+        prerolls = [x for x in processor.preroll_times if x <= window.end]
+        data['preroll-time'] = prerolls[-1] if prerolls else 0
+    return data
+
+def follow_lines(f, wait, partial=''):
+    ''' Yields the lines of f as they are written, partial is the start
+    of the first one if it was already read
+
+    When wait is set the end of the file is polled for new data, otherwise
+    the lines are yielded until EOF, as is the case for pipes. '''
+    while True:
+        line = f.readline()
+        if not line:
+            if not wait:
+                return
+            time.sleep(FOLLOW_POLL_INTERVAL)
+            continue
+        if not line.endswith('\n'):
+            # the writer is in the middle of this line
+            partial += line
+            continue
+        yield partial + line
+        partial = ''
+
+def follow_file(input_file, processor):
+    ''' Feeds processor with the lines of a growing file, or stdin for '-'
+
+    Compressed logs can't be followed, gsttracerinput.LogInputException
+    is raised for them. '''
+    if input_file == '-':
+        f, wait, offset = sys.stdin, False, None
+    else:
+        f, wait, offset = open(input_file, 'rb'), True, 0
+    head, newline, partial = gsttracerinput.read_plain_prefix(f).rpartition('\n')
+    lines = follow_lines(f, wait, partial)
+    if newline:
+        # lines shorter than the magic bytes, not tracer ones
+        lines = itertools.chain([head + newline], lines)
+    for line in lines:
+        try:
+            processor.add_line(GstTracerLine(line, offset))
+        except GstTracerLineParsingException, e:
+            pass
+        if offset is not None:
+            offset += len(line)
+
+class GstCapsQueryTreeFilter(object):
+    ''' Selects the trees whose root starts in window and, if given, that
+    have a query on the element and pad with those names '''
+
+    def __init__(self, processor, window, element=None, pad=None):
+        self.processor = processor
+        self.window = window
+        self.element = element
+        self.pad = pad
 
-    with open(input_file, 'r') as f:
-        for line in f:
-            try:
-                tracer_line = GstTracerLine(line)
-            except GstTracerLineParsingException, e:
+    def _matches(self, node):
+        query = node.queryline
+        return (self.element is None or
+                self.processor.elements.get(query.get_query_origin()) == self.element) and \
+               (self.pad is None or
+                self.processor.pads.get(query.get_query_origin_pad()) == self.pad)
+
+    def matches_event(self, ts, element, pad):
+        ''' Whether an invalidating event or message is in window and, if
+        given, on the element and pad with those names. A message has no
+        pad, it is on all the pads of its element. '''
+        if not self.window.contains(ts):
+            return False
+        return (self.element is None or
+                self.processor.elements.get(element) == self.element) and \
+               (self.pad is None or pad is None or
+                self.processor.pads.get(pad) == self.pad)
+
+    def __call__(self, tree):
+        if not self.window.contains(tree.root.queryline.ts):
+            return False
+        if self.element is None and self.pad is None:
+            return True
+        for node in tree.traverse():
+            if self._matches(node):
+                return True
+        return False
+
+class GstCapsQuerySummary(object):
+    ''' Per pad stats and totals, updated one closed tree at a time '''
+
+    def __init__(self):
+        self.pads = {}
+        self.tree_count = 0
+        self.query_count = 0
+        self.total_time = 0
+
+    def add_tree(self, tree):
+        self.tree_count += 1
+        self.query_count += tree.node_count
+        self.total_time += tree.get_total_time()
+        for node in tree.traverse():
+            elem = node.queryline.get_query_origin()
+            pad = node.queryline.get_query_origin_pad()
+            data = self.pads.get((elem,pad))
+            if data is None:
+                data = self.pads[(elem,pad)] = GstCapsQueryPadStats(elem,pad)
+            data.add_node(node)
+
+    def print_summary(self, preroll_time):
+        print
+        print '=== STATS ==='
+        for k in self.pads.keys():
+            print gen_element_pad_name(k[0], k[1])
+            print self.pads[k].get_pretty_string(4)
+            print
+
+        print '=== TOTALS ==='
+        print 'Total query trees:', self.tree_count
+        print 'Total queries:', self.query_count
+        print 'Total time: %dns' % self.total_time
+        print 'Preroll time: %dns' % preroll_time
+
+    def print_self_time(self):
+        ''' Prints the pads ranked by the time spent in their own query
+        handling, excluding the queries they made to other pads '''
+        print
+        print '=== SELF TIME ==='
+        for stats in sorted(self.pads.values(), key=lambda x: x.self_time, reverse=True):
+            print '%s - self: %dns total: %dns queries: %d' % (
+                gen_element_pad_name(stats.elem, stats.pad), stats.self_time,
+                stats.total_time, stats.count)
+
+class GstCapsQueryFoldedStacks(object):
+    ''' Self time of the queries aggregated by their chain of element:pad
+    ancestors, to be written as folded stacks for flamegraph tools '''
+
+    def __init__(self):
+        # tuple of (element, pad) from the root to the node -> self time
+        self.stacks = collections.OrderedDict()
+
+    def add_tree(self, tree):
+        nodes = [(tree.root, ())]
+        while nodes:
+            node, parent_stack = nodes.pop()
+            if not node.res_queryline:
                 continue
+            stack = parent_stack + ((node.queryline.get_query_origin(),
+                                     node.queryline.get_query_origin_pad()),)
+            self.stacks[stack] = self.stacks.get(stack, 0) + node.get_self_time()
+            nodes.extend([(c, stack) for c in reversed(node.children)])
+
+    def write(self, out):
+        for stack, self_time in self.stacks.iteritems():
+            out.write('%s %d\n' % (';'.join(['%s:%s' % (get_element_name(elem), get_pad_name(pad))
+                                             for elem, pad in stack]),
+                                   max(self_time, 0)))
+
+class GstCapsQuerySlowestTrees(object):
+    ''' Keeps the count query trees with the highest total time '''
+
+    def __init__(self, count):
+        self.count = count
+        self.heap = []
+        self.seq = 0
+
+    def add_tree(self, tree):
+        # seq breaks ties so trees are never compared
+        item = (tree.get_total_time(), self.seq, tree)
+        self.seq += 1
+        if len(self.heap) < self.count:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def get_trees(self):
+        return [x[2] for x in sorted(self.heap, reverse=True)]
+
+class GstCapsQueryThreadStats(object):
+    ''' The caps query trees run by a thread '''
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.count = 0
+        self.busy_time = 0
+        self.longest = 0
+        # bit length of the total time -> trees, bucket n holds the trees
+        # that took [2^(n-1), 2^n) ns
+        self.histogram = collections.defaultdict(int)
+
+    def add_tree(self, tree):
+        total_time = tree.get_total_time()
+        self.count += 1
+        self.busy_time += total_time
+        self.longest = max(self.longest, total_time)
+        self.histogram[total_time.bit_length()] += 1
+
+class GstCapsQueryThreadTimeline(object):
+    ''' How the caps query trees are spread over the threads
+
+    A thread is busy from the start to the end of each of its trees. The
+    busy intervals of all threads are swept in ts order to tell for how
+    long each number of threads was negotiating at once, overall and in
+    slices of slice ns, which shows whether the streams negotiate in
+    parallel or one after the other. As in GstCapsQueryCacheSimulator the
+    interval ends wait until no tree still open in processor can start
+    before them, or at most STALE_TREE_TIME, so only the ones around the
+    open trees are kept. The ends of a stale tree that still closes are
+    swept late, from the last ts swept. '''
+
+    def __init__(self, processor, slice, count):
+        self.processor = processor
+        self.slice = slice
+        self.threads = {}
+        self.stalls = GstCapsQuerySlowestTrees(count)
+        # heap of (ts, +1 for a tree start or -1 for its end)
+        self.pending = []
+        self.busy_threads = 0
+        self.last_ts = None
+        self.first_ts = None
+        # busy threads -> time, from the first tree start on
+        self.concurrency = collections.defaultdict(int)
+        # slice index -> [busy thread time, most busy threads]
+        self.slices = {}
+
+    def add_tree(self, tree):
+        thread = tree.root.queryline.thread
+        stats = self.threads.get(thread)
+        if stats is None:
+            stats = self.threads[thread] = GstCapsQueryThreadStats(thread)
+        stats.add_tree(tree)
+        self.stalls.add_tree(tree)
+        start = tree.root.queryline.ts
+        heapq.heappush(self.pending, (start, 1))
+        heapq.heappush(self.pending, (start + tree.get_total_time(), -1))
+        self.flush(self.processor.get_replay_ts())
+
+    def flush(self, until=None):
+        ''' Sweeps the pending interval ends older than until, all if None '''
+        while self.pending and (until is None or self.pending[0][0] < until):
+            ts, delta = heapq.heappop(self.pending)
+            if self.last_ts is None:
+                self.first_ts = ts
+            else:
+                ts = max(ts, self.last_ts)
+                self._add_time(self.last_ts, ts)
+            self.busy_threads += delta
+            self.last_ts = ts
+
+    def _add_time(self, start, end):
+        busy_threads = self.busy_threads
+        self.concurrency[busy_threads] += end - start
+        if not busy_threads:
+            return
+        while start < end:
+            index = start / self.slice
+            slice_end = min(end, (index + 1) * self.slice)
+            data = self.slices.get(index)
+            if data is None:
+                data = self.slices[index] = [0, 0]
+            data[0] += busy_threads * (slice_end - start)
+            data[1] = max(data[1], busy_threads)
+            start = slice_end
+
+    def print_report(self):
+        self.flush()
+        span = self.last_ts - self.first_ts if self.last_ts is not None else 0
+        print
+        print '=== QUERY THREADS ==='
+        for stats in sorted(self.threads.values(), key=lambda x: x.busy_time, reverse=True):
+            print '0x%x - trees: %d busy: %dns (%.1f%%) longest: %dns' % (
+                stats.thread, stats.count, stats.busy_time,
+                100.0 * stats.busy_time / span if span else 0, stats.longest)
+            for bucket in sorted(stats.histogram):
+                print '    [%d, %d)ns: %d' % (1 << bucket >> 1, 1 << bucket,
+                                              stats.histogram[bucket])
+
+        print
+        print '=== QUERY THREAD CONCURRENCY ==='
+        for busy_threads in sorted(self.concurrency):
+            print '%d threads: %dns (%.1f%%)' % (busy_threads, self.concurrency[busy_threads],
+                                                100.0 * self.concurrency[busy_threads] / span
+                                                if span else 0)
+        busy_time = sum([s.busy_time for s in self.threads.itervalues()])
+        negotiating = span - self.concurrency.get(0, 0)
+        print 'Mean busy threads while negotiating: %.2f' % \
+              (float(busy_time) / negotiating if negotiating else 0)
+
+        print
+        print '=== QUERY THREAD CONCURRENCY OVER TIME (%dns slices) ===' % self.slice
+        for index in sorted(self.slices):
+            busy, peak = self.slices[index]
+            print '%s - busy: %dns mean threads: %.2f peak threads: %d' % (
+                _format_debug_time(index * self.slice), busy, float(busy) / self.slice, peak)
+
+        print
+        print '=== LONGEST QUERY THREAD STALLS ==='
+        for tree in self.stalls.get_trees():
+            query = tree.root.queryline
+            print '0x%x at %s - %dns in %s on %s, %d queries' % (
+                query.thread, query.time, tree.get_total_time(), tree.root.query_name,
+                gen_element_pad_name(query.get_query_origin(), query.get_query_origin_pad()),
+                tree.node_count)
+
+class GstCapsQueryLatency(object):
+    ''' Distribution of the time taken by the queries of each pad, per
+    query kind '''
+
+    def __init__(self):
+        self.stats = gsttracerstats.DurationStats()
+
+    def add_tree(self, tree):
+        for node in tree.traverse():
+            if node.res_queryline:
+                query = node.queryline
+                self.stats.add((query.get_query_origin(), query.get_query_origin_pad(),
+                                node.query_name), node.get_total_time())
+
+    def print_report(self):
+        print
+        print '=== QUERY LATENCY ==='
+        summaries = self.stats.summarize()
+        for summary in sorted(summaries, key=lambda x: x.total, reverse=True):
+            elem, pad, query_name = summary.key
+            gsttracerstats.write_summary(sys.stdout, '%s %s' % (
+                gen_element_pad_name(elem, pad), query_name), summary)
+
+# Name of the saved --approx sketches
+SKETCH_TOOL = 'negotiation'
+
+class GstCapsQueryApproxSummary(object):
+    ''' The --approx counterpart of GstCapsQuerySummary and
+    GstCapsQueryLatency, its memory does not grow with the number of
+    queries
+
+    It still grows with the number of distinct pads, as do the element
+    and pad names of the processor, and with the number of distinct caps,
+    which are all kept in caps_table: a log of a pipeline that keeps
+    creating elements or negotiating new caps is not read in constant
+    memory.
+
+    The per pad counts and times are exact. The query times are kept in
+    quantile sketches, the (filter, caps, result) of the caps queries of
+    the pads in a count-min sketch and count of the trees are picked at
+    random to be printed, see gsttracersketch for the error bounds. Pads
+    go by the names of their element and pad, so that the summaries of
+    different logs can be merged. '''
+
+    def __init__(self, processor, count):
+        self.processor = processor
+        # (element, pad) -> 'element:pad'
+        self.pad_names = {}
+        # 'element:pad' -> [queries, total time, self time]
+        self.pads = collections.OrderedDict()
+        self.latency = gsttracersketch.DurationSketches()
+        # items are [pad, filter, caps, result]
+        self.repeated = gsttracersketch.FrequentItems()
+        # the trees, then their text once closed
+        self.sample = gsttracersketch.ReservoirSample(count)
+        self.tree_count = 0
+        self.query_count = 0
+        self.total_time = 0
+        # logs read, by this summary and the merged ones
+        self.logs = 0
+
+    def _get_pad_name(self, query):
+        key = (query.get_query_origin(), query.get_query_origin_pad())
+        name = self.pad_names.get(key)
+        if name is None:
+            elem, pad = key
+            name = self.pad_names[key] = '%s:%s' % (
+                self.processor.elements.get(elem, '--%s--' % elem),
+                self.processor.pads.get(pad, '--%s--' % pad))
+        return name
+
+    def add_tree(self, tree):
+        self.tree_count += 1
+        self.query_count += tree.node_count
+        self.total_time += tree.get_total_time()
+        self.sample.add(tree)
+        for node in tree.traverse():
+            res = node.res_queryline
+            if not res:
+                continue
+            name = self._get_pad_name(node.queryline)
+            data = self.pads.get(name)
+            if data is None:
+                data = self.pads[name] = [0, 0, 0]
+            total_time = node.get_total_time()
+            data[0] += 1
+            data[1] += total_time
+            data[2] += node.get_self_time()
+            self.latency.add((name, node.query_name), total_time)
+
+            if node.is_caps_query():
+                key_hash = gsttracersketch.stable_hash('%s %x %x %d' % (
+                    name, caps_table.get_class_hash(res.filter),
+                    caps_table.get_class_hash(res.caps), res.res))
+                self.repeated.add(key_hash, [name, caps_table.get_string(res.filter),
+                                             caps_table.to_string(res.caps), res.res])
+
+    def close(self):
+        ''' Called once the log has been read and the names of the
+        elements and pads are known, the sampled trees are replaced by
+        their text '''
+        self.logs += 1
+        self.sample.items = [x if isinstance(x, str) else x.get_pretty_string()
+                             for x in self.sample.items]
+
+    def get_state(self):
+        ''' The state to save with gsttracersketch.save(), once closed '''
+        return {'pads' : self.pads.items(), 'latency' : self.latency.to_dict(),
+                'repeated' : self.repeated.to_dict(), 'sample' : self.sample.to_dict(),
+                'trees' : self.tree_count, 'queries' : self.query_count,
+                'total-time' : self.total_time, 'logs' : self.logs}
+
+    def merge_state(self, state):
+        ''' Adds the state saved from another summary '''
+        for name, counts in state['pads']:
+            data = self.pads.get(name)
+            if data is None:
+                data = self.pads[name] = [0, 0, 0]
+            for i, value in enumerate(counts):
+                data[i] += value
+        self.latency.merge(gsttracersketch.DurationSketches.from_dict(state['latency']))
+        self.repeated.merge(gsttracersketch.FrequentItems.from_dict(state['repeated']))
+        self.sample.merge(gsttracersketch.ReservoirSample.from_dict(state['sample']))
+        self.tree_count += state['trees']
+        self.query_count += state['queries']
+        self.total_time += state['total-time']
+        self.logs += state['logs']
+
+    def print_summary(self, preroll_time):
+        print
+        print '=== SAMPLED QUERY TREES (%d of %d) ===' % (len(self.sample.items),
+                                                         self.sample.seen)
+        for text in self.sample.items:
+            print text
+            print
+
+        print '=== STATS ==='
+        for name, (count, total_time, self_time) in self.pads.iteritems():
+            print '%s - queries: %d total: %dns' % (name, count, total_time)
+
+        print
+        print '=== MOST REPEATED CAPS QUERIES (counts over by up to %d) ===' % \
+              self.repeated.get_error()
+        for count, (name, filtercaps, caps, result) in self.repeated.get_top():
+            print name
+            print '    filter: ' + (filtercaps or '--')
+            print '    caps: ' + caps
+            print '    res: ' + str(bool(result))
+            print '    Repeated: %d' % count
+            print
+
+        print '=== QUERY LATENCY (within %g%%) ===' % (self.latency.relative_accuracy * 100)
+        for summary in sorted(self.latency.summarize(), key=lambda x: x.total, reverse=True):
+            gsttracerstats.write_summary(sys.stdout, '%s %s' % summary.key, summary)
+
+        print
+        print '=== TOTALS ==='
+        if self.logs > 1:
+            print 'Logs:', self.logs
+        print 'Total query trees:', self.tree_count
+        print 'Total queries:', self.query_count
+        print 'Total time: %dns' % self.total_time
+        if preroll_time is not None:
+            print 'Preroll time: %dns' % preroll_time
+
+    def print_self_time(self):
+        print
+        print '=== SELF TIME ==='
+        for name, (count, total_time, self_time) in sorted(self.pads.items(),
+                                                           key=lambda x: x[1][2],
+                                                           reverse=True):
+            print '%s - self: %dns total: %dns queries: %d' % (name, self_time,
+                                                              total_time, count)
+
+# Bytes counted for each cached query on top of its filter and result caps
+# strings: the hash table entry, the key and the refs to the caps
+CAPS_CACHE_ENTRY_OVERHEAD = 64
+
+CAPS_CACHE_POLICIES = ('lru', 'lfu')
+
+class GstCapsQueryPadCache(object):
+    ''' Model of a cache of caps query results on a pad, keyed by the filter '''
+
+    def __init__(self, capacity, policy):
+        self.capacity = capacity
+        self.policy = policy
+        # filter class -> [(result caps class, res), uses, bytes]
+        self.entries = collections.OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.saved_time = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self.peak_bytes = 0
+
+    def lookup(self, node):
+        ''' Returns True if the cache had the result of the query node '''
+        query = node.queryline
+        res = node.res_queryline
+        key = caps_table.get_class(query.filter)
+        result = (caps_table.get_class(res.caps), res.res)
+        self.lookups += 1
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[1] += 1
+            if self.policy == 'lru':
+                del self.entries[key]
+                self.entries[key] = entry
+            if entry[0] == result:
+                self.hits += 1
+                self.saved_time += node.get_total_time()
+                return True
+            # the cache would have answered with outdated caps, the
+            # query is made and its result replaces the entry
+            self.stale_hits += 1
+            entry[0] = result
+            self._set_bytes(entry, query, res)
+            return False
+
+        if len(self.entries) >= self.capacity:
+            if self.policy == 'lru':
+                victim = self.entries.popitem(last=False)[1]
+            else:
+                # the oldest of the least used ones
+                victim_key = min(self.entries, key=lambda k: self.entries[k][1])
+                victim = self.entries.pop(victim_key)
+            self.bytes -= victim[2]
+        entry = self.entries[key] = [result, 1, 0]
+        self._set_bytes(entry, query, res)
+        return False
+
+    def _set_bytes(self, entry, query, res):
+        size = CAPS_CACHE_ENTRY_OVERHEAD + \
+               len(caps_table.get_string(query.filter) or '') + \
+               len(caps_table.get_string(res.caps) or '')
+        self.bytes += size - entry[2]
+        entry[2] = size
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+
+    def invalidate(self):
+        if self.entries:
+            self.invalidations += 1
+            self.entries.clear()
+            self.bytes = 0
+
+class GstCapsQueryCacheSimulator(object):
+    ''' Replays the caps queries through a GstCapsQueryPadCache on each pad
+
+    Queries and invalidations are replayed in ts order: closed trees and
+    events wait until no tree still open in processor can have older
+    queries, or at most STALE_TREE_TIME. A query answered by the cache
+    would not have made the queries below it, those are skipped. '''
+
+    def __init__(self, processor, policy, capacity):
+        self.processor = processor
+        self.policy = policy
+        self.capacity = capacity
+        self.pads = collections.OrderedDict()
+        self.element_pads = {}
+        # heap of (ts, seq, query node or (element, pad) invalidation)
+        self.pending = []
+        self.seq = 0
+        # thread -> ts until which its queries are below a cache hit
+        self.skip_until = {}
+
+    def _push(self, ts, item):
+        heapq.heappush(self.pending, (ts, self.seq, item))
+        self.seq += 1
+
+    def add_tree(self, tree):
+        for node in tree.traverse():
+            if node.is_caps_query() and node.res_queryline:
+                self._push(node.queryline.ts, node)
+        self.flush(self.processor.get_replay_ts())
+
+    def add_event(self, tracer_line):
+        element = tracer_line.get_element_ix()
+        pad = tracer_line.structure.get_value('pad-ix') if tracer_line.is_event() else None
+        # the events outside the trees' window are left out as well, the
+        # cached runs only read the log around it
+        tree_filter = self.processor.tree_filter
+        if tree_filter and not tree_filter.matches_event(tracer_line.ts, element, pad):
+            return
+        self._push(tracer_line.ts, (element, pad))
+        self.flush(self.processor.get_replay_ts())
+
+    def flush(self, until=None):
+        ''' Replays the pending items older than until, all if None '''
+        while self.pending and (until is None or self.pending[0][0] < until):
+            ts, seq, item = heapq.heappop(self.pending)
+            if isinstance(item, tuple):
+                self._invalidate(*item)
+            else:
+                self._query(ts, item)
+
+    def _query(self, ts, node):
+        query = node.queryline
+        if ts < self.skip_until.get(query.thread, 0):
+            return
+        key = (query.get_query_origin(), query.get_query_origin_pad())
+        cache = self.pads.get(key)
+        if cache is None:
+            cache = self.pads[key] = GstCapsQueryPadCache(self.capacity, self.policy)
+            self.element_pads.setdefault(key[0], []).append(key)
+        if cache.lookup(node):
+            self.skip_until[query.thread] = node.res_queryline.ts
+
+    def _invalidate(self, element, pad):
+        if pad is not None:
+            keys = [(element, pad)]
+        else:
+            keys = self.element_pads.get(element, [])
+        for key in keys:
+            cache = self.pads.get(key)
+            if cache:
+                cache.invalidate()
+
+    def print_report(self):
+        self.flush()
+        print
+        print '=== CAPS QUERY CACHE SIMULATION (%s, %d entries per pad) ===' % \
+              (self.policy, self.capacity)
+        for key, cache in sorted(self.pads.items(), key=lambda x: x[1].saved_time,
+                                 reverse=True):
+            print '%s - lookups: %d hits: %d (%.1f%%) stale hits: %d ' \
+                  'invalidations: %d saved: %dns memory: %d bytes' % (
+                gen_element_pad_name(key[0], key[1]), cache.lookups, cache.hits,
+                100.0 * cache.hits / cache.lookups, cache.stale_hits,
+                cache.invalidations, cache.saved_time, cache.peak_bytes)
+
+        print
+        print '=== CAPS QUERY CACHE SAVINGS PER ELEMENT ==='
+        elements = []
+        for element, keys in self.element_pads.iteritems():
+            caches = [self.pads[k] for k in keys]
+            elements.append((sum([c.saved_time for c in caches]), element,
+                             sum([c.lookups for c in caches]),
+                             sum([c.hits for c in caches]),
+                             sum([c.peak_bytes for c in caches])))
+        for saved_time, element, lookups, hits, peak_bytes in sorted(elements, reverse=True):
+            print '%s(%s) - lookups: %d hits: %d (%.1f%%) saved: %dns memory: %d bytes' % (
+                get_element_name(element), element, lookups, hits,
+                100.0 * hits / lookups, saved_time, peak_bytes)
+
+        lookups = sum([c.lookups for c in self.pads.itervalues()])
+        hits = sum([c.hits for c in self.pads.itervalues()])
+        print
+        print 'Total lookups:', lookups
+        print 'Total hits: %d (%.1f%%)' % (hits, 100.0 * hits / lookups if lookups else 0)
+        print 'Total stale hits:', sum([c.stale_hits for c in self.pads.itervalues()])
+        print 'Total saved time: %dns' % sum([c.saved_time for c in self.pads.itervalues()])
+        print 'Total memory: %d bytes' % sum([c.peak_bytes for c in self.pads.itervalues()])
+
+class GstCapsQueryRule(object):
+    ''' Base class of the rules run by GstCapsQueryRuleEngine
+
+    check_node() is called for every closed query node in pre-order with
+    its depth in the tree (0 for the root) and check_tree() once for every
+    tree after its nodes. Findings are reported with engine.report(). '''
+
+    def check_node(self, engine, node, depth):
+        pass
 
-            if tracer_line.is_new_element():
-                elements[tracer_line.structure.get_value('ix')] = \
-                    tracer_line.structure.get_value('name')
-            elif tracer_line.is_new_pad():
-                pads[tracer_line.structure.get_value('ix')] = \
-                    tracer_line.structure.get_value('name')
-            elif tracer_line.is_query():
-                if not (tracer_line.is_query_type('caps') or \
-                        tracer_line.is_query_type('accept-caps')): continue
-
-                thread = tracer_line.get_thread()
-                if thread in threads:
-                    tree = threads[thread]
-                    tree.add_node(GstCapsQueryTreeNode(tracer_line))
-                    if tree.is_closed():
-                        query_trees.append(tree)
-                        del threads[thread]
-                else:
-                    tree = GstCapsQueryTree(GstCapsQueryTreeNode(tracer_line))
-                    threads[thread] = tree
-
-            elif tracer_line.is_message():
-                if tracer_line.is_message_type('async-done') and element_is_pipeline(tracer_line, elements):
-                    preroll_time = tracer_line.ts
-
-    return {'elements' : elements, 'pads' : pads, 'queries' : query_trees,
-            'preroll-time' : preroll_time}
+    def check_tree(self, engine, tree):
+        pass
+
+    def finish(self, engine):
+        pass
+
+class GstAcceptCapsQueryRule(GstCapsQueryRule):
+    ''' Caps queries on other elements made by an accept-caps, flagged by
+    GstCapsQueryTreeNode when the tree is built '''
+
+    def check_node(self, engine, node, depth):
+        if PERFORMANCE_ACCEPT_CAPS in node.issues:
+            engine.report(PERFORMANCE_ACCEPT_CAPS, node, node.get_total_time())
+
+class GstRepeatedQueryRule(GstCapsQueryRule):
+    ''' Queries repeated with the same caps on a pad within one tree, the
+    cost is the time of the repetitions '''
+
+    def __init__(self):
+        self.seen = set()
+
+    def check_node(self, engine, node, depth):
+        query = node.queryline
+        if node.is_caps_query():
+            caps = caps_table.get_class(query.filter)
+        else:
+            caps = caps_table.get_class(query.caps)
+        key = (query.get_query_origin(), query.get_query_origin_pad(), query.kind, caps)
+        if key in self.seen:
+            engine.report(PERFORMANCE_REPEATED_QUERY, node, node.get_total_time())
+        else:
+            self.seen.add(key)
+
+    def check_tree(self, engine, tree):
+        self.seen.clear()
+
+class GstQueryFanoutRule(GstCapsQueryRule):
+    ''' Queries with more than max_fanout child queries and trees deeper
+    than max_depth '''
+
+    def __init__(self, max_fanout, max_depth):
+        self.max_fanout = max_fanout
+        self.max_depth = max_depth
+        self.depth = 0
+
+    def check_node(self, engine, node, depth):
+        if len(node.children) > self.max_fanout:
+            engine.report(PERFORMANCE_QUERY_FANOUT, node, node.get_total_time())
+        self.depth = max(self.depth, depth + 1)
+
+    def check_tree(self, engine, tree):
+        if self.depth > self.max_depth:
+            engine.report(PERFORMANCE_QUERY_DEPTH, tree.root, tree.get_total_time())
+        self.depth = 0
+
+class GstStreamingThreadQueryRule(GstCapsQueryRule):
+    ''' Caps query trees run by a thread that pushed buffers, after the
+    pipeline prerolled '''
+
+    def check_tree(self, engine, tree):
+        root = tree.root
+        if not root.is_caps_query():
+            return
+        preroll_time = engine.processor.preroll_time
+        first_buffer = engine.processor.streaming_threads.get(root.queryline.thread)
+        if preroll_time and first_buffer is not None and \
+           root.queryline.ts > max(preroll_time, first_buffer):
+            engine.report(PERFORMANCE_STREAMING_QUERY, root, tree.get_total_time())
+
+class GstAcceptCapsStormRule(GstCapsQueryRule):
+    ''' More than max_rate accept-caps on a pad in the same second '''
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        # (element, pad, second) -> [count, total time, first node]
+        self.seconds = {}
+        self.last_second = 0
+
+    def check_node(self, engine, node, depth):
+        if not node.is_accept_caps_query():
+            return
+        query = node.queryline
+        second = query.ts / 1000000000
+        key = (query.get_query_origin(), query.get_query_origin_pad(), second)
+        data = self.seconds.get(key)
+        if data is None:
+            data = self.seconds[key] = [0, 0, node]
+        data[0] += 1
+        data[1] += node.get_total_time()
+        if second > self.last_second + 1:
+            # trees close out of ts order, but not by seconds
+            self.last_second = second
+            self.flush(engine, second - 1)
+
+    def flush(self, engine, before=None):
+        for key in self.seconds.keys():
+            if before is None or key[2] < before:
+                count, total_time, node = self.seconds.pop(key)
+                if count > self.max_rate:
+                    engine.report(PERFORMANCE_ACCEPT_CAPS_STORM, node, total_time, count)
+
+    def finish(self, engine):
+        self.flush(engine)
+
+class GstFilteredResultRule(GstCapsQueryRule):
+    ''' Caps queries with a filter that ended up with EMPTY caps, all the
+    work of the query was thrown away '''
+
+    def check_node(self, engine, node, depth):
+        if node.is_caps_query() and node.queryline.filter is not None and \
+           caps_table.is_empty(node.res_queryline.caps):
+            engine.report(PERFORMANCE_FILTERED_RESULT, node, node.get_total_time())
+
+class GstCapsQueryRuleEngine(object):
+    ''' Runs rules on the closed query trees
+
+    Findings are aggregated per issue and pad with their count and their
+    cost in ns, the first one of each is kept as an example. '''
+
+    def __init__(self, processor, rules):
+        self.processor = processor
+        self.rules = rules
+        # (issue, element, pad) -> [count, cost, first node]
+        self.findings = collections.OrderedDict()
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+
+    def report(self, issue, node, cost, count=1):
+        query = node.queryline
+        key = (issue, query.get_query_origin(), query.get_query_origin_pad())
+        data = self.findings.get(key)
+        if data is None:
+            data = self.findings[key] = [0, 0, node]
+        data[0] += count
+        data[1] += cost
+
+    def add_tree(self, tree):
+        nodes = [(tree.root, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            if not node.res_queryline:
+                continue
+            for rule in self.rules:
+                rule.check_node(self, node, depth)
+            nodes.extend([(c, depth + 1) for c in reversed(node.children)])
+        for rule in self.rules:
+            rule.check_tree(self, tree)
+
+    def print_findings(self):
+        for rule in self.rules:
+            rule.finish(self)
+        print
+        print '=== FINDINGS ==='
+        issues = collections.OrderedDict()
+        for key, data in self.findings.iteritems():
+            issues.setdefault(key[0], []).append((data[1], data[0], key[1], key[2], data[2]))
+        for issue, findings in sorted(issues.items(), key=lambda x: sum([f[0] for f in x[1]]),
+                                      reverse=True):
+            print '%s - count: %d cost: %dns' % (issue, sum([f[1] for f in findings]),
+                                                sum([f[0] for f in findings]))
+            for cost, count, elem, pad, node in sorted(findings, reverse=True):
+                print '    %s - count: %d cost: %dns first at: %s' % (
+                    gen_element_pad_name(elem, pad), count, cost, node.queryline.time)
+
+def default_rules(max_fanout, max_depth, max_accept_caps_rate):
+    return [GstAcceptCapsQueryRule(), GstRepeatedQueryRule(),
+            GstQueryFanoutRule(max_fanout, max_depth),
+            GstStreamingThreadQueryRule(),
+            GstAcceptCapsStormRule(max_accept_caps_rate),
+            GstFilteredResultRule()]
 
 def generate_per_pad_caps_query_summary(queries):
-    summary = {}
+    summary = GstCapsQuerySummary()
     for q in queries:
-       for node in q.traverse():
-           elem = node.queryline.get_query_origin()
-           pad = node.queryline.get_query_origin_pad()
-           if (elem,pad) not in summary:
-               summary[(elem,pad)] = GstCapsQueryPadStats(elem,pad)
-	   data = summary[(elem,pad)]
-           data.add_node(node)
-    return summary
+        summary.add_tree(q)
+    return summary.pads
 
 if __name__ == '__main__':
-    Gst.init()
-
-    input_file = sys.argv[1]
-
-    data = process_file (input_file)
+    parser = argparse.ArgumentParser(description='Analyzes caps negotiation from GST_TRACER logs')
+    parser.add_argument('input_file', nargs='?',
+                        help='GST_DEBUG log with GST_TRACER lines, '
+                             'can be gzip, xz or zstd compressed, '
+                             '\'-\' for stdin, can be left out with --approx-merge')
+    parser.add_argument('--gst-parser', action='store_true',
+                        help='parse the tracer structures with GStreamer (PyGObject)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes used to parse the log')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the %s sidecar cache' % \
+                             gsttracercache.CACHE_SUFFIX)
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='keep reading the log as it grows and print each '
+                             'query tree when it completes, stats are printed '
+                             'on EOF of stdin or on Ctrl+C, the log can not be '
+                             'compressed')
+    parser.add_argument('--stats-only', action='store_true',
+                        help='only keep the stats of the query trees and the '
+                             '--top slowest ones, so memory use does not grow '
+                             'with the log')
+    parser.add_argument('--approx', action='store_true',
+                        help='like --stats-only, with the per pad caps and query '
+                             'times kept in fixed size sketches and --top query '
+                             'trees picked at random, the query latency is printed '
+                             'with percentiles within 1%%; memory still grows with '
+                             'the number of distinct caps and of created elements '
+                             'and pads')
+    parser.add_argument('--approx-save', metavar='FILE',
+                        help='save the --approx sketches to FILE, implies --approx')
+    parser.add_argument('--approx-merge', metavar='FILE', action='append',
+                        help='merge the --approx sketches saved to FILE by another '
+                             'run, can be repeated, implies --approx')
+    parser.add_argument('--top', type=int, default=10,
+                        help='slowest query trees printed with --stats-only, trees '
+                             'sampled with --approx and longest stalls with '
+                             '--thread-stats (default: %(default)s)')
+    parser.add_argument('--self-time', action='store_true',
+                        help='print the pads ranked by the time spent in their '
+                             'own caps query handling')
+    parser.add_argument('--latency', action='store_true',
+                        help='print the count, mean, percentiles, max and log2 '
+                             'histogram of the query times of each pad')
+    parser.add_argument('--thread-stats', action='store_true',
+                        help='print how the query trees are spread over the '
+                             'threads and how many ran at once')
+    parser.add_argument('--thread-slice', type=int, default=100, metavar='MS',
+                        help='length of the slices the thread concurrency is '
+                             'reported in (default: %(default)s)')
+    parser.add_argument('--cache-sim', choices=CAPS_CACHE_POLICIES,
+                        help='replay the caps queries through a simulated '
+                             'per pad query cache with this eviction policy and '
+                             'report what it would have saved')
+    parser.add_argument('--cache-capacity', type=int, default=8,
+                        help='entries of each simulated pad cache '
+                             '(default: %(default)s)')
+    gsttracerwindow.add_arguments(parser)
+    parser.add_argument('--no-rules', action='store_true',
+                        help='do not look for performance issues in the query trees')
+    parser.add_argument('--max-fanout', type=int, default=8,
+                        help='queries a single query can make before it is '
+                             'reported (default: %(default)s)')
+    parser.add_argument('--max-depth', type=int, default=8,
+                        help='depth of a query tree before it is reported '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-accept-caps-rate', type=int, default=100,
+                        help='accept-caps per second on a pad before they are '
+                             'reported (default: %(default)s)')
+    parser.add_argument('--folded', metavar='FILE',
+                        help='write the self time of the queries as folded '
+                             'stacks (element:pad;element:pad;... ns) for '
+                             'flamegraph tools')
+    args = parser.parse_args()
+
+    if args.approx_save or args.approx_merge:
+        args.approx = True
+    if args.input_file is None and not args.approx_merge:
+        parser.error('an input file is needed unless --approx-merge is given')
+    if args.approx and args.latency:
+        parser.error('--approx already prints the query latency')
+    if args.input_file is not None:
+        try:
+            gsttracerinput.check_log(args.input_file)
+        except gsttracerinput.LogInputException, e:
+            parser.error(str(e))
+
+    if args.gst_parser:
+        if args.jobs > 1:
+            parser.error('--jobs can only be used with the python parser')
+        use_gst_backend()
+
+    input_file = args.input_file
+    folded = GstCapsQueryFoldedStacks() if args.folded else None
+
+    processor = GstCapsNegoProcessor()
+    window = gsttracerwindow.window_from_args(args)
+    if window.is_bounded() or args.element or args.pad:
+        processor.tree_filter = GstCapsQueryTreeFilter(processor, window,
+                                                       args.element, args.pad)
+    simulator = None
+    if args.cache_sim:
+        simulator = GstCapsQueryCacheSimulator(processor, args.cache_sim, args.cache_capacity)
+        processor.event_callback = simulator.add_event
+
+    latency = GstCapsQueryLatency() if args.latency else None
+    threads = None
+    if args.thread_stats:
+        threads = GstCapsQueryThreadTimeline(processor, args.thread_slice * 1000000, args.top)
+
+    rules = None
+    # without a log only the merged sketches are printed
+    if not args.no_rules and input_file is not None:
+        rules = GstCapsQueryRuleEngine(processor, default_rules(
+            args.max_fanout, args.max_depth, args.max_accept_caps_rate))
+
+    # fed with every tree as it is closed
+    tree_consumers = [x for x in (folded, latency, simulator, threads, rules) if x]
+
+    def print_results(summary, preroll_time):
+        summary.print_summary(preroll_time)
+        if args.self_time:
+            summary.print_self_time()
+        if latency:
+            latency.print_report()
+        if simulator:
+            simulator.print_report()
+        if threads:
+            threads.print_report()
+        if rules:
+            rules.print_findings()
+        if folded:
+            with open(args.folded, 'w') as f:
+                folded.write(f)
+
+    if args.follow or args.stats_only or args.approx:
+        # Closed trees are aggregated and released as they come
+        if args.approx:
+            summary = GstCapsQueryApproxSummary(processor, args.top)
+        else:
+            summary = GstCapsQuerySummary()
+        slowest = GstCapsQuerySlowestTrees(args.top) if args.stats_only else None
+
+        def tree_closed(tree):
+            summary.add_tree(tree)
+            for consumer in tree_consumers:
+                consumer.add_tree(tree)
+            if slowest:
+                slowest.add_tree(tree)
+            elif args.follow:
+                element_names.update(processor.elements)
+                pad_names.update(processor.pads)
+                print tree.get_pretty_string()
+                print
+                sys.stdout.flush()
+
+        processor.tree_callback = tree_closed
+        if input_file is None:
+            data = {'elements' : {}, 'pads' : {}, 'preroll-time' : None}
+        elif args.follow:
+            try:
+                follow_file(input_file, processor)
+            except KeyboardInterrupt:
+                pass
+            except (gsttracerinput.LogInputException, IOError), e:
+                sys.exit(str(e))
+            data = processor.get_data()
+        else:
+            try:
+                data = process_file (input_file, args.jobs, not args.no_cache,
+                                     processor=processor, window=window)
+            except (gsttracerinput.LogInputException, IOError), e:
+                sys.exit(str(e))
+        element_names.update(data['elements'])
+        pad_names.update(data['pads'])
+
+        if args.approx:
+            if input_file is not None:
+                summary.close()
+            try:
+                for path in args.approx_merge or []:
+                    summary.merge_state(gsttracersketch.load(path, SKETCH_TOOL))
+            except gsttracersketch.SketchException, e:
+                sys.exit(str(e))
+            if args.approx_save:
+                gsttracersketch.save(args.approx_save, SKETCH_TOOL, summary.get_state())
+
+        if slowest:
+            print '=== SLOWEST QUERY TREES ==='
+            for t in slowest.get_trees():
+                print t.get_pretty_string()
+                print
+
+        print_results(summary, data['preroll-time'])
+        sys.exit(0)
+
+    if tree_consumers:
+        def tree_closed(tree):
+            processor.query_trees.append(tree)
+            for consumer in tree_consumers:
+                consumer.add_tree(tree)
+        processor.tree_callback = tree_closed
+
+    try:
+        data = process_file (input_file, args.jobs, not args.no_cache, processor=processor,
+                             window=window)
+    except (gsttracerinput.LogInputException, IOError), e:
+        sys.exit(str(e))
     element_names.update(data['elements'])
     pad_names.update(data['pads'])
     queries = data['queries']
 
-    statistics = generate_per_pad_caps_query_summary (queries)
-
+    summary = GstCapsQuerySummary()
     for t in queries:
         print t.get_pretty_string()
         print
+        summary.add_tree(t)
 
-    print
-    print '=== STATS ==='
-    for k in statistics.keys():
-        print gen_element_pad_name(k[0], k[1])
-        print statistics[k].get_pretty_string(4)
-        print
-
-    print '=== TOTALS ==='
-    print 'Total query trees:', len(queries)
-    print 'Total queries:', sum([q.node_count for q in queries])
-    print 'Total time: %dns' % sum([q.get_total_time() for q in queries])
-    print 'Preroll time: %dns' % data['preroll-time']
+    print_results(summary, data['preroll-time'])
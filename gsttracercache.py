@@ -0,0 +1,139 @@
+"""
+Sidecar cache of the events decoded from a tracer log.
+
+The first analysis of a log stores the decoded events in an SQLite
+database next to it (<log>.gsttracer-cache), later runs read them back
+instead of parsing the text. Each tool keeps its own tables, tagged with
+the size, mtime and a hash of the start and end of the log, so the cache
+is ignored and rewritten when the log changes.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+CACHE_SUFFIX = '.gsttracer-cache'
+
+# Bytes hashed at each end of the log, hashing the whole log would cost
+# as much as parsing it
+FINGERPRINT_BYTES = 1 << 20
+
+# Rows inserted at once while writing
+BATCH_SIZE = 10000
+
+def log_fingerprint(path):
+    st = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if st.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, st.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return st.st_size, int(st.st_mtime), digest.hexdigest()
+
+def open_cache(log_path):
+    ''' Returns the TracerLogCache of a log, or None if it can't be used '''
+    if not os.path.isfile(log_path):
+        return None
+    try:
+        return TracerLogCache(log_path)
+    except (sqlite3.Error, IOError, OSError):
+        return None
+
+class TracerLogCache(object):
+    def __init__(self, log_path):
+        self.path = log_path + CACHE_SUFFIX
+        self.fingerprint = log_fingerprint(log_path)
+        self.db = sqlite3.connect(self.path)
+        self.db.text_factory = str
+        # writers sharing the connection, a rollback drops the rows of all
+        self.writers = []
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (tool TEXT PRIMARY KEY, '
+                        'version INTEGER, size INTEGER, mtime INTEGER, digest TEXT)')
+
+    def is_valid(self, tool, version):
+        ''' Whether the tables of tool were written from the current log '''
+        row = self.db.execute('SELECT version, size, mtime, digest FROM meta '
+                              'WHERE tool = ?', (tool,)).fetchone()
+        return row is not None and tuple(row) == (version,) + self.fingerprint
+
+    def rows(self, table, first_row=None):
+        ''' The rows of table in insertion order, from rowid first_row on '''
+        if first_row is None:
+            return self.db.execute('SELECT * FROM %s ORDER BY rowid' % table)
+        return self.db.execute('SELECT * FROM %s WHERE rowid >= ? ORDER BY rowid' % table,
+                               (first_row,))
+
+    def writer(self, tool, version, schema):
+        ''' Starts replacing the tables of tool
+
+        schema maps the table names to their column definitions, several
+        tools can be written at once. Returns None if the cache can't be
+        written, when it is read only or locked by another run. '''
+        try:
+            writer = TracerLogCacheWriter(self, tool, version, schema)
+        except sqlite3.Error:
+            try:
+                self.db.rollback()
+            except sqlite3.Error:
+                pass
+            return None
+        self.writers.append(writer)
+        return writer
+
+    def close(self):
+        self.db.close()
+
+class TracerLogCacheWriter(object):
+    def __init__(self, cache, tool, version, schema):
+        self.cache = cache
+        self.tool = tool
+        self.version = version
+        self.pending = {}
+        self.inserts = {}
+        self.failed = False
+        db = cache.db
+        db.execute('DELETE FROM meta WHERE tool = ?', (tool,))
+        db.commit()
+        for table, columns in schema.iteritems():
+            db.execute('DROP TABLE IF EXISTS %s' % table)
+            db.execute('CREATE TABLE %s (%s)' % (table, columns))
+            self.pending[table] = []
+            self.inserts[table] = 'INSERT INTO %s VALUES (%s)' % \
+                (table, ','.join(['?'] * len(columns.split(','))))
+
+    def add(self, table, row):
+        if self.failed:
+            return
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            try:
+                self._flush(table)
+            except (sqlite3.Error, OverflowError):
+                self.abort()
+
+    def _flush(self, table):
+        self.cache.db.executemany(self.inserts[table], self.pending[table])
+        self.pending[table] = []
+
+    def commit(self):
+        ''' Writes the remaining rows and marks the tables valid '''
+        if self.failed:
+            return
+        try:
+            for table in self.pending:
+                self._flush(table)
+            self.cache.db.execute('INSERT INTO meta VALUES (?, ?, ?, ?, ?)',
+                                  (self.tool, self.version) + self.cache.fingerprint)
+            self.cache.db.commit()
+        except (sqlite3.Error, OverflowError):
+            self.abort()
+
+    def abort(self):
+        # the tables are left without a meta entry, so they are never used,
+        # and so are the ones of the other writers as their rows are gone
+        for writer in self.cache.writers:
+            writer.failed = True
+            writer.pending = {}
+        self.cache.db.rollback()
@@ -0,0 +1,99 @@
+"""
+Caps intern table shared by the analyzers.
+
+Every distinct caps string gets an integer id the first time it is seen,
+the rest of the analysis only handles ids: the string to print is a list
+lookup and the equality class of the caps is computed once per id. Caps
+with the same gsttracerparser.caps_key() get the same class, a
+normalization of their text that is weaker than gst_caps_is_equal().
+Parsed caps are kept in a bounded LRU, only the strings, the class of
+each id and the canonical key of each class are kept for good.
+"""
+
+import gsttracerparser
+import gsttracersketch
+
+# Parsed caps kept for get_structures()
+CAPS_LRU_SIZE = 1024
+
+class CapsTable(object):
+    def __init__(self, lru_size=CAPS_LRU_SIZE):
+        self.ids = {}
+        self.strings = []
+        self.classes = []
+        self.class_ids = {}
+        # class -> its key, and the stable hash of the key once computed
+        self.class_keys = []
+        self.class_hashes = []
+        self.parsed = gsttracerparser.LRUCache(lru_size)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def get_id(self, caps):
+        ''' Returns the id of caps (gsttracerparser.Caps or Gst.Caps), None for NULL caps '''
+        if caps is None:
+            return None
+        return self.get_string_id(caps.to_string())
+
+    def get_string_id(self, string):
+        caps_id = self.ids.get(string)
+        if caps_id is None:
+            caps_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            self.classes.append(None)
+        return caps_id
+
+    def get_string(self, caps_id):
+        if caps_id is None:
+            return None
+        return self.strings[caps_id]
+
+    def to_string(self, caps_id):
+        ''' The caps string to print, NULL for missing caps '''
+        if caps_id is None:
+            return 'NULL'
+        return self.strings[caps_id]
+
+    def get_structures(self, caps_id):
+        ''' Returns the parsed caps, see gsttracerparser.parse_caps() '''
+        structures = self.parsed.get(caps_id, self)
+        if structures is self:
+            structures = gsttracerparser.parse_caps(self.strings[caps_id])
+            self.parsed[caps_id] = structures
+        return structures
+
+    def is_empty(self, caps_id):
+        return caps_id is not None and self.get_structures(caps_id) == []
+
+    def get_class(self, caps_id):
+        ''' Returns the equality class of caps, the same for all caps ids
+        whose caps are equal, see gsttracerparser.caps_key() '''
+        if caps_id is None:
+            return None
+        class_id = self.classes[caps_id]
+        if class_id is None:
+            try:
+                key = gsttracerparser.caps_key(self.strings[caps_id])
+            except gsttracerparser.GstStructureParsingException:
+                # unparseable caps are only equal to themselves
+                key = ('invalid', self.strings[caps_id])
+            class_id = self.class_ids.get(key)
+            if class_id is None:
+                class_id = self.class_ids[key] = len(self.class_ids)
+                self.class_keys.append(key)
+                self.class_hashes.append(None)
+            self.classes[caps_id] = class_id
+        return class_id
+
+    def get_class_hash(self, caps_id):
+        ''' Returns a hash of the class of caps that is the same for equal
+        caps in any log, 0 for NULL caps '''
+        class_id = self.get_class(caps_id)
+        if class_id is None:
+            return 0
+        class_hash = self.class_hashes[class_id]
+        if class_hash is None:
+            class_hash = self.class_hashes[class_id] = \
+                gsttracersketch.stable_hash(repr(self.class_keys[class_id]))
+        return class_hash
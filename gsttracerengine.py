@@ -0,0 +1,192 @@
+"""
+Single pass over a tracer log for several analyzers.
+
+The analyzers register handlers for the lines they use in a dispatch
+table keyed on the format of the lines and their name: the structure
+name for the GST_TRACER lines ('query', 'message'...) and the event for
+the statechange ones ('element-new'...). Each line of the log is decoded
+once, by the format whose marker it contains, and passed to the handlers
+of its name, so the log is read a single time whatever the number of
+analyzers. It isn't read at all when no handler is registered, as when
+all the analyzers load their data from the cache.
+
+The log can be compressed or '-' for stdin, see gsttracerinput, it is
+then read by a single process and stdin is never cached.
+
+An analyzer is an object with a register(engine) method, called when it
+is added, and a finish() one, called once the log has been read.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import os
+
+import gsttracercache
+import gsttracerinput
+
+# Bytes of log a --jobs worker parses at a time
+CHUNK_BYTES = 4 << 20
+
+# Chunks handed out ahead per --jobs worker. Parsed chunks wait in the
+# main process until their turn, this bounds how many of them do while
+# keeping the workers busy as the main process builds the trees
+CHUNKS_IN_FLIGHT_PER_JOB = 2
+
+class LineFormat(object):
+    ''' A kind of log line, told apart by the marker string in it
+
+    The engine creates an instance of each format class a handler is
+    registered with. With --jobs there is one per chunk in the workers,
+    where the lines are decoded and packed into records, and one in the
+    main process that unpacks them. '''
+
+    marker = None
+
+    def decode(self, line, offset):
+        ''' Returns the (name, value) of a line, None to skip it '''
+        raise NotImplementedError
+
+    def pack(self, value):
+        ''' Called in the --jobs workers, returns the record sent back for
+        a value. The records of a chunk are pickled at once, plain tuples
+        of ints and strings load much faster than decoded objects '''
+        return value
+
+    def get_chunk_state(self):
+        ''' Called in the --jobs workers once a chunk is packed, returns
+        what its records refer to, such as strings sent once per chunk '''
+        return None
+
+    def set_chunk_state(self, state):
+        ''' Called in the main process with the state of a chunk before
+        its records are unpacked '''
+        pass
+
+    def unpack(self, record):
+        ''' Called in the main process, returns the value of a record '''
+        return record
+
+def split_file(input_file, chunk_bytes):
+    ''' Yields the byte ranges of about chunk_bytes a file splits in,
+    starting at line boundaries '''
+    size = os.path.getsize(input_file)
+    start = 0
+    with open(input_file, 'rb') as f:
+        while start < size:
+            # if the previous byte is a newline this is already a line start
+            f.seek(start + chunk_bytes - 1)
+            f.readline()
+            end = min(f.tell(), size)
+            yield input_file, start, end
+            start = end
+
+def _decode_line(formats, line, offset):
+    ''' Returns the (format index, name, value) of a line handled by one of
+    formats, a list of (LineFormat, names), None otherwise '''
+    for i, (line_format, names) in enumerate(formats):
+        if line_format.marker in line:
+            decoded = line_format.decode(line, offset)
+            if decoded is not None and decoded[0] in names:
+                return i, decoded[0], decoded[1]
+    return None
+
+def _parse_chunk(args):
+    ''' Decodes the handled lines in the [start, end) byte range of a file '''
+    (input_file, start, end), spec = args
+    formats = [(format_class(), names) for format_class, names in spec]
+    records = []
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            line = f.readline()
+            if not line:
+                break
+            decoded = _decode_line(formats, line, start)
+            if decoded is not None:
+                format_ix, name, value = decoded
+                # interned, each name is pickled once
+                records.append((format_ix, intern(name), formats[format_ix][0].pack(value)))
+            start += len(line)
+    return records, [line_format.get_chunk_state() for line_format, names in formats]
+
+class GstTracerEngine(object):
+    ''' Reads a log once and dispatches its lines to the analyzers
+
+    cache is the TracerLogCache of the log shared by the analyzers, None
+    when use_cache is False or it can't be opened. jobs is ignored for
+    logs that can't be seeked into. '''
+
+    def __init__(self, input_file, jobs=1, use_cache=True):
+        self.input_file = input_file
+        if jobs > 1 and not gsttracerinput.is_seekable(input_file):
+            jobs = 1
+        self.jobs = jobs
+        self.cache = gsttracercache.open_cache(input_file) if use_cache else None
+        self.analyzers = []
+        # [(format class, {name -> [handlers]})] in registration order
+        self.tables = []
+
+    def add_analyzer(self, analyzer):
+        self.analyzers.append(analyzer)
+        analyzer.register(self)
+
+    def add_handler(self, format_class, name, handler):
+        ''' Calls handler with the value of each format_class line named
+        name, handlers of a line are called in registration order '''
+        for registered, table in self.tables:
+            if registered is format_class:
+                break
+        else:
+            table = {}
+            self.tables.append((format_class, table))
+        table.setdefault(name, []).append(handler)
+
+    def _serial_lines(self):
+        formats = [(format_class(), table) for format_class, table in self.tables]
+        offset = 0
+        with gsttracerinput.open_log(self.input_file) as f:
+            for line in f:
+                decoded = _decode_line(formats, line, offset)
+                if decoded is not None:
+                    yield decoded
+                offset += len(line)
+
+    def _parallel_lines(self):
+        # Workers decode chunks of the file, the lines are then dispatched
+        # here in order, so the handlers see them just as in a serial pass
+        spec = [(format_class, frozenset(table)) for format_class, table in self.tables]
+        formats = [format_class() for format_class, table in self.tables]
+        chunks = split_file(self.input_file, CHUNK_BYTES)
+        pending = collections.deque()
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            while True:
+                # chunks are handed out as the parsed ones are taken
+                for chunk in itertools.islice(
+                        chunks, self.jobs * CHUNKS_IN_FLIGHT_PER_JOB - len(pending)):
+                    pending.append(pool.apply_async(_parse_chunk, ((chunk, spec),)))
+                if not pending:
+                    break
+                records, states = pending.popleft().get()
+                for line_format, state in zip(formats, states):
+                    line_format.set_chunk_state(state)
+                for format_ix, name, record in records:
+                    yield format_ix, name, formats[format_ix].unpack(record)
+        finally:
+            pool.terminate()
+
+    def run(self):
+        ''' Feeds the log to the handlers and finishes the analyzers '''
+        try:
+            if self.tables:
+                lines = self._parallel_lines() if self.jobs > 1 else self._serial_lines()
+                tables = [table for format_class, table in self.tables]
+                for format_ix, name, value in lines:
+                    for handler in tables[format_ix][name]:
+                        handler(value)
+            for analyzer in self.analyzers:
+                analyzer.finish()
+        finally:
+            if self.cache:
+                self.cache.close()
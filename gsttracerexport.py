@@ -0,0 +1,121 @@
+"""
+Export of the analyzers' results in the Chrome trace event format, which
+chrome://tracing, Perfetto (ui.perfetto.dev) and speedscope can load.
+
+Events are written to the output as they are added, so a trace with
+millions of events never has to be held in memory. Timestamps in the
+format are in microseconds, the tracer ones (in ns) are converted with
+ns_to_us().
+"""
+
+import json
+
+# Processes grouping the tracks in the viewers
+QUERIES_PID = 1
+STATE_CHANGES_PID = 2
+
+def ns_to_us(ns):
+    return ns / 1000.0
+
+class TraceEventWriter(object):
+    ''' Writes trace events to the file object out as a JSON object '''
+
+    def __init__(self, out):
+        self.out = out
+        self.count = 0
+        out.write('{"displayTimeUnit":"ns","traceEvents":[\n')
+
+    def add(self, event):
+        if self.count:
+            self.out.write(',\n')
+        self.out.write(json.dumps(event, separators=(',', ':')))
+        self.count += 1
+
+    def complete(self, name, cat, pid, tid, ts, dur, args=None):
+        ''' Adds a complete (X) event, ts and dur are in ns '''
+        event = {'name' : name, 'cat' : cat, 'ph' : 'X', 'pid' : pid,
+                 'tid' : tid, 'ts' : ns_to_us(ts), 'dur' : ns_to_us(dur)}
+        if args:
+            event['args'] = args
+        self.add(event)
+
+    def instant(self, name, cat, pid, tid, ts, args=None):
+        ''' Adds an instant (i) event on the tid track, ts is in ns '''
+        event = {'name' : name, 'cat' : cat, 'ph' : 'i', 's' : 't',
+                 'pid' : pid, 'tid' : tid, 'ts' : ns_to_us(ts)}
+        if args:
+            event['args'] = args
+        self.add(event)
+
+    def process_name(self, pid, name):
+        self.add({'name' : 'process_name', 'ph' : 'M', 'pid' : pid,
+                  'args' : {'name' : name}})
+
+    def thread_name(self, pid, tid, name, sort_index=None):
+        self.add({'name' : 'thread_name', 'ph' : 'M', 'pid' : pid,
+                  'tid' : tid, 'args' : {'name' : name}})
+        if sort_index is not None:
+            self.add({'name' : 'thread_sort_index', 'ph' : 'M', 'pid' : pid,
+                      'tid' : tid, 'args' : {'sort_index' : sort_index}})
+
+    def close(self):
+        self.out.write('\n]}\n')
+
+class QueryTreeExporter(object):
+    ''' Writes caps query trees as nested complete events on the track of
+    the thread that ran them
+
+    element_name and pad_name return the names of element and pad ixs,
+    caps_string the string of the caps ids of the query lines. '''
+
+    def __init__(self, writer, element_name, pad_name, caps_string):
+        self.writer = writer
+        self.element_name = element_name
+        self.pad_name = pad_name
+        self.caps_string = caps_string
+        self.threads = set()
+        writer.process_name(QUERIES_PID, 'caps queries')
+
+    def add_tree(self, tree):
+        thread = tree.root.queryline.thread
+        if thread not in self.threads:
+            self.threads.add(thread)
+            self.writer.thread_name(QUERIES_PID, thread, '0x%x' % thread)
+        # the nodes are written in pre-order, parents before their children
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            self.add_node(node, thread)
+            stack.extend(reversed(node.children))
+
+    def add_node(self, node, thread):
+        query = node.queryline
+        res = node.res_queryline
+        args = {'element' : self.element_name(query.element),
+                'pad' : self.pad_name(query.pad),
+                'peer' : '%s:%s' % (self.element_name(query.peer_element),
+                                    self.pad_name(query.peer_pad))}
+        if node.is_caps_query():
+            args['filter'] = self.caps_string(query.filter)
+            args['caps'] = self.caps_string(res.caps if res else query.caps)
+        else:
+            args['caps'] = self.caps_string(query.caps)
+        if res:
+            args['result'] = res.result if node.is_accept_caps_query() else res.res
+        if node.issues:
+            args['issues'] = list(node.issues)
+        self.writer.complete('%s %s:%s' % (node.query_name, args['element'], args['pad']),
+                             node.query_name, QUERIES_PID, thread, query.ts,
+                             node.get_total_time() if res else 0, args)
+
+def export_state_changes(writer, elements):
+    ''' Writes the transitions of the ElementStateChangeTimings in elements
+    as complete events, on a track per element '''
+    writer.process_name(STATE_CHANGES_PID, 'state changes')
+    for tid, e in enumerate(elements):
+        writer.thread_name(STATE_CHANGES_PID, tid, '%s (%s)' % (e.element, e.ptr), tid)
+        args = {'element' : e.element, 'ptr' : e.ptr}
+        writer.instant('element-new', 'element', STATE_CHANGES_PID, tid, e.ts, args)
+        for t in e.transitions:
+            writer.complete(t.get_transition_name(), 'state-change', STATE_CHANGES_PID,
+                            tid, t.transition_start_ts, t.duration, args)
@@ -0,0 +1,204 @@
+"""
+Reading of tracer logs, compressed or from stdin.
+
+Logs compressed with gzip, xz or zstd are decompressed as they are read,
+told apart by their first bytes so that compressed data can also be
+piped through stdin ('-'). Nothing is written to disk: compressed logs
+and stdin are read in blocks of BLOCK_SIZE bytes by a background thread,
+so the decompression, which releases the GIL, overlaps the parsing of
+the previous blocks. Plain files are read directly, the OS read-ahead
+already does as much for them. xz needs the lzma module (backports.lzma
+on python 2), zstd the zstandard one.
+
+Only plain log files can be seeked into, the rest have to be read from
+the start in a single process, see is_seekable().
+"""
+
+import cStringIO
+import os
+import sys
+import threading
+import zlib
+import Queue
+
+STDIN = '-'
+
+# Bytes read at once by the background thread, and blocks it can be
+# ahead of the parser
+BLOCK_SIZE = 1 << 20
+QUEUED_BLOCKS = 8
+
+class LogInputException(Exception): pass
+
+class _GzipStream(object):
+    ''' Decompresses the gzip members of f, python 2's GzipFile needs to
+    seek in it so it can't read pipes '''
+
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read(self, size):
+        while True:
+            data = self.f.read(size)
+            if not data:
+                return self.decompressor.flush()
+            block = self.decompressor.decompress(data)
+            while self.decompressor.unused_data:
+                # the start of the next member
+                data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                block += self.decompressor.decompress(data)
+            if block:
+                return block
+
+def _open_gzip(f):
+    return _GzipStream(f)
+
+def _open_xz(f):
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise LogInputException, 'reading xz logs needs the lzma module (backports.lzma)'
+    return lzma.LZMAFile(f)
+
+def _open_zstd(f):
+    try:
+        import zstandard
+    except ImportError:
+        raise LogInputException, 'reading zstd logs needs the zstandard module'
+    return zstandard.ZstdDecompressor().stream_reader(f, read_size=BLOCK_SIZE,
+                                                      read_across_frames=True)
+
+# (magic bytes, name, opener)
+COMPRESSIONS = [
+    ('\x1f\x8b', 'gzip', _open_gzip),
+    ('\xfd7zXZ\x00', 'xz', _open_xz),
+    ('\x28\xb5\x2f\xfd', 'zstd', _open_zstd),
+]
+
+MAGIC_BYTES = max([len(x[0]) for x in COMPRESSIONS])
+
+class _PrefixedFile(object):
+    ''' A file whose first bytes were already read into prefix '''
+
+    def __init__(self, prefix, f):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.f.read(size)
+        if size < 0:
+            data, self.prefix = self.prefix + self.f.read(), ''
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            if len(data) < size:
+                data += self.f.read(size - len(data))
+        return data
+
+    def close(self):
+        if self.f is not sys.stdin:
+            self.f.close()
+
+def _find_compression(prefix):
+    ''' The (magic, name, opener) of the compression of a log starting
+    with prefix, None if it is plain text '''
+    for compression in COMPRESSIONS:
+        if prefix.startswith(compression[0]):
+            return compression
+    return None
+
+def get_compression(path):
+    ''' The name of the compression of the log at path, None if it has none '''
+    if path == STDIN:
+        return None
+    with open(path, 'rb') as f:
+        compression = _find_compression(f.read(MAGIC_BYTES))
+    return compression[1] if compression else None
+
+def read_plain_prefix(f):
+    ''' Returns the first bytes of the file f, raises LogInputException
+    if they are the ones of a compressed log: those can't be read as
+    they grow, by the line '''
+    prefix = f.read(MAGIC_BYTES)
+    compression = _find_compression(prefix)
+    if compression is not None:
+        raise LogInputException, 'a %s compressed log can not be followed' % compression[1]
+    return prefix
+
+def is_seekable(path):
+    ''' Whether the lines of the log can be read at any offset, so by
+    several processes at once '''
+    return path != STDIN and get_compression(path) is None
+
+def _read_blocks(f, queue):
+    try:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            queue.put(block)
+            if not block:
+                break
+    except Exception, e:
+        queue.put(e)
+
+class LogReader(object):
+    ''' Iterates over the lines of the file f, decompressed by opener if
+    given, reading ahead in a background thread '''
+
+    def __init__(self, f, opener=None):
+        self.f = f
+        self.stream = opener(f) if opener else f
+        self.queue = Queue.Queue(QUEUED_BLOCKS)
+        self.thread = threading.Thread(target=_read_blocks, args=(self.stream, self.queue))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __iter__(self):
+        pending = ''
+        while True:
+            block = self.queue.get()
+            if isinstance(block, Exception):
+                raise LogInputException, 'failed to read the log: %s' % block
+            if not block:
+                break
+            end = block.rfind('\n') + 1
+            if not end:
+                pending += block
+                continue
+            for line in cStringIO.StringIO(pending + block[:end]):
+                yield line
+            pending = block[end:]
+        if pending:
+            yield pending
+
+    def close(self):
+        # the thread is a daemon, it is not waited for when the reader is
+        # dropped before the end of the log
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def check_log(path):
+    ''' Raises LogInputException if there is no log at path '''
+    if path != STDIN and not os.path.isfile(path):
+        raise LogInputException, 'no such log: %s' % path
+
+def open_log(path):
+    ''' Returns an iterable over the lines of the log at path, '-' for
+    stdin, to be used in a with statement '''
+    check_log(path)
+    f = sys.stdin if path == STDIN else open(path, 'rb')
+    prefix = f.read(MAGIC_BYTES)
+    compression = _find_compression(prefix)
+    if compression is None and f is not sys.stdin:
+        f.seek(0)
+        return f
+    return LogReader(_PrefixedFile(prefix, f), compression[2] if compression else None)
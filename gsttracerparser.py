@@ -0,0 +1,360 @@
+"""
+Pure python parser for the GstStructure serialization used by GST_TRACER
+log lines.
+
+Structures are returned as dicts (with the structure name available via
+get_name()) and caps as Caps objects that keep the caps text and can
+produce a normalized, hashable representation of it. Both provide the
+subset of the Gst.Structure/Gst.Caps API used by the analyzers, so the
+GObject based backend can still be used in their place.
+"""
+
+import re
+
+class GstStructureParsingException(Exception): pass
+
+_NAME_RE = re.compile(r'\s*([^\s,;()]+(?:\([^)]*\))?)')
+_FIELD_RE = re.compile(r'\s*([^\s,;=]+)\s*=\s*')
+_TYPE_RE = re.compile(r'\(\s*([^\s()]+)\s*\)\s*')
+_TOKEN_RE = re.compile(r'[^\s,;\]}>]+')
+_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_ESCAPE_RE = re.compile(r'\\([0-7]{3}|.)')
+_FRACTION_RE = re.compile(r'^(-?\d+)/(\d+)$')
+
+_INT_TYPES = frozenset(['int', 'uint', 'gint', 'guint', 'int64', 'uint64',
+                        'gint64', 'guint64', 'long', 'ulong', 'glong',
+                        'gulong', 'i', 'u', 'uchar', 'guchar', 'char',
+                        'gchar'])
+_BOOLEAN_TYPES = frozenset(['boolean', 'gboolean', 'bool', 'b'])
+_FLOAT_TYPES = frozenset(['double', 'gdouble', 'float', 'gfloat', 'd', 'f'])
+_STRING_TYPES = frozenset(['string', 'gchararray', 'str', 's'])
+_STRUCTURE_TYPES = frozenset(['structure', 'GstStructure'])
+_CAPS_TYPES = frozenset(['GstCaps', 'caps'])
+
+# caps features that are implied when none are given
+_DEFAULT_CAPS_FEATURES = '(memory:SystemMemory)'
+
+# Distinct nested structure and caps texts whose parsed values are kept,
+# the same handful of them is repeated in most query lines
+NESTED_CACHE_SIZE = 4096
+
+class LRUCache(object):
+    ''' Keeps the size most recently used items '''
+
+    def __init__(self, size):
+        self.size = size
+        self.items = {}
+        # circular doubly linked list of [prev, next, key, value], the
+        # oldest item is next to the root
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        link = self.items.get(key)
+        if link is None:
+            return default
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return link[3]
+
+    def __setitem__(self, key, value):
+        link = self.items.get(key)
+        if link is not None:
+            self.get(key)
+            link[3] = value
+            return
+        root = self.root
+        if len(self.items) >= self.size:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.items[oldest[2]]
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = link
+        self.items[key] = link
+
+_structure_cache = LRUCache(NESTED_CACHE_SIZE)
+_caps_cache = LRUCache(NESTED_CACHE_SIZE)
+
+class Structure(dict):
+    """ A parsed structure, the fields are the dict items """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        dict.__init__(self)
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+    def get_value(self, field):
+        return self.get(field)
+
+    def __reduce__(self):
+        return (_make_structure, (self.name, dict(self)))
+
+def _make_structure(name, fields):
+    s = Structure(name)
+    s.update(fields)
+    return s
+
+class ValueList(tuple):
+    """ { a, b, c } - an unordered set of values """
+    pass
+
+class ValueRange(tuple):
+    """ [ min, max ] or [ min, max, step ] """
+    pass
+
+class ValueArray(tuple):
+    """ < a, b, c > - an ordered array of values """
+    pass
+
+_COLLECTIONS = {'{' : ('}', ValueList), '[' : (']', ValueRange),
+                '<' : ('>', ValueArray)}
+
+class Caps(object):
+    """ GstCaps as serialized in the log
+
+    The caps text is kept as is for printing, the canonical key is only
+    computed when the caps are compared. """
+    __slots__ = ('string', '_key')
+
+    def __init__(self, string):
+        self.string = string
+        self._key = None
+
+    def to_string(self):
+        return self.string
+
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = caps_key(self.string)
+        return self._key
+
+    def is_equal(self, other):
+        if other is None:
+            return False
+        return self.key == other.key
+
+    def __eq__(self, other):
+        return isinstance(other, Caps) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        return (Caps, (self.string,))
+
+    def __repr__(self):
+        return 'Caps(%r)' % self.string
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    def replace(m):
+        c = m.group(1)
+        if len(c) == 3:
+            return chr(int(c, 8))
+        return c
+    return _ESCAPE_RE.sub(replace, text)
+
+def _skip_ws(s, pos):
+    length = len(s)
+    while pos < length and s[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+def _convert(value_type, text, quoted):
+    if value_type is None:
+        if quoted:
+            return text
+        try:
+            return int(text)
+        except ValueError:
+            return text
+    if value_type in _INT_TYPES:
+        try:
+            return int(text)
+        except ValueError:
+            return text
+    if value_type in _BOOLEAN_TYPES:
+        return text.lower() in ('1', 'true', 'yes', 't')
+    if value_type in _STRING_TYPES:
+        if not quoted and text == 'NULL':
+            return None
+        return text
+    if value_type in _CAPS_TYPES:
+        if not quoted and text == 'NULL':
+            return None
+        return Caps(text)
+    if value_type in _STRUCTURE_TYPES:
+        if not quoted and text == 'NULL':
+            return None
+        return parse_structure(text)
+    if value_type in _FLOAT_TYPES:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+    # enums, flags, fractions... are kept as their serialized text
+    return text
+
+def _parse_value(s, pos, value_type):
+    m = _TYPE_RE.match(s, pos)
+    if m:
+        value_type = m.group(1)
+        pos = m.end()
+
+    if pos >= len(s):
+        raise GstStructureParsingException, 'missing value'
+    c = s[pos]
+    if c == '"':
+        m = _STRING_RE.match(s, pos)
+        if not m:
+            raise GstStructureParsingException, 'unterminated string'
+        text = m.group(1)
+        # nested values are shared by all the lines with the same text,
+        # they are never modified
+        if value_type in _STRUCTURE_TYPES:
+            cache = _structure_cache
+        elif value_type in _CAPS_TYPES:
+            cache = _caps_cache
+        else:
+            return _convert(value_type, _unescape(text), True), m.end()
+        value = cache.get(text)
+        if value is None:
+            value = cache[text] = _convert(value_type, _unescape(text), True)
+        return value, m.end()
+    if c in _COLLECTIONS:
+        end, cls = _COLLECTIONS[c]
+        items = []
+        pos = _skip_ws(s, pos + 1)
+        while pos < len(s) and s[pos] != end:
+            value, pos = _parse_value(s, pos, value_type)
+            items.append(value)
+            pos = _skip_ws(s, pos)
+            if pos < len(s) and s[pos] == ',':
+                pos = _skip_ws(s, pos + 1)
+        if pos >= len(s):
+            raise GstStructureParsingException, 'unterminated %s' % c
+        return cls(items), pos + 1
+    m = _TOKEN_RE.match(s, pos)
+    if not m:
+        raise GstStructureParsingException, 'invalid value at %d' % pos
+    return _convert(value_type, m.group(0), False), m.end()
+
+def _parse_structure(s, pos):
+    m = _NAME_RE.match(s, pos)
+    if not m:
+        raise GstStructureParsingException, 'missing structure name'
+    structure = Structure(m.group(1))
+    pos = m.end()
+    length = len(s)
+    while True:
+        pos = _skip_ws(s, pos)
+        if pos >= length or s[pos] == ';':
+            break
+        if s[pos] != ',':
+            raise GstStructureParsingException, \
+                'unexpected %r at %d' % (s[pos], pos)
+        m = _FIELD_RE.match(s, pos + 1)
+        if not m:
+            raise GstStructureParsingException, 'invalid field at %d' % pos
+        value, pos = _parse_value(s, m.end(), None)
+        structure[m.group(1)] = value
+    return structure, pos
+
+def parse_structure(text):
+    """ Parses a serialized GstStructure into a Structure """
+    return _parse_structure(text, 0)[0]
+
+def parse_caps(text):
+    """ Parses a serialized GstCaps into a list of Structures
+
+    Returns None for ANY caps and an empty list for EMPTY caps """
+    text = text.strip()
+    if text == 'ANY':
+        return None
+    if text in ('EMPTY', 'NONE', ''):
+        return []
+    structures = []
+    pos = 0
+    while pos < len(text):
+        structure, pos = _parse_structure(text, pos)
+        structures.append(structure)
+        pos = _skip_ws(text, pos + 1)
+    return structures
+
+def _fraction_key(text):
+    ''' A fraction in lowest terms, 60/2 and 30/1 are equal '''
+    m = _FRACTION_RE.match(text)
+    if not m:
+        return text
+    num, den = int(m.group(1)), int(m.group(2))
+    if not den:
+        return text
+    a, b = abs(num), den
+    while b:
+        a, b = b, a % b
+    return '%d/%d' % (num / a, den / a) if a else '0/1'
+
+def _value_key(value):
+    if isinstance(value, ValueList):
+        items = set([_value_key(x) for x in value])
+        if len(items) == 1:
+            # { I420 } is I420
+            return items.pop()
+        return ('{', tuple(sorted(items, key=repr)))
+    if isinstance(value, ValueRange):
+        items = tuple([_value_key(x) for x in value])
+        if len(items) >= 2 and items[0] == items[1]:
+            # [ 1, 1 ] is 1
+            return items[0]
+        return ('[', items)
+    if isinstance(value, ValueArray):
+        return ('<', tuple([_value_key(x) for x in value]))
+    if isinstance(value, Structure):
+        return _structure_key(value)
+    if isinstance(value, Caps):
+        return value.key
+    if isinstance(value, str) and '/' in value:
+        return _fraction_key(value)
+    return value
+
+def _structure_key(structure):
+    name = structure.name
+    if name.endswith(_DEFAULT_CAPS_FEATURES):
+        name = name[:-len(_DEFAULT_CAPS_FEATURES)]
+    return (name, tuple(sorted([(k, _value_key(v)) for k, v in structure.iteritems()])))
+
+def caps_key(text):
+    """ Returns a normalized, hashable representation of a caps string
+
+    Caps that only differ in the order of their fields, structures or list
+    items, in duplicated structures, in lists of a single value or ranges
+    of a single value written as the value itself, or in fractions not in
+    lowest terms, get the same key. Unlike gst_caps_is_equal() no subset
+    checks are made, so caps that are only equal as sets of formats (a
+    range and the values it covers) do not. """
+    structures = parse_caps(text)
+    if structures is None:
+        return 'ANY'
+    return tuple(sorted(set([_structure_key(s) for s in structures]), key=repr))
@@ -0,0 +1,407 @@
+"""
+Fixed size summaries of the analyzers' results, for their --approx modes.
+
+Unlike gsttracerstats, which keeps every duration, the sketches here use
+the same memory whatever the length of the log, at the cost of bounded
+errors:
+
+ * QuantileSketch counts durations in buckets whose bounds grow by a
+   factor of (1 + a) / (1 - a), a being the relative accuracy (1% by
+   default). Any percentile is then within a relative error a of the
+   exact one: between 0.99x and 1.01x of it. The count, total, mean and
+   max are exact. Up to max_bins buckets are kept, 2048 by default, which
+   covers 1ns to several hours at 1%; past that the lowest buckets are
+   folded together and only the low percentiles lose accuracy. The log2
+   histograms are rebuilt from the buckets, a duration within a of a
+   power of two can land in the bucket next to its own.
+
+ * FrequentItems is a count-min sketch, depth rows of width counters,
+   with the capacity most frequent keys kept as candidates. The count of
+   a key is never underestimated and with a probability of 1 - e^-depth
+   (98% by default) it is overestimated by at most e / width of the total
+   count (0.03% with the default 8192 counters). A key replaces the
+   candidate with the smallest estimate when its own gets bigger, so the
+   keys seen more often than that error, up to capacity of them, are the
+   ones reported.
+
+ * ReservoirSample keeps size items picked uniformly out of all the ones
+   added to it.
+
+All the sketches can be merged, with merge(), as if they had been fed the
+items of both, and saved with save() to be merged later with the ones of
+other logs, or of parts of a log. Sketches are only merged with sketches
+of the same parameters. The keys of FrequentItems are hashed by the
+caller, the hashes must not depend on the process or on the log, see
+stable_hash().
+"""
+
+import array
+import hashlib
+import json
+import math
+import random
+
+import gsttracerstats
+
+# Bumped whenever the saved sketches change
+SKETCH_VERSION = 1
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+
+FREQUENT_ITEMS_CAPACITY = 100
+COUNT_MIN_WIDTH = 8192
+COUNT_MIN_DEPTH = 4
+
+RESERVOIR_SEED = 0
+
+# Modulus of the count-min row hashes, a Mersenne prime
+HASH_PRIME = (1 << 61) - 1
+# (multiplier, offset) of the hash of each count-min row, fixed so the
+# sketches of different runs can be merged
+ROW_HASHES = [
+    (0x824b7774bf475ad, 0x61073647919f7c7),
+    (0x89cafd34c9cea47, 0x14987de627adc2a2),
+    (0x1674eef135fb09c2, 0xf4c33ee35533f53),
+    (0x1fbf07732b24ab91, 0x14256ab6b5f90c31),
+    (0x111bc6b43e308468, 0x131b5aaa08a80726),
+    (0x1b4559cc329331e0, 0x10862fd5147e054),
+    (0x18184a6ca02be601, 0x13494e8c129cf724),
+    (0x1cc443e7c3ac417f, 0xb08fc7f18cea336),
+]
+
+class SketchException(Exception): pass
+
+def stable_hash(text):
+    ''' A 64 bit hash of text that is the same in any process, unlike
+    hash() '''
+    return int(hashlib.md5(text).hexdigest()[:16], 16)
+
+class QuantileSketch(object):
+    ''' Relative error percentiles of durations in ns, see the module
+    documentation for the error bounds '''
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_bins=MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.multiplier = 1 / math.log(self.gamma)
+        # bucket index -> count, bucket i holds (gamma^(i-1), gamma^i]
+        self.bins = {}
+        # durations of zero, or negative with clock issues
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = int(math.ceil(math.log(value) * self.multiplier))
+        bins = self.bins
+        bins[index] = bins.get(index, 0) + 1
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        lowest = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[lowest] += self.bins.pop(index)
+
+    def _value(self, index):
+        ''' The value reported for the durations of a bucket, within the
+        relative accuracy of all of them '''
+        if index is None:
+            value = 0
+        else:
+            value = int(round(2 * self.gamma ** index / (self.gamma + 1)))
+        return max(self.min, min(self.max, value))
+
+    def _buckets(self):
+        ''' (index, count) of the buckets in increasing order, None for
+        the zero bucket '''
+        if self.zero_count:
+            yield None, self.zero_count
+        for index in sorted(self.bins):
+            yield index, self.bins[index]
+
+    def get_percentile(self, percentile):
+        ''' The duration at percentile, by the nearest rank method as in
+        gsttracerstats '''
+        rank = gsttracerstats.percentile_rank(percentile, self.count)
+        seen = 0
+        for index, count in self._buckets():
+            seen += count
+            if seen > rank:
+                return self._value(index)
+        return self.max
+
+    def summarize(self, key):
+        ''' Returns the gsttracerstats.DurationSummary of the durations '''
+        histogram = {}
+        for index, count in self._buckets():
+            value = self._value(index)
+            bucket = value.bit_length() if value > 0 else 0
+            histogram[bucket] = histogram.get(bucket, 0) + count
+        return gsttracerstats.DurationSummary(
+            key, self.count, self.total,
+            dict([(p, self.get_percentile(p)) for p in gsttracerstats.PERCENTILES]),
+            self.max, histogram)
+
+    def merge(self, other):
+        if other.gamma != self.gamma or other.max_bins != self.max_bins:
+            raise SketchException, 'can not merge quantile sketches of different accuracies'
+        for index, count in other.bins.iteritems():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def to_dict(self):
+        return {'relative-accuracy' : self.relative_accuracy, 'max-bins' : self.max_bins,
+                'bins' : sorted(self.bins.items()), 'zero-count' : self.zero_count,
+                'count' : self.count, 'total' : self.total,
+                'min' : self.min, 'max' : self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative-accuracy'], data['max-bins'])
+        sketch.bins = dict([(index, count) for index, count in data['bins']])
+        sketch.zero_count = data['zero-count']
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
+
+class DurationSketches(object):
+    ''' A QuantileSketch per key, the approximate DurationStats '''
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.keys = []
+        self.sketches = {}
+
+    def get_sketch(self, key):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = QuantileSketch(self.relative_accuracy)
+            self.keys.append(key)
+        return sketch
+
+    def add(self, key, duration):
+        self.get_sketch(key).add(duration)
+
+    def summarize(self):
+        ''' Returns the gsttracerstats.DurationSummary of each key, in the
+        order they were first added '''
+        return [self.sketches[key].summarize(key) for key in self.keys]
+
+    def merge(self, other):
+        for key in other.keys:
+            self.get_sketch(key).merge(other.sketches[key])
+
+    def to_dict(self):
+        return {'relative-accuracy' : self.relative_accuracy,
+                'sketches' : [[key, self.sketches[key].to_dict()] for key in self.keys]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls(data['relative-accuracy'])
+        for key, sketch in data['sketches']:
+            # the tuple keys are saved as lists
+            if isinstance(key, list):
+                key = tuple(key)
+            sketches.keys.append(key)
+            sketches.sketches[key] = QuantileSketch.from_dict(sketch)
+        return sketches
+
+class FrequentItems(object):
+    ''' Approximate counts of hashed keys and the most frequent ones, see
+    the module documentation for the error bounds
+
+    Each key comes with an item, what is reported for it, only the ones
+    of the candidates are kept. Items are saved as JSON. '''
+
+    def __init__(self, capacity=FREQUENT_ITEMS_CAPACITY, width=COUNT_MIN_WIDTH,
+                 depth=COUNT_MIN_DEPTH):
+        if depth > len(ROW_HASHES):
+            raise SketchException, 'count-min sketches have up to %d rows' % len(ROW_HASHES)
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array('l', [0]) * width for i in range(depth)]
+        self.total = 0
+        # key hash -> [estimated count, item] of the candidates
+        self.candidates = {}
+        # a lower bound of the smallest candidate estimate
+        self.min_estimate = 0
+
+    def _indexes(self, key_hash):
+        width = self.width
+        return [(key_hash * a + b) % HASH_PRIME % width for a, b in ROW_HASHES[:self.depth]]
+
+    def get_estimate(self, key_hash):
+        ''' The count of the key, never below the exact one '''
+        return min([row[i] for row, i in zip(self.rows, self._indexes(key_hash))])
+
+    def add(self, key_hash, item, count=1):
+        self.total += count
+        estimate = None
+        for row, i in zip(self.rows, self._indexes(key_hash)):
+            row[i] += count
+            if estimate is None or row[i] < estimate:
+                estimate = row[i]
+
+        candidates = self.candidates
+        candidate = candidates.get(key_hash)
+        if candidate is not None:
+            candidate[0] = estimate
+        elif len(candidates) < self.capacity:
+            candidates[key_hash] = [estimate, item]
+        elif estimate > self.min_estimate:
+            # the estimates of the candidates only grow, the smallest one
+            # is only looked for when the key could replace it
+            victim = min(candidates, key=lambda k: candidates[k][0])
+            if estimate > candidates[victim][0]:
+                del candidates[victim]
+                candidates[key_hash] = [estimate, item]
+            self.min_estimate = min([c[0] for c in candidates.itervalues()])
+
+    def get_error(self):
+        ''' The most the counts are overestimated by, with the
+        probability given in the module documentation '''
+        return int(math.ceil(math.e / self.width * self.total))
+
+    def get_top(self, count=None):
+        ''' Returns the (estimated count, item) of the count most frequent
+        keys, all the candidates if None '''
+        top = sorted([(self.get_estimate(k), c[1]) for k, c in self.candidates.iteritems()],
+                     key=lambda x: x[0], reverse=True)
+        return top[:count] if count is not None else top
+
+    def _trim(self):
+        for key_hash, candidate in self.candidates.iteritems():
+            candidate[0] = self.get_estimate(key_hash)
+        if len(self.candidates) > self.capacity:
+            kept = sorted(self.candidates.iteritems(), key=lambda x: x[1][0],
+                          reverse=True)[:self.capacity]
+            self.candidates = dict(kept)
+        self.min_estimate = min([c[0] for c in self.candidates.itervalues()] or [0])
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise SketchException, 'can not merge count-min sketches of different sizes'
+        for row, other_row in zip(self.rows, other.rows):
+            for i in xrange(self.width):
+                row[i] += other_row[i]
+        self.total += other.total
+        for key_hash, candidate in other.candidates.iteritems():
+            if key_hash not in self.candidates:
+                self.candidates[key_hash] = list(candidate)
+        self._trim()
+
+    def to_dict(self):
+        return {'capacity' : self.capacity, 'width' : self.width, 'depth' : self.depth,
+                'rows' : [row.tolist() for row in self.rows], 'total' : self.total,
+                'candidates' : [[k, c[1]] for k, c in self.candidates.iteritems()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        items = cls(data['capacity'], data['width'], data['depth'])
+        items.rows = [array.array('l', row) for row in data['rows']]
+        items.total = data['total']
+        items.candidates = dict([(k, [0, item]) for k, item in data['candidates']])
+        items._trim()
+        return items
+
+class ReservoirSample(object):
+    ''' Keeps size of the items added, each of them with the same chance '''
+
+    def __init__(self, size, seed=RESERVOIR_SEED):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self.random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        index = self.random.randrange(self.seen)
+        if index < self.size:
+            self.items[index] = item
+
+    def merge(self, other):
+        ''' Keeps size items out of both samples, an item of a sample
+        standing for seen / len(items) of the items added to it '''
+        pools = []
+        for sample in (self, other):
+            items = list(sample.items)
+            self.random.shuffle(items)
+            weight = float(sample.seen) / len(items) if items else 0
+            pools.append((items, weight))
+        merged = []
+        while len(merged) < self.size and (pools[0][0] or pools[1][0]):
+            weights = [len(items) * weight for items, weight in pools]
+            pool = 0 if self.random.random() * sum(weights) < weights[0] else 1
+            if not pools[pool][0]:
+                pool = 1 - pool
+            merged.append(pools[pool][0].pop())
+        self.items = merged
+        self.seen += other.seen
+
+    def to_dict(self):
+        return {'size' : self.size, 'items' : self.items, 'seen' : self.seen}
+
+    @classmethod
+    def from_dict(cls, data):
+        sample = cls(data['size'])
+        sample.items = data['items']
+        sample.seen = data['seen']
+        return sample
+
+def _to_str(value):
+    ''' The json module reads unicode strings, the analyzers use str '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(x) for x in value]
+    if isinstance(value, dict):
+        return dict([(_to_str(k), _to_str(v)) for k, v in value.iteritems()])
+    return value
+
+def save(path, tool, state):
+    ''' Writes the state of the sketches of tool, a JSON serializable
+    dict, to path '''
+    with open(path, 'w') as f:
+        json.dump({'version' : SKETCH_VERSION, 'tool' : tool, 'state' : state}, f)
+
+def load(path, tool):
+    ''' Returns the state saved to path by save() for tool '''
+    try:
+        with open(path) as f:
+            data = _to_str(json.load(f))
+    except (IOError, ValueError), e:
+        raise SketchException, 'can not read the sketches in %s: %s' % (path, e)
+    if not isinstance(data, dict) or data.get('tool') != tool:
+        raise SketchException, '%s has no %s sketches' % (path, tool)
+    if data.get('version') != SKETCH_VERSION:
+        raise SketchException, '%s has sketches of another version' % path
+    return data['state']
@@ -0,0 +1,204 @@
+"""
+Duration distributions of the analyzers' results.
+
+Durations are appended to a compact array per key while the log is
+read, the statistics of all the keys are then computed at once. With
+NumPy the histogram buckets of each key come out of a single search of
+its durations and its percentiles out of a partition of them. Without
+it each key is sorted on its own in pure Python, with the same results,
+a lot more slowly on large logs.
+
+Percentiles use the nearest rank method: the p-th percentile is the
+smallest duration with at least p% of the durations at or below it.
+Histograms have log2 buckets, bucket n holds the durations in
+[2^(n-1), 2^n) ns and bucket 0 the zero (or, with clock issues,
+negative) ones.
+
+The significance tests of the comparisons between runs are here as well,
+in pure Python: the p-value of an increase of a metric over its baseline
+values, from Student's t distribution, and the Benjamini-Hochberg
+procedure that keeps the share of false positives among the flagged
+metrics under a rate when many of them are tested at once.
+"""
+
+import array
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERCENTILES = (50, 90, 99)
+
+# array type of the durations, C long as python 2 has no long long arrays
+DURATION_TYPECODE = 'l'
+
+# Bucket edges of the histograms
+POWERS_OF_TWO = numpy.left_shift(1, numpy.arange(63, dtype=numpy.int64)) if numpy else None
+
+class DurationSummary(object):
+    ''' The distribution of the durations of a key, percentiles maps the
+    PERCENTILES to their value and histogram the buckets to their count '''
+
+    def __init__(self, key, count, total, percentiles, max, histogram):
+        self.key = key
+        self.count = count
+        self.total = total
+        self.mean = float(total) / count
+        self.percentiles = percentiles
+        self.max = max
+        self.histogram = histogram
+
+def percentile_rank(percentile, count):
+    ''' Index of the percentile in count sorted durations '''
+    return max((percentile * count + 99) / 100 - 1, 0)
+
+class DurationStats(object):
+    ''' Durations in ns grouped by key '''
+
+    def __init__(self):
+        self.keys = []
+        # key -> array of its durations
+        self.values = {}
+
+    def add(self, key, duration):
+        values = self.values.get(key)
+        if values is None:
+            values = self.values[key] = array.array(DURATION_TYPECODE)
+            self.keys.append(key)
+        values.append(duration)
+
+    def summarize(self):
+        ''' Returns the DurationSummary of each key, in the order they
+        were first added '''
+        if not self.keys:
+            return []
+        if numpy is not None:
+            return self._summarize_numpy()
+        return self._summarize_python()
+
+    def _summarize_python(self):
+        summaries = []
+        for key in self.keys:
+            values = sorted(self.values[key])
+            count = len(values)
+            histogram = {}
+            for value in values:
+                bucket = value.bit_length() if value > 0 else 0
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+            summaries.append(DurationSummary(
+                key, count, sum(values),
+                dict([(p, values[percentile_rank(p, count)]) for p in PERCENTILES]),
+                values[-1], histogram))
+        return summaries
+
+    def _summarize_numpy(self):
+        summaries = []
+        for key in self.keys:
+            # a view of the array, the partition below makes the copy
+            values = numpy.frombuffer(self.values[key], dtype=numpy.int_)
+            count = len(values)
+            # only the ranks that are reported are put in place, a
+            # partition is linear where a sort is not
+            ranks = dict([(p, percentile_rank(p, count)) for p in PERCENTILES])
+            ranked = numpy.partition(values, sorted(set(ranks.values() + [count - 1])))
+            # the bucket of a duration is the number of powers of two up to it
+            histogram = numpy.bincount(numpy.searchsorted(POWERS_OF_TWO, values, side='right'))
+            summaries.append(DurationSummary(
+                key, count, int(values.sum()),
+                dict([(p, int(ranked[r])) for p, r in ranks.iteritems()]),
+                int(ranked[count - 1]),
+                dict([(b, int(histogram[b])) for b in numpy.flatnonzero(histogram).tolist()])))
+        return summaries
+
+def write_summary(out, name, summary, indent=4):
+    ''' Writes the stats of summary, under name, and its histogram '''
+    out.write('%s - count: %d mean: %dns %s max: %dns\n' % (
+        name, summary.count, summary.mean,
+        ' '.join(['p%d: %dns' % (p, summary.percentiles[p]) for p in PERCENTILES]),
+        summary.max))
+    for bucket in sorted(summary.histogram):
+        out.write('%s[%d, %d)ns: %d\n' % (' ' * indent, 1 << bucket >> 1, 1 << bucket,
+                                         summary.histogram[bucket]))
+
+def mean_and_variance(values):
+    ''' The mean and the sample variance of values '''
+    count = len(values)
+    mean = float(sum(values)) / count
+    if count < 2:
+        return mean, 0.0
+    return mean, sum([(x - mean) ** 2 for x in values]) / (count - 1)
+
+def _beta_continued_fraction(a, b, x):
+    # Lentz's method, as in Numerical Recipes' betacf
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 301):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            delta = d * c
+            result *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return result
+
+def regularized_beta(a, b, x):
+    ''' The regularized incomplete beta function I_x(a, b) '''
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_continued_fraction(a, b, x) / a
+    return 1 - front * _beta_continued_fraction(b, a, 1 - x) / b
+
+def student_t_sf(t, df):
+    ''' P(T > t) for a Student's t distribution of df degrees of freedom '''
+    p = 0.5 * regularized_beta(df / 2.0, 0.5, df / (df + t * t))
+    return p if t > 0 else 1 - p
+
+def increase_p_value(baseline, candidate):
+    ''' The one sided p-value of the candidate values being higher than
+    the baseline ones
+
+    Welch's t-test is used, or with a single candidate value the test of a
+    new observation against the baseline sample. At least two baseline
+    values are needed. '''
+    baseline_mean, baseline_variance = mean_and_variance(baseline)
+    candidate_mean, candidate_variance = mean_and_variance(candidate)
+    if len(candidate) == 1:
+        error = math.sqrt(baseline_variance * (1 + 1.0 / len(baseline)))
+        df = len(baseline) - 1
+    else:
+        baseline_error = baseline_variance / len(baseline)
+        candidate_error = candidate_variance / len(candidate)
+        error = math.sqrt(baseline_error + candidate_error)
+        if error:
+            df = (baseline_error + candidate_error) ** 2 / (
+                baseline_error ** 2 / (len(baseline) - 1) +
+                candidate_error ** 2 / (len(candidate) - 1))
+    difference = candidate_mean - baseline_mean
+    if not error:
+        # constant values, any increase is significant
+        return 0.0 if difference > 0 else 1.0
+    return student_t_sf(difference / error, df)
+
+def false_discoveries(p_values, rate):
+    ''' Returns the indexes of the p_values that are significant at the
+    false discovery rate, by the Benjamini-Hochberg procedure '''
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    significant = 0
+    for rank, i in enumerate(order):
+        if p_values[i] <= rate * (rank + 1) / len(p_values):
+            significant = rank + 1
+    return set(order[:significant])
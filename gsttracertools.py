@@ -0,0 +1,26 @@
+"""
+Loads the analyzer scripts as modules, their file names are not valid
+module names.
+"""
+
+import imp
+import os
+import sys
+
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NEGOTIATION_ANALYZER = os.path.join(TOP_DIR, 'gsttracer-negotiation-analyzer.py')
+STATECHANGE_ANALYZER = os.path.join(TOP_DIR, 'scripts', 'gsttracer-statechange.py')
+
+def _load(name, path):
+    if name in sys.modules:
+        return sys.modules[name]
+    if TOP_DIR not in sys.path:
+        sys.path.insert(0, TOP_DIR)
+    return imp.load_source(name, path)
+
+def load_negotiation_analyzer():
+    return _load('gsttracer_negotiation_analyzer', NEGOTIATION_ANALYZER)
+
+def load_statechange_analyzer():
+    return _load('gsttracer_statechange', STATECHANGE_ANALYZER)
@@ -0,0 +1,86 @@
+"""
+Time window and name filters shared by the analyzers.
+
+Times are given as in the debug log (h:mm:ss.nnnnnnnnn) or in seconds,
+and compared to the ts of the tracer lines, in ns.
+"""
+
+import argparse
+import bisect
+
+def parse_time(text):
+    ''' Returns the ns of 'h:mm:ss.nnnnnnnnn', 'mm:ss.n' or 'ss.n' '''
+    try:
+        parts = text.split(':')
+        whole, _, fraction = parts[-1].partition('.')
+        if len(fraction) > 9 or (fraction and not fraction.isdigit()):
+            raise ValueError
+        seconds = 0
+        for part in parts[:-1] + [whole or '0']:
+            seconds = seconds * 60 + int(part)
+        return seconds * 1000000000 + int(fraction.ljust(9, '0') or 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid time: %r' % text)
+
+class TimeWindow(object):
+    ''' [start, end] in ns, either can be None for no bound '''
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    def is_bounded(self):
+        return self.start is not None or self.end is not None
+
+    def contains(self, ts):
+        return (self.start is None or ts >= self.start) and \
+               (self.end is None or ts <= self.end)
+
+    def overlaps(self, start, end):
+        return (self.start is None or end >= self.start) and \
+               (self.end is None or start <= self.end)
+
+def add_arguments(parser, pad=True):
+    parser.add_argument('--from', dest='from_time', type=parse_time, metavar='TIME',
+                        help='only look at what starts at or after TIME, '
+                             'h:mm:ss.nnnnnnnnn or seconds')
+    parser.add_argument('--to', dest='to_time', type=parse_time, metavar='TIME',
+                        help='only look at what starts at or before TIME')
+    parser.add_argument('--element', metavar='NAME',
+                        help='only look at the element named NAME')
+    if pad:
+        parser.add_argument('--pad', metavar='NAME',
+                            help='only look at the pads named NAME')
+
+def window_from_args(args):
+    return TimeWindow(args.from_time, args.to_time)
+
+def find_segments(segments, window):
+    ''' Returns the first and the end indexes of the segments to read
+
+    segments are (min ts, max ts) of consecutive parts of a log, None when
+    the part has no timestamped lines. The parts before the first index
+    only have lines older than the window, the ones from the end index on
+    only lines newer than it. '''
+    prefix_max = []
+    value = -1
+    for min_ts, max_ts in segments:
+        if max_ts is not None:
+            value = max(value, max_ts)
+        prefix_max.append(value)
+    suffix_min = [None] * len(segments)
+    value = float('inf')
+    for i in range(len(segments) - 1, -1, -1):
+        if segments[i][0] is not None:
+            value = min(value, segments[i][0])
+        suffix_min[i] = value
+
+    first = 0
+    if window.start is not None and segments:
+        # the segments whose lines are all older than start are skipped
+        first = min(bisect.bisect_left(prefix_max, window.start), len(segments) - 1)
+    end = len(segments)
+    if window.end is not None:
+        # and so are the ones whose lines are all newer than end
+        end = max(first, bisect.bisect_right(suffix_min, window.end))
+    return first, end
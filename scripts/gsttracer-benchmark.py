@@ -0,0 +1,458 @@
+"""
+Generates synthetic tracer logs and measures the analyzers on them.
+
+  gsttracer-benchmark.py generate [scale options] output.log
+  gsttracer-benchmark.py run [scale options] [--log existing.log] [-o results.json]
+
+The generated logs have the GST_TRACER stats lines read by
+gsttracer-negotiation-analyzer.py and the statechange tracer lines read
+by gsttracer-statechange.py interleaved by timestamp, as they are when
+both tracers are enabled. 'run' reports the time of each phase, the
+parsed lines/sec and the peak RSS of each analyzer as JSON.
+"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import gsttracertools
+
+TRACER_LINE = '%s \033[335m%5d\033[00m %14s \033[37mTRACE  \033[00m ' \
+              '\033[00;01;34m          GST_TRACER :0::\033[00m %s\n'
+STATECHANGE_LINE = '%s %5d %14s INFO             statechange ' \
+                   'gststatechange.c:%d:%s: %d$%s\n'
+
+PID = 4242
+NONE_IX = 4294967295
+
+CAPS = [
+    'video/x-raw, format=(string)I420, width=(int)1920, height=(int)1080, framerate=(fraction)30/1',
+    'video/x-raw, format=(string){ I420, YV12, NV12 }, width=(int)[ 1, 2147483647 ], height=(int)[ 1, 2147483647 ]',
+    'video/x-raw, width=(int)1920, height=(int)1080, format=(string)I420, framerate=(fraction)30/1',
+    'video/x-raw(memory:GLMemory), format=(string)RGBA, width=(int)[ 1, 8192 ], height=(int)[ 1, 8192 ]',
+    'audio/x-raw, format=(string)S16LE, layout=(string)interleaved, rate=(int)48000, channels=(int)2',
+    'audio/x-raw, format=(string){ S16LE, F32LE }, rate=(int)[ 1, 2147483647 ], channels=(int)[ 1, 8 ]',
+    'ANY',
+    'EMPTY',
+]
+
+def format_time(ns):
+    return '%u:%02u:%02u.%09u' % (ns / 3600000000000, ns / 60000000000 % 60,
+                                 ns / 1000000000 % 60, ns % 1000000000)
+
+def wrap_string(s):
+    ''' Quotes s like gst_value_serialize() does for nested values '''
+    out = []
+    for c in s:
+        if c.isalnum() or c in '_-+/:.':
+            out.append(c)
+        else:
+            out.append('\\' + c)
+    return '"%s"' % ''.join(out)
+
+class NegotiationGenerator(object):
+    ''' Caps and accept-caps query trees issued from streaming threads '''
+
+    def __init__(self, args, rand):
+        self.args = args
+        self.rand = rand
+        self.elements = ['pipeline0'] + ['%s%d' % (rand.choice(['queue', 'videoconvert',
+                         'capsfilter', 'tee', 'videoscale', 'sink']), i)
+                         for i in range(1, args.elements)]
+        self.pads = {}
+        for e in range(len(self.elements)):
+            self.pads[e] = [e * args.pads + p for p in range(args.pads)]
+        self.threads = [0x7f0000001000 + t * 0x100000 for t in range(args.threads)]
+
+    def line(self, ts, structure, thread_ptr='0x1c1b400'):
+        return TRACER_LINE % (format_time(ts), PID, thread_ptr, structure)
+
+    def header(self, ts):
+        for e, name in enumerate(self.elements):
+            yield ts, self.line(ts, 'new-element, ix=(uint)%d, parent-ix=(uint)0, '
+                                'name=(string)%s, type=(string)GstElement, '
+                                'is-bin=(boolean)%d;' % (e, name, e == 0))
+            for i, p in enumerate(self.pads[e]):
+                yield ts, self.line(ts, 'new-pad, ix=(uint)%d, parent-ix=(uint)%d, '
+                                    'name=(string)%s_%d, type=(string)GstPad, '
+                                    'is-ghostpad=(boolean)0, pad-direction=(int)%d, '
+                                    'thread-id=(guint64)%d;' % \
+                                    (p, e, 'src' if i % 2 else 'sink', i, 1 + i % 2, self.threads[0]))
+
+    def query(self, ts, thread, element, kind, post, filtercaps, caps, result):
+        if kind == 'caps':
+            inner = 'query-caps, filter=(GstCaps)%s, caps=(GstCaps)%s;' % (
+                wrap_string(filtercaps) if filtercaps else 'NULL',
+                wrap_string(caps) if caps else 'NULL')
+        else:
+            inner = 'query-accept-caps, caps=(GstCaps)%s, result=(boolean)%s;' % (
+                wrap_string(caps), 'true' if result else 'false')
+        pad = self.rand.choice(self.pads[element])
+        peer = element + 1 if element + 1 < len(self.elements) else NONE_IX
+        peer_pad = self.pads[peer][0] if peer != NONE_IX else NONE_IX
+        return self.line(ts, 'query, thread-id=(guint64)%d, ts=(guint64)%d, '
+                         'pad-ix=(uint)%d, element-ix=(uint)%d, peer-pad-ix=(uint)%d, '
+                         'peer-element-ix=(uint)%d, name=(string)%s, '
+                         'structure=(structure)%s, have-res=(boolean)%d, '
+                         'res=(boolean)%d;' % (thread, ts, pad, element, peer_pad,
+                         peer, kind, wrap_string(inner), post, result),
+                         '0x%x' % thread)
+
+    def noise(self, ts, thread):
+        element = self.rand.randrange(len(self.elements))
+        pad = self.pads[element][-1]
+        if self.rand.random() < 0.9:
+            return self.line(ts, 'buffer, thread-id=(guint64)%d, ts=(guint64)%d, '
+                             'pad-ix=(uint)%d, element-ix=(uint)%d, peer-pad-ix=(uint)%d, '
+                             'peer-element-ix=(uint)%d, buffer-size=(uint)3110400, '
+                             'buffer-ts=(guint64)%d, buffer-duration=(guint64)33333333, '
+                             'buffer-flags=(GstBufferFlags)0, buffer-offset=(guint64)0, '
+                             'buffer-offset-end=(guint64)0;' % \
+                             (thread, ts, pad, element, pad + 1, element + 1, ts),
+                             '0x%x' % thread)
+        return self.line(ts, 'event, thread-id=(guint64)%d, ts=(guint64)%d, '
+                         'pad-ix=(uint)%d, element-ix=(uint)%d, name=(string)%s;' % \
+                         (thread, ts, pad, element, self.rand.choice(['segment',
+                         'caps', 'stream-start', 'tag', 'reconfigure'])),
+                         '0x%x' % thread)
+
+    def tree(self, thread, clock, element, kind, depth):
+        ''' Yields the (ts, line) of a query tree rooted at element '''
+        args = self.args
+        rand = self.rand
+        filtercaps = rand.choice([None] + CAPS[:6])
+        caps = rand.choice(CAPS[:6])
+        clock[0] += rand.randint(200, 2000)
+        yield clock[0], self.query(clock[0], thread, element, kind, 0,
+                                   filtercaps if kind == 'caps' else None,
+                                   None if kind == 'caps' else caps, 0)
+
+        children = []
+        if kind == 'caps' and depth < args.depth:
+            # caps queries recurse downstream, tee-like elements fan out
+            downstream = [e for e in range(element + 1, len(self.elements))]
+            if downstream:
+                count = rand.randint(1, args.fanout)
+                children = [(rand.choice(downstream), 'caps')
+                            for i in range(count)]
+        elif kind == 'accept-caps':
+            if rand.random() < args.accept_caps_query and element + 1 < len(self.elements):
+                # an accept-caps that ends up querying another element
+                children = [(element + 1, 'caps')]
+        for child, child_kind in children:
+            for item in self.tree(thread, clock, child, child_kind, depth + 1):
+                yield item
+        for i in range(args.noise):
+            clock[0] += rand.randint(50, 500)
+            yield clock[0], self.noise(clock[0], thread)
+
+        clock[0] += rand.randint(200, 2000)
+        result = rand.random() < 0.8
+        yield clock[0], self.query(clock[0], thread, element, kind, 1, filtercaps,
+                                   rand.choice(CAPS) if kind == 'caps' else caps,
+                                   result)
+
+    def thread_lines(self, thread, start, count):
+        clock = [start]
+        for i in range(count):
+            kind = 'accept-caps' if self.rand.random() < self.args.accept_caps else 'caps'
+            element = self.rand.randrange(1, len(self.elements))
+            for item in self.tree(thread, clock, element, kind, 1):
+                yield item
+            clock[0] += self.rand.randint(1000, 100000)
+
+    def generate(self, start):
+        per_thread = [self.args.trees / len(self.threads)] * len(self.threads)
+        per_thread[0] += self.args.trees % len(self.threads)
+        streams = [self.header(start)]
+        streams += [self.thread_lines(t, start + 1000, c)
+                    for t, c in zip(self.threads, per_thread)]
+        preroll = start + 1000 + self.args.trees * 20000 / len(self.threads)
+        streams.append(iter([(preroll, self.line(preroll, 'message, thread-id=(guint64)%d, '
+                        'ts=(guint64)%d, element-ix=(uint)0, name=(string)async-done, '
+                        'structure=(structure)NULL;' % (self.threads[0], preroll)))]))
+        return heapq.merge(*streams)
+
+class StateChangeGenerator(object):
+    ''' Pipeline instances made of nested bins going to PLAYING and back '''
+
+    def __init__(self, args, rand):
+        self.args = args
+        self.rand = rand
+        self.counter = 0
+        self.free_ptrs = []
+        self.next_ptr = 0x7f5000000000
+        # whether a bin filling itself in _init() got the ptr of a freed
+        # element yet, the first bin that can is made to
+        self.reused_in_init = False
+
+    def new_ptr(self):
+        # freed pointers are reused, as the allocator does
+        if self.free_ptrs:
+            return self.free_ptrs.pop()
+        self.next_ptr += 0x400
+        return '0x%x' % self.next_ptr
+
+    def line(self, func, event):
+        self.clock += self.rand.randint(500, 50000)
+        return self.clock, STATECHANGE_LINE % (format_time(self.clock), PID,
+                                              '0x1c1b400', 81, func,
+                                              self.clock, event)
+
+    def build(self, name, depth, lines):
+        ''' Creates an element, or a bin with its children, returns its node '''
+        self.counter += 1
+        reused = bool(self.free_ptrs)
+        ptr = self.new_ptr()
+        node = {'ptr' : ptr, 'name' : '%s%d' % (name, self.counter), 'children' : []}
+        is_bin = depth < self.args.bins
+        in_init = is_bin and (self.rand.random() < 0.3 or (reused and not self.reused_in_init))
+        if in_init and reused:
+            self.reused_in_init = True
+        if not in_init:
+            lines.append(self.line('do_element_new', 'element-new$%s$<%s>' % (ptr, node['name'])))
+        if is_bin:
+            for c in range(self.args.bin_children):
+                last = c == self.args.bin_children - 1
+                child = self.build('bin' if c == 0 else ('sink' if last else 'element'),
+                                   depth + 1 if c == 0 else self.args.bins, lines)
+                node['children'].append(child)
+                # bins filling themselves in _init() add children before
+                # their own element-new, without a name
+                lines.append(self.line('do_bin_add_post', 'bin-add-post$%s$<%s>$%s$<%s>' % \
+                                       (ptr, 'GstBin@%s' % ptr if in_init else node['name'],
+                                        child['ptr'], child['name'])))
+        if in_init:
+            lines.append(self.line('do_element_new', 'element-new$%s$<%s>' % (ptr, node['name'])))
+        return node
+
+    def change_state(self, node, current, next, lines, async_done):
+        ''' Returns True if the change went async '''
+        lines.append(self.line('do_change_state_pre', 'element-state-change-pre$%s$<%s>$%s$%s' % \
+                               (node['ptr'], node['name'], current, next)))
+        is_async = False
+        for child in reversed(node['children']):
+            is_async |= self.change_state(child, current, next, lines, async_done)
+        if next == 'paused' and current == 'ready' and node['name'].startswith('sink'):
+            is_async = True
+        lines.append(self.line('do_change_state_post', 'element-state-change-post$%s$<%s>$%s$%s$%s' % \
+                               (node['ptr'], node['name'], current, next,
+                                'async' if is_async else 'success')))
+        if is_async:
+            async_done.append(node)
+        return is_async
+
+    def free(self, node):
+        for child in node['children']:
+            self.free(child)
+        self.free_ptrs.append(node['ptr'])
+
+    def generate(self, start):
+        self.clock = start
+        for i in range(self.args.instances):
+            lines = []
+            self.counter = 0
+            pipeline = self.build('pipeline', 0, lines)
+            pipeline['name'] = 'pipeline%d' % i
+            for current, next in [('null', 'ready'), ('ready', 'paused'),
+                                  ('paused', 'playing'), ('playing', 'paused'),
+                                  ('paused', 'ready'), ('ready', 'null')]:
+                async_done = []
+                self.change_state(pipeline, current, next, lines, async_done)
+                # async-done is posted by the sinks first, then by each bin
+                for node in async_done:
+                    lines.append(self.line('do_post_message_pre', 'element-async-done$%s$<%s>' % \
+                                           (node['ptr'], node['name'])))
+            self.free(pipeline)
+            for item in lines:
+                yield item
+            self.clock += self.rand.randint(1000000, 10000000)
+
+def generate_log(args, output):
+    ''' Writes a synthetic log, returns its line count '''
+    rand = random.Random(args.seed)
+    streams = []
+    if args.trees:
+        streams.append(NegotiationGenerator(args, rand).generate(1000))
+    if args.instances:
+        streams.append(StateChangeGenerator(args, rand).generate(1000))
+    count = 0
+    for ts, line in heapq.merge(*streams):
+        output.write(line)
+        count += 1
+    return count
+
+class NullOutput(object):
+    def write(self, data):
+        pass
+
+def _run_phases(name, phases, queue):
+    ''' Runs phases, a list of (phase name, function), in a child process
+    so the peak RSS is the one of this analyzer only '''
+    results = {'phases' : {}}
+    data = None
+    for phase, func in phases:
+        start = time.time()
+        data = func(data)
+        results['phases'][phase] = time.time() - start
+    results['peak-rss-kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((name, results))
+
+def negotiation_phases(log, args):
+    def parse(data):
+        analyzer = gsttracertools.load_negotiation_analyzer()
+        return analyzer, analyzer.process_file(log, args.jobs, False)
+
+    def summary(data):
+        analyzer, parsed = data
+        return analyzer, parsed, analyzer.generate_per_pad_caps_query_summary(parsed['queries'])
+
+    def render(data):
+        analyzer, parsed, statistics = data
+        analyzer.element_names.update(parsed['elements'])
+        analyzer.pad_names.update(parsed['pads'])
+        out = NullOutput()
+        for t in parsed['queries']:
+            out.write(t.get_pretty_string())
+        for k in statistics.keys():
+            out.write(analyzer.gen_element_pad_name(k[0], k[1]))
+            out.write(statistics[k].get_pretty_string(4))
+        return data
+
+    def latency(data):
+        analyzer, parsed, statistics = data
+        stats = analyzer.GstCapsQueryLatency()
+        for t in parsed['queries']:
+            stats.add_tree(t)
+        stats.stats.summarize()
+        return data
+
+    return [('parse', parse), ('per-pad-summary', summary), ('render-text', render),
+            ('latency-stats', latency)]
+
+def statechange_phases(log, args):
+    def parse(data):
+        analyzer = gsttracertools.load_statechange_analyzer()
+        return analyzer, analyzer.process_file(log, False)
+
+    def timeline(data):
+        analyzer, elements = data
+        analyzer.output_html_timeline_chart(elements, NullOutput())
+        return data
+
+    def viewer(data):
+        analyzer, elements = data
+        analyzer.output_html_viewer(elements, NullOutput())
+        return data
+
+    def transition_stats(data):
+        analyzer, elements = data
+        analyzer.output_transition_stats(elements, NullOutput())
+        return data
+
+    return [('parse', parse), ('html-timeline', timeline), ('html-viewer', viewer),
+            ('transition-stats', transition_stats)]
+
+def run_benchmark(args):
+    log = args.log
+    generated = None
+    if not log:
+        fd, log = tempfile.mkstemp(suffix='.log', prefix='gsttracer-benchmark-')
+        generated = log
+        start = time.time()
+        with os.fdopen(fd, 'w') as f:
+            generate_log(args, f)
+        generate_time = time.time() - start
+    try:
+        with open(log, 'rb') as f:
+            lines = sum(1 for l in f)
+        results = {
+            'log' : {'path' : None if generated else log,
+                     'bytes' : os.path.getsize(log), 'lines' : lines},
+            'parameters' : dict((k, v) for k, v in vars(args).iteritems()
+                                if k not in ('command', 'output', 'log')),
+        }
+        if generated:
+            results['log']['generate-time'] = generate_time
+
+        queue = multiprocessing.Queue()
+        for name, phases in [('negotiation', negotiation_phases(log, args)),
+                             ('statechange', statechange_phases(log, args))]:
+            p = multiprocessing.Process(target=_run_phases, args=(name, phases, queue))
+            p.start()
+            name, analyzer_results = queue.get()
+            p.join()
+            parse_time = analyzer_results['phases']['parse']
+            analyzer_results['lines-per-sec'] = lines / parse_time if parse_time else None
+            results[name] = analyzer_results
+    finally:
+        if generated:
+            os.unlink(generated)
+    return results
+
+def add_scale_arguments(parser):
+    g = parser.add_argument_group('synthetic log scale')
+    g.add_argument('--seed', type=int, default=0)
+    g.add_argument('--elements', type=int, default=20,
+                   help='elements in the negotiating pipeline (default: %(default)s)')
+    g.add_argument('--pads', type=int, default=2,
+                   help='pads per element (default: %(default)s)')
+    g.add_argument('--threads', type=int, default=4,
+                   help='streaming threads issuing queries (default: %(default)s)')
+    g.add_argument('--trees', type=int, default=10000,
+                   help='query trees (default: %(default)s)')
+    g.add_argument('--depth', type=int, default=4,
+                   help='maximum query tree depth (default: %(default)s)')
+    g.add_argument('--fanout', type=int, default=2,
+                   help='maximum children of a caps query (default: %(default)s)')
+    g.add_argument('--accept-caps', type=float, default=0.3,
+                   help='ratio of trees rooted at an accept-caps (default: %(default)s)')
+    g.add_argument('--accept-caps-query', type=float, default=0.2,
+                   help='ratio of accept-caps that trigger a caps query on '
+                        'another element (default: %(default)s)')
+    g.add_argument('--noise', type=int, default=2,
+                   help='buffer/event lines per query (default: %(default)s)')
+    g.add_argument('--instances', type=int, default=100,
+                   help='pipeline instances going through state changes '
+                        '(default: %(default)s)')
+    g.add_argument('--bins', type=int, default=3,
+                   help='bin nesting depth of each instance (default: %(default)s)')
+    g.add_argument('--bin-children', type=int, default=3,
+                   help='children of each bin (default: %(default)s)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the tracer log analyzers on synthetic logs')
+    sub = parser.add_subparsers(dest='command')
+    gen = sub.add_parser('generate', help='write a synthetic log')
+    gen.add_argument('output', help='log to write, - for stdout')
+    add_scale_arguments(gen)
+    run = sub.add_parser('run', help='run the analyzers and report timings as JSON')
+    run.add_argument('--log', help='existing log to use instead of a synthetic one')
+    run.add_argument('-o', '--output', help='file to write the JSON results to')
+    run.add_argument('-j', '--jobs', type=int, default=1,
+                     help='--jobs of the negotiation analyzer (default: %(default)s)')
+    add_scale_arguments(run)
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        if args.output == '-':
+            generate_log(args, sys.stdout)
+        else:
+            with open(args.output, 'w') as f:
+                generate_log(args, f)
+    else:
+        results = run_benchmark(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        else:
+            print json.dumps(results, indent=2, sort_keys=True)
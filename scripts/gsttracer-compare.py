@@ -0,0 +1,253 @@
+"""
+Compares the tracer logs of several runs of the same pipelines and flags
+the regressions against a set of baseline runs.
+
+  gsttracer-compare.py -b base1.log base2.log ... -- new1.log new2.log ...
+
+Each log is read once, by a process of a pool, with both analyzers fed
+from that single pass (see gsttracerengine), and only its metrics are
+sent back: the preroll time, the number and total time of the caps query
+trees, the queries and query time of each element:pad and the time spent
+in each state transition of each element. Elements and pads are matched
+across runs by name, the metrics of elements with the same name in a log
+are added up.
+
+A metric is flagged when its values in the logs to check are higher than
+in the baseline logs with a one sided p-value that holds at the
+--false-discovery-rate, see gsttracerstats.increase_p_value(), and its
+mean went up by at least --min-change percent. The exit status is 1 when
+a regression is flagged.
+"""
+
+import argparse
+import collections
+import csv
+import multiprocessing
+import os
+import sys
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import gsttracercache
+import gsttracerengine
+import gsttracerstats
+import gsttracertools
+
+# Logs analyzed by a pool process before it is replaced, the analyzers
+# keep some tables (the caps) for the life of the process
+LOGS_PER_PROCESS = 8
+
+# metric -> unit of its values
+METRICS = collections.OrderedDict([
+    ('preroll-time', 'ns'),
+    ('query-trees', ''),
+    ('query-time', 'ns'),
+    ('pad-queries', ''),
+    ('pad-query-time', 'ns'),
+    ('transition', 'ns'),
+])
+
+class RunMetrics(object):
+    ''' The metrics of a log, (metric, subject) -> value, the subject is
+    '' for the metrics of the whole log '''
+
+    def __init__(self, path):
+        self.path = path
+        self.values = collections.defaultdict(int)
+        self.error = None
+
+    def add(self, metric, subject, value):
+        self.values[(metric, subject)] += value
+
+def add_query_metrics(engine, metrics):
+    analyzer = gsttracertools.load_negotiation_analyzer()
+    processor = analyzer.GstCapsNegoProcessor()
+
+    def tree_closed(tree):
+        metrics.add('query-trees', '', 1)
+        metrics.add('query-time', '', tree.get_total_time())
+        for node in tree.traverse():
+            if not node.res_queryline:
+                continue
+            query = node.queryline
+            pad = '%s:%s' % (processor.elements.get(query.get_query_origin(), '--'),
+                             processor.pads.get(query.get_query_origin_pad(), '--'))
+            metrics.add('pad-queries', pad, 1)
+            metrics.add('pad-query-time', pad, node.get_total_time())
+
+    processor.tree_callback = tree_closed
+    nego_analyzer = analyzer.GstCapsNegoAnalyzer(processor)
+    engine.add_analyzer(nego_analyzer)
+    return nego_analyzer
+
+def collect_metrics(args):
+    ''' Returns the RunMetrics of a log, with the error that stopped its
+    analysis if any '''
+    path, use_cache = args
+    metrics = RunMetrics(path)
+    try:
+        engine = gsttracerengine.GstTracerEngine(path, use_cache=use_cache)
+        queries = add_query_metrics(engine, metrics)
+        state_changes = gsttracertools.load_statechange_analyzer().StateChangeAnalyzer()
+        engine.add_analyzer(state_changes)
+        engine.run()
+    except Exception, e:
+        # a broken log is reported, the others are still compared
+        metrics.values.clear()
+        metrics.error = '%s: %s' % (e.__class__.__name__, e)
+        return metrics
+
+    metrics.add('preroll-time', '', queries.data['preroll-time'])
+    for e in state_changes.elements:
+        for t in e.transitions:
+            metrics.add('transition', '%s %s' % (e.element, t.get_transition_name()),
+                        t.duration)
+    metrics.values = dict(metrics.values)
+    return metrics
+
+def collect_all_metrics(paths, jobs, use_cache):
+    ''' Returns the RunMetrics of the logs, in the same order '''
+    if jobs == 1:
+        return [collect_metrics((p, use_cache)) for p in paths]
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=LOGS_PER_PROCESS)
+    try:
+        return pool.map(collect_metrics, [(p, use_cache) for p in paths], chunksize=1)
+    finally:
+        pool.terminate()
+
+class MetricComparison(object):
+    ''' The values of a metric in the baseline and the checked logs '''
+
+    def __init__(self, key, baseline, candidate):
+        self.key = key
+        self.baseline = baseline
+        self.candidate = candidate
+        self.baseline_mean, variance = gsttracerstats.mean_and_variance(baseline)
+        self.baseline_std = variance ** 0.5
+        self.candidate_mean, variance = gsttracerstats.mean_and_variance(candidate)
+        self.candidate_std = variance ** 0.5
+        self.p_value = gsttracerstats.increase_p_value(baseline, candidate)
+        self.regression = False
+
+    def get_change(self):
+        ''' The change of the mean, in percent, None from 0 '''
+        if not self.baseline_mean:
+            return None
+        return 100 * (self.candidate_mean - self.baseline_mean) / self.baseline_mean
+
+def get_keys(runs):
+    ''' The (metric, subject) of all the runs, in METRICS order '''
+    return sorted(set([k for r in runs for k in r.values]),
+                  key=lambda k: (METRICS.keys().index(k[0]), k[1]))
+
+def compare(baseline_runs, candidate_runs, rate, min_change):
+    ''' Returns the MetricComparison of all the metrics, the regressions
+    flagged
+
+    The metrics are counts and times that add up, one that is missing
+    from a run is 0 there: an element or a pad that shows up is compared
+    as well. The false discovery rate holds for each kind of metric, so
+    the few metrics of the whole logs are not drowned out by the many per
+    pad or element ones. '''
+    comparisons = []
+    for key in get_keys(baseline_runs + candidate_runs):
+        comparisons.append(MetricComparison(key,
+                                            [r.values.get(key, 0) for r in baseline_runs],
+                                            [r.values.get(key, 0) for r in candidate_runs]))
+
+    kinds = collections.defaultdict(list)
+    for c in comparisons:
+        kinds[c.key[0]].append(c)
+    for kind in kinds.itervalues():
+        significant = gsttracerstats.false_discoveries([c.p_value for c in kind], rate)
+        for i, c in enumerate(kind):
+            change = c.get_change()
+            c.regression = i in significant and (change is None or change >= min_change)
+    return comparisons
+
+def format_comparison(c):
+    metric, subject = c.key
+    unit = METRICS[metric]
+    change = c.get_change()
+    return '%s%s - baseline: %.0f%s (std %.0f%s, %d logs) checked: %.0f%s ' \
+           '(std %.0f%s, %d logs) change: %s p-value: %.2g' % (
+        metric, ' ' + subject if subject else '',
+        c.baseline_mean, unit, c.baseline_std, unit, len(c.baseline),
+        c.candidate_mean, unit, c.candidate_std, unit, len(c.candidate),
+        '%+.1f%%' % change if change is not None else '--', c.p_value)
+
+def write_table(runs, out):
+    ''' Writes a CSV table of the metrics of the runs, a row per metric
+    and a column per log '''
+    writer = csv.writer(out)
+    writer.writerow(['metric', 'subject'] + [r.path for r in runs])
+    for key in get_keys(runs):
+        writer.writerow(list(key) + [r.values.get(key, '') for r in runs])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares tracer logs of several runs and '
+                                                 'flags the regressions against baseline runs')
+    parser.add_argument('logs', nargs='+', metavar='LOG',
+                        help='logs to check, can be gzip, xz or zstd compressed')
+    parser.add_argument('-b', '--baseline', nargs='+', required=True, metavar='LOG',
+                        help='logs of the baseline runs, at least two, end the '
+                             'list with -- when the logs to check follow')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of processes the logs are analyzed by '
+                             '(default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the %s sidecar caches' % \
+                             gsttracercache.CACHE_SUFFIX)
+    parser.add_argument('--false-discovery-rate', type=float, default=0.05, metavar='RATE',
+                        help='expected share of false regressions among the '
+                             'flagged ones (default: %(default)s)')
+    parser.add_argument('--min-change', type=float, default=5, metavar='PERCENT',
+                        help='increase of the mean of a metric below which it is '
+                             'not flagged (default: %(default)s)')
+    parser.add_argument('--all', action='store_true',
+                        help='print the comparison of all the metrics, not only '
+                             'the regressions')
+    parser.add_argument('--table', metavar='FILE',
+                        help='write the metrics of every log to FILE as CSV')
+    args = parser.parse_args()
+
+    if len(args.baseline) < 2:
+        parser.error('at least two baseline logs are needed')
+    if '-' in args.baseline + args.logs:
+        parser.error('logs can not be read from stdin')
+
+    runs = collect_all_metrics(args.baseline + args.logs, max(args.jobs, 1),
+                               not args.no_cache)
+    baseline_runs = [r for r in runs[:len(args.baseline)] if r.error is None]
+    candidate_runs = [r for r in runs[len(args.baseline):] if r.error is None]
+
+    print '=== LOGS ==='
+    for i, run in enumerate(runs):
+        print '%s %s%s' % ('baseline' if i < len(args.baseline) else 'checked ',
+                           run.path, ' - failed: ' + run.error if run.error else '')
+
+    if args.table:
+        with open(args.table, 'wb') as f:
+            write_table(runs, f)
+
+    if len(baseline_runs) < 2 or not candidate_runs:
+        sys.exit('not enough logs could be analyzed to compare them')
+    comparisons = compare(baseline_runs, candidate_runs, args.false_discovery_rate,
+                          args.min_change)
+
+    print
+    print '=== REGRESSIONS (false discovery rate %g, min change %g%%) ===' % (
+        args.false_discovery_rate, args.min_change)
+    for c in sorted([c for c in comparisons if c.regression], key=lambda x: x.p_value):
+        print format_comparison(c)
+
+    if args.all:
+        print
+        print '=== COMPARISON ==='
+        for c in comparisons:
+            print format_comparison(c) + (' REGRESSION' if c.regression else '')
+
+    print
+    print 'Metrics compared:', len(comparisons)
+    print 'Regressions:', len([c for c in comparisons if c.regression])
+    sys.exit(1 if any([c.regression for c in comparisons]) else 0)
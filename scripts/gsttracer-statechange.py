@@ -1,5 +1,18 @@
+import argparse
+import bisect
+import json
+import os
 import sys
 
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import gsttracercache
+import gsttracerengine
+import gsttracerinput
+import gsttracersketch
+import gsttracerstats
+import gsttracerwindow
+
 class ElementStateChange(object):
     VALUES = {'null' : 1, 'ready' : 2, 'ready-async': 3, 'paused' : 4, 'playing' : 5}
 
@@ -35,6 +48,9 @@ class ElementStateChangeTiming(object):
         self.transitions = []
         self.parent = None
         self.children = []
+        # the ElementStateChangeTimings of the children, the ptrs can be
+        # reused by other elements later on
+        self.child_timings = []
 
     def start_state_change(self, ts, initial_state, final_state):
         assert self.state == initial_state or (self.async_pending and self.pending_state == initial_state), '%s: %s/%s != %s' % (self.element, self.state, self.pending_state, initial_state)
@@ -63,8 +79,10 @@ class ElementStateChangeTiming(object):
             self.async_pending = False
             self.finish_state_change(ts, self.state, self.pending_state, 'success')
 
-    def add_child(self, ptr, element):
+    def add_child(self, ptr, element, child=None):
         self.children.append((ptr, element))
+        if child is not None:
+            self.child_timings.append(child)
 
     def set_parent(self, ptr, element):
         assert self.parent == None
@@ -79,83 +97,346 @@ def parse_entry(entry):
 
     return timestamp, event, ptr, element, tokens[4:]
 
-def process_file(input_file):
-    old_elements = []
-    elements = {}
+# Bumped whenever the cached rows change
+CACHE_VERSION = 1
 
-    pending_parent_relations = []
+CACHE_SCHEMA = {
+    'statechange_events' : 'ts INTEGER, event TEXT, ptr TEXT, element TEXT, data TEXT',
+}
 
-    def set_parent(parent_ptr, child_ptr, child_name):
-        child_name = child_name[1:-1]
-        elements[parent_ptr].add_child(child_ptr, child_name)
-        # We can't trust the bin's element name (it is uppercase and has the memaddress
-        elements[child_ptr].set_parent(parent_ptr, elements[parent_ptr].element)
+EVENTS = frozenset(['element-new', 'element-state-change-pre',
+                    'element-state-change-post', 'element-async-done',
+                    'bin-add-post'])
 
-    with open(input_file, 'r') as f:
-        for line in f:
-            # Get the last token
-            entry = line.split(' ')[-1].strip()
+class StateChangeLineFormat(gsttracerengine.LineFormat):
+    ''' The statechange lines, named after their event '''
 
-            try:
-                ts, event, ptr, element, data = parse_entry(entry)
-            except:
-                #TODO use a proper exception
+    # the debug category, followed by the source file
+    marker = 'statechange '
+
+    def decode(self, line, offset):
+        # Get the last token
+        entry = line.split(' ')[-1].strip()
+
+        try:
+            entry = parse_entry(entry)
+        except:
+            #TODO use a proper exception
+            return None
+        return entry[1], entry
+
+def read_cached_entries(cache):
+    for ts, event, ptr, element, data in cache.rows('statechange_events'):
+        yield ts, event, ptr, element, data.split('$') if data else []
+
+def is_unnamed(element):
+    ''' True for the name GST_PTR_FORMAT prints for an object without a
+    name, <TypeName@0x...> '''
+    return '@0x' in element
+
+class ElementStateChangeTracker(object):
+    ''' Builds the ElementStateChangeTimings from the statechange events '''
+
+    def __init__(self):
+        self.old_elements = []
+        self.elements = {}
+        # bin ptr -> [(child ptr, child name, child)] added before the bin's
+        # element-new
+        self.pending_parent_relations = {}
+
+    def set_parent(self, parent_ptr, child_ptr, child_name, child=None):
+        elements = self.elements
+        child_name = child_name[1:-1]
+        if child is None:
+            child = elements[child_ptr]
+        elements[parent_ptr].add_child(child_ptr, child_name, child)
+        # We can't trust the bin's element name (it is uppercase and has the memaddress
+        child.set_parent(parent_ptr, elements[parent_ptr].element)
+
+    def add_entry(self, entry):
+        ts, event, ptr, element, data = entry
+        elements = self.elements
+
+        if event == 'element-new':
+            data = ElementStateChangeTiming(ptr, element, ts)
+            if ptr in elements:
+                self.old_elements.append(elements[ptr])
+            elements[ptr] = data
+
+            for child_ptr, child_name, child in self.pending_parent_relations.pop(ptr, ()):
+                self.set_parent(ptr, child_ptr, child_name, child)
+
+        elif event == 'element-state-change-pre':
+            elements[ptr].start_state_change(ts, data[0], data[1])
+        elif event == 'element-state-change-post':
+            elements[ptr].finish_state_change(ts, data[0], data[1], data[2])
+        elif event == 'element-async-done':
+            elements[ptr].async_done(ts)
+        elif event == 'bin-add-post':
+            # Some elements will add their children in the _init() so the element-new hook
+            # will be called after the bin-add. The bin has no name yet then, and its ptr
+            # can be the one of a freed element that is still in elements
+            if ptr not in elements or is_unnamed(element):
+                # keep the child object, its ptr can be reused before
+                # the bin shows up
+                self.pending_parent_relations.setdefault(ptr, []).append(
+                    (data[0], data[1], elements.get(data[0])))
+            else:
+                self.set_parent(ptr, data[0], data[1])
+
+    def get_elements(self):
+        return sorted(self.old_elements + self.elements.values(), key=lambda x: x.ts)
+
+class ApproxTransitionTracker(object):
+    ''' The --approx counterpart of ElementStateChangeTracker
+
+    The durations of the transitions that overlap window go to quantile
+    sketches, see gsttracersketch, as soon as they are done. Only the
+    last element of each ptr is kept and the bins are not followed, so the
+    memory does not grow with the log. '''
+
+    def __init__(self, window):
+        self.window = window
+        self.elements = {}
+        self.durations = gsttracersketch.DurationSketches()
+
+    def add_entry(self, entry):
+        ts, event, ptr, element, data = entry
+        elements = self.elements
+
+        if event == 'element-new':
+            elements[ptr] = ElementStateChangeTiming(ptr, element, ts)
+            return
+        elif event == 'element-state-change-pre':
+            elements[ptr].start_state_change(ts, data[0], data[1])
+            return
+        elif event == 'element-state-change-post':
+            elements[ptr].finish_state_change(ts, data[0], data[1], data[2])
+        elif event == 'element-async-done':
+            elements[ptr].async_done(ts)
+        else:
+            return
+
+        transitions = elements[ptr].transitions
+        for t in transitions:
+            if self.window.overlaps(t.transition_start_ts, t.transition_end_ts):
+                self.durations.add(t.get_transition_name(), t.duration)
+        del transitions[:]
+
+    def get_elements(self):
+        return sorted(self.elements.values(), key=lambda x: x.ts)
+
+class StateChangeAnalyzer(object):
+    ''' Feeds an ElementStateChangeTracker, or the given tracker, from a
+    gsttracerengine.GstTracerEngine, or from the cache of the log once the
+    engine is done when it is valid. The elements are in elements after
+    finish(). '''
+
+    def __init__(self, tracker=None):
+        self.tracker = tracker or ElementStateChangeTracker()
+        self.cache = None
+        self.cached = False
+        self.cache_writer = None
+        self.elements = None
+
+    def register(self, engine):
+        self.cache = engine.cache
+        if self.cache and self.cache.is_valid('statechange', CACHE_VERSION):
+            self.cached = True
+            return
+        if self.cache:
+            self.cache_writer = self.cache.writer('statechange', CACHE_VERSION, CACHE_SCHEMA)
+        for event in EVENTS:
+            engine.add_handler(StateChangeLineFormat, event, self.add_entry)
+
+    def add_entry(self, entry):
+        if self.cache_writer:
+            ts, event, ptr, element, data = entry
+            self.cache_writer.add('statechange_events', (ts, event, ptr, element, '$'.join(data)))
+        self.tracker.add_entry(entry)
+
+    def finish(self):
+        if self.cached:
+            for entry in read_cached_entries(self.cache):
+                self.tracker.add_entry(entry)
+        elif self.cache_writer:
+            self.cache_writer.commit()
+        self.elements = self.tracker.get_elements()
+
+def process_file(input_file, use_cache=True, tracker=None):
+    analyzer = StateChangeAnalyzer(tracker)
+    engine = gsttracerengine.GstTracerEngine(input_file, use_cache=use_cache)
+    engine.add_analyzer(analyzer)
+    engine.run()
+    return analyzer.elements
+
+def filter_elements(elements, window, name=None):
+    ''' Returns the elements named name, with all the elements in them,
+    that exist in window, with only the transitions that overlap it
+
+    The state of the elements at the start of the window comes from the
+    events before it, so all the events are always processed. '''
+    if name is not None:
+        selected = set()
+        pending = [e for e in elements if e.element == name]
+        while pending:
+            e = pending.pop()
+            if id(e) in selected:
                 continue
+            selected.add(id(e))
+            pending.extend(e.child_timings)
+        elements = [e for e in elements if id(e) in selected]
 
-            if event == 'element-new':
-                data = ElementStateChangeTiming(ptr, element, ts)
-                if ptr in elements:
-                    old_elements.append(elements[ptr])
-                elements[ptr] = data
-
-                #handle the pending parents (reversed will create a copy)
-                for pp in reversed(pending_parent_relations):
-                    if pp[2] in elements:
-                        pending_parent_relations.remove(pp)
-                        set_parent(pp[2], pp[4][0], pp[4][1]) #FIXME this is ugly
-
-
-            elif event == 'element-state-change-pre':
-                elements[ptr].start_state_change(ts, data[0], data[1])
-            elif event == 'element-state-change-post':
-                elements[ptr].finish_state_change(ts, data[0], data[1], data[2])
-            elif event == 'element-async-done':
-                elements[ptr].async_done(ts)
-            elif event == 'bin-add-post':
-                # Some elements will add their children in the _init() so the element-new hook
-                # will be called after the bin-add
-                if ptr not in elements:
-                    pending_parent_relations.append((ts,event, ptr, element, data))
-                else:
-                    set_parent(ptr, data[0], data[1])
-
-    return sorted(old_elements + elements.values(), key=lambda x: x.ts)
-
-def output_html_timeline_chart(elements):
-    def find_element(ptr):
-        for e in elements:
-            if e.ptr == ptr:
-                return e
+    if not window.is_bounded():
+        return elements
+    result = []
+    for e in elements:
+        if window.end is not None and e.ts > window.end:
+            continue
+        e.transitions = [t for t in e.transitions
+                         if window.overlaps(t.transition_start_ts, t.transition_end_ts)]
+        if e.transitions or window.contains(e.ts):
+            result.append(e)
+    return result
+
+def get_preroll_windows(element):
+    ''' Returns the (start, end, transitions) of each time element went
+    from ready to paused, directly or through ready-async until its
+    async-done, sorted by end '''
+    windows = []
+    pending = None
+    for t in element.transitions:
+        if t.initial_state != 'ready' and t.initial_state != 'ready-async':
+            pending = None
+        elif t.final_state == 'ready-async':
+            pending = t
+        elif t.final_state == 'paused':
+            if t.initial_state == 'ready':
+                windows.append((t.transition_start_ts, t.transition_end_ts, [t]))
+            elif pending is not None:
+                windows.append((pending.transition_start_ts, t.transition_end_ts, [pending, t]))
+            pending = None
+    return windows
+
+class CriticalPathStep(object):
+    ''' An element on the critical path of a preroll
+
+    slack is how much earlier it could have reached paused before a
+    sibling would gate its bin instead, None when it has no sibling, and
+    contribution the part of the preroll time spent in it and not in its
+    child on the path. '''
+
+    def __init__(self, element, window, slack):
+        self.element = element
+        self.start, self.end, self.transitions = window
+        self.slack = slack
+        self.contribution = self.end - self.start
+
+class PrerollCriticalPaths(object):
+    ''' Finds the chain of elements that gated each pipeline reaching paused
+
+    A bin completes its ready -> paused once all its children did, so the
+    child that finished last within the bin's change gated it. The path
+    goes from the pipeline down to an element without children through
+    these children. '''
+
+    def __init__(self, elements):
+        self.elements = elements
+        # id(element) -> (windows, their ends)
+        self.windows = {}
+
+    def _windows(self, element):
+        windows = self.windows.get(id(element))
+        if windows is None:
+            preroll_windows = get_preroll_windows(element)
+            windows = self.windows[id(element)] = \
+                (preroll_windows, [w[1] for w in preroll_windows])
+        return windows
+
+    def _window_in(self, element, start, end):
+        ''' The preroll window of element within [start, end], None if
+        it has none '''
+        windows, ends = self._windows(element)
+        i = bisect.bisect_right(ends, end) - 1
+        if i >= 0 and windows[i][0] >= start:
+            return windows[i]
         return None
 
-    def generate_elements_menu(element_list):
-        menu = '<ul>\n'
-        for e in element_list:
-            menu += '<li>\n'
-            menu += '<a href="#" onclick="drawChart(\'%s:%s\')">%s:%s</a>' % (e[0], e[1], e[0], e[1])
-            element = find_element(e[0])
-            if element and element.children:
-                menu += generate_elements_menu(element.children)
-            menu += '</li>\n'
-        menu += '</ul>\n'
-        return menu
-
-    maxtime = max([x.ts for x in elements])
+    def get_path(self, pipeline, window):
+        ''' The CriticalPathSteps from pipeline, in its preroll window '''
+        steps = [CriticalPathStep(pipeline, window, None)]
+        seen = set([id(pipeline)])
+        element = pipeline
+        while element.child_timings:
+            start, end = steps[-1].start, steps[-1].end
+            candidates = []
+            for child in element.child_timings:
+                child_window = self._window_in(child, start, end)
+                if child_window is not None and id(child) not in seen:
+                    candidates.append((child_window[1], child, child_window))
+            if not candidates:
+                break
+            candidates.sort(key=lambda x: x[0])
+            child_end, element, child_window = candidates[-1]
+            slack = child_end - candidates[-2][0] if len(candidates) > 1 else None
+            seen.add(id(element))
+            step = CriticalPathStep(element, child_window, slack)
+            steps[-1].contribution -= step.end - step.start
+            steps.append(step)
+        return steps
+
+    def get_paths(self):
+        ''' Yields the (pipeline, CriticalPathSteps) of each preroll of the
+        pipelines, the bins without parent '''
+        for e in self.elements:
+            if e.parent is None and e.child_timings:
+                for window in self._windows(e)[0]:
+                    yield e, self.get_path(e, window)
+
+def output_critical_paths(elements, out):
+    paths = PrerollCriticalPaths(elements)
+    # element name -> [times on a path, contribution]
+    totals = {}
+
+    out.write('=== PREROLL CRITICAL PATHS ===\n')
+    for pipeline, steps in paths.get_paths():
+        latency = steps[0].end - steps[0].start
+        out.write('%s (%s): ready -> paused in %d, from %d\n' % \
+                  (pipeline.element, pipeline.ptr, latency, steps[0].start))
+        for depth, step in enumerate(steps):
+            total = totals.setdefault(step.element.element, [0, 0])
+            total[0] += 1
+            total[1] += step.contribution
+            out.write('%s%s: %s\n' % ('  ' * (depth + 1), step.element.element,
+                                      ', '.join([str(t) for t in step.transitions])))
+            out.write('%s  contribution: %d (%.1f%%) slack: %s\n' % \
+                      ('  ' * (depth + 1), step.contribution,
+                       100.0 * step.contribution / latency if latency else 0,
+                       '-' if step.slack is None else '%d' % step.slack))
+
+    out.write('=== CRITICAL PATH CONTRIBUTION PER ELEMENT ===\n')
+    for name, (count, contribution) in sorted(totals.iteritems(), key=lambda x: -x[1][1]):
+        out.write('  %s: on %d paths, contribution: %d total, %d mean\n' % \
+                  (name, count, contribution, contribution / count))
+
+def output_transition_stats(elements, out):
+    stats = gsttracerstats.DurationStats()
     for e in elements:
-        if e.transitions:
-            maxtime = max(maxtime, max([x.transition_end_ts for x in [t for t in e.transitions]]))
+        for t in e.transitions:
+            stats.add(t.get_transition_name(), t.duration)
+    out.write('=== TRANSITION DURATIONS ===\n')
+    for summary in stats.summarize():
+        gsttracerstats.write_summary(out, summary.key, summary)
+
+# Name of the saved --approx sketches
+SKETCH_TOOL = 'statechange'
 
-    html = """
+def output_approx_transition_stats(durations, out):
+    out.write('=== TRANSITION DURATIONS (within %g%%) ===\n' % (durations.relative_accuracy * 100))
+    for summary in durations.summarize():
+        gsttracerstats.write_summary(out, summary.key, summary)
+
+TIMELINE_HTML = """
 <html>
   <head>
     <script type="text/javascript" src="https://www.google.com/jsapi"></script>
@@ -210,34 +491,385 @@ def output_html_timeline_chart(elements):
     <div id="timeline-tooltip" style="height: 1080px; width: 1200px; float: right;"></div>
   </body>
 </html>
-    """
-    data = []
+"""
+
+def output_html_timeline_chart(elements, out):
+    ''' Writes the html timeline of elements to the file object out '''
+    # the first element created with each ptr, elements are sorted by ts
+    index = {}
+    for e in elements:
+        index.setdefault(e.ptr, e)
+
+    def write_elements_menu(element_list):
+        # depth first walk with an explicit stack of (children, bin ptr),
+        # the bin hierarchy can be deeper than the recursion limit
+        out.write('<ul>\n')
+        stack = [(iter(element_list), None)]
+        path = set()
+        while stack:
+            e = next(stack[-1][0], None)
+            if e is None:
+                ptr = stack.pop()[1]
+                if stack:
+                    path.discard(ptr)
+                    out.write('</ul>\n</li>\n')
+                continue
+            out.write('<li>\n')
+            out.write('<a href="#" onclick="drawChart(\'%s:%s\')">%s:%s</a>' % (e[0], e[1], e[0], e[1]))
+            element = index.get(e[0])
+            # a reused ptr can make a bin look like its own descendant
+            if element and element.children and e[0] not in path:
+                out.write('<ul>\n')
+                path.add(e[0])
+                stack.append((iter(element.children), e[0]))
+            else:
+                out.write('</li>\n')
+        out.write('</ul>\n')
+
+    head, rest = TIMELINE_HTML.split('%(data)s', 1)
+    middle, tail = rest.split('%(menu)s', 1)
+
+    out.write(head)
     toplevel = []
+    separator = ''
     for e in elements:
         if e.parent is None:
             toplevel.append((e.ptr, e.element))
-        data.append("'%s:%s' : {'name' : '%s', 'children' : [%s], 'transitions' : [%s]}" \
+        out.write(separator)
+        out.write("'%s:%s' : {'name' : '%s', 'children' : [%s], 'transitions' : [%s]}" \
                             % (e.ptr, e.element, e.element,
                             ','.join(["'"+x[0]+':'+x[1]+"'" for x in e.children]),
                             ','.join(["{'transition': '%s', 'start' : %d, 'end' : %d}" % \
                                      (t.get_transition_name(), t.transition_start_ts, t.transition_end_ts) \
                                      for t in e.transitions if t.is_upwards()])))
+        separator = ',\n'
+    out.write(middle)
+    write_elements_menu(toplevel)
+    out.write(tail)
+
+VIEWER_HTML_HEAD = """<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8">
+    <title>State changes</title>
+    <style>
+      body { margin: 0; font: 12px sans-serif; display: flex; height: 100vh; }
+      #menu { width: 360px; overflow: auto; border-right: 1px solid #ccc; position: relative; }
+      #chart { flex: 1; overflow-y: auto; position: relative; }
+      #chart canvas { position: absolute; left: 0; top: 0; }
+      .row { position: absolute; left: 0; right: 0; height: 18px; line-height: 18px; white-space: nowrap; cursor: pointer; }
+      .row:hover { background: #eef; }
+      .row.selected { background: #cde; }
+      .toggle { display: inline-block; width: 14px; text-align: center; color: #666; }
+      #tooltip { position: fixed; display: none; pointer-events: none; background: #ffd; border: 1px solid #999; padding: 2px 4px; }
+    </style>
+  </head>
+  <body>
+    <div id="menu"><div id="menu-rows"></div></div>
+    <div id="chart"><div id="chart-rows"></div><canvas id="canvas"></canvas></div>
+    <div id="tooltip"></div>
+"""
+
+VIEWER_HTML_TAIL = """    <script type="text/javascript">
+      var ROW = 18, LABELS = 220;
+      var COLORS = ['#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f', '#edc948', '#b07aa1', '#ff9da7'];
+      var meta = JSON.parse(document.getElementById('elements').textContent);
+
+      // transitions are stored as flat [name index, start, end, ...] arrays,
+      // a chunk is only parsed when one of its elements is drawn
+      var chunks = {};
+      function getTransitions(e) {
+        var c = Math.floor(e / meta.chunk);
+        if (!(c in chunks))
+          chunks[c] = JSON.parse(document.getElementById('transitions-' + c).textContent);
+        return chunks[c][e % meta.chunk];
+      }
 
-    menu = generate_elements_menu (toplevel)
+      function formatTime(ns) {
+        if (ns >= 1e9) return (ns / 1e9).toFixed(3) + 's';
+        if (ns >= 1e6) return (ns / 1e6).toFixed(3) + 'ms';
+        if (ns >= 1e3) return (ns / 1e3).toFixed(3) + 'us';
+        return ns + 'ns';
+      }
 
-    return html % {'data': ',\n'.join(data),
-                   'menu' : menu}
+      // Renders the rows in view of a scrollable container, rows are
+      // absolutely positioned inside a spacer as tall as all of them
+      function VirtualList(container, spacer, draw) {
+        this.container = container;
+        this.spacer = spacer;
+        this.draw = draw;
+        this.count = 0;
+        var self = this;
+        container.addEventListener('scroll', function() { self.update(); });
+        window.addEventListener('resize', function() { self.update(); });
+      }
+      VirtualList.prototype.setCount = function(count) {
+        this.count = count;
+        this.spacer.style.height = (count * ROW) + 'px';
+        this.update();
+      };
+      VirtualList.prototype.update = function() {
+        var first = Math.floor(this.container.scrollTop / ROW);
+        var last = Math.min(this.count, first + Math.ceil(this.container.clientHeight / ROW) + 1);
+        this.draw(first, last);
+      };
 
-if __name__ == '__main__':
-    input_file = sys.argv[1]
+      // menu rows are [element, depth, expanded], the children of a bin are
+      // only inserted when it is expanded
+      var menuRows = meta.roots.map(function(e) { return [e, 0, false]; });
+      var selected = null;
+      var menuSpacer = document.getElementById('menu-rows');
+      var menu = new VirtualList(document.getElementById('menu'), menuSpacer, function(first, last) {
+        menuSpacer.textContent = '';
+        for (var i = first; i < last; i++) {
+          var r = menuRows[i], e = r[0];
+          var div = document.createElement('div');
+          div.className = 'row' + (e === selected ? ' selected' : '');
+          div.style.top = (i * ROW) + 'px';
+          div.style.paddingLeft = (r[1] * 14) + 'px';
+          var toggle = document.createElement('span');
+          toggle.className = 'toggle';
+          toggle.textContent = meta.children[e].length ? (r[2] ? '-' : '+') : '';
+          div.appendChild(toggle);
+          div.appendChild(document.createTextNode(meta.ptrs[e] + ':' + meta.names[e]));
+          div.onclick = onMenuClick.bind(null, i);
+          menuSpacer.appendChild(div);
+        }
+      });
+
+      function onMenuClick(i, event) {
+        var r = menuRows[i];
+        if (event.target.className === 'toggle' && meta.children[r[0]].length) {
+          if (r[2]) {
+            var end = i + 1;
+            while (end < menuRows.length && menuRows[end][1] > r[1])
+              end++;
+            menuRows.splice(i + 1, end - i - 1);
+          } else {
+            var rows = meta.children[r[0]].map(function(c) { return [c, r[1] + 1, false]; });
+            Array.prototype.splice.apply(menuRows, [i + 1, 0].concat(rows));
+          }
+          r[2] = !r[2];
+        } else {
+          select(r[0]);
+        }
+        menu.setCount(menuRows.length);
+      }
+
+      // the chart shows the selected element and its children
+      var chartRows = [], chartStart = 0, chartEnd = 1;
+      var chartContainer = document.getElementById('chart');
+      var canvas = document.getElementById('canvas');
+      var chart = new VirtualList(chartContainer, document.getElementById('chart-rows'), drawChart);
+
+      function select(e) {
+        selected = e;
+        chartRows = [e].concat(meta.children[e]);
+        chartStart = Infinity;
+        chartEnd = -Infinity;
+        chartRows.forEach(function(r) {
+          var t = getTransitions(r);
+          for (var i = 0; i < t.length; i += 3) {
+            chartStart = Math.min(chartStart, t[i + 1]);
+            chartEnd = Math.max(chartEnd, t[i + 2]);
+          }
+        });
+        if (chartStart > chartEnd) {
+          chartStart = 0;
+          chartEnd = 1;
+        }
+        chartContainer.scrollTop = 0;
+        chart.setCount(chartRows.length);
+      }
+
+      function timeToX(ts, width) {
+        return LABELS + (ts - chartStart) * (width - LABELS) / Math.max(1, chartEnd - chartStart);
+      }
 
-    data = process_file (input_file)
+      function drawChart(first, last) {
+        var width = chartContainer.clientWidth, height = chartContainer.clientHeight;
+        canvas.width = width;
+        canvas.height = height;
+        canvas.style.top = chartContainer.scrollTop + 'px';
+        var ctx = canvas.getContext('2d');
+        ctx.font = '11px sans-serif';
+        ctx.textBaseline = 'middle';
+        var offset = first * ROW - chartContainer.scrollTop;
+        for (var i = first; i < last; i++) {
+          var e = chartRows[i], y = offset + (i - first) * ROW;
+          ctx.fillStyle = '#000';
+          ctx.fillText(meta.names[e], 4, y + ROW / 2, LABELS - 8);
+          var t = getTransitions(e);
+          for (var j = 0; j < t.length; j += 3) {
+            var x0 = timeToX(t[j + 1], width), x1 = Math.max(x0 + 1, timeToX(t[j + 2], width));
+            ctx.fillStyle = COLORS[t[j] % COLORS.length];
+            ctx.fillRect(x0, y + 2, x1 - x0, ROW - 4);
+            var label = meta.transitions[t[j]];
+            if (ctx.measureText(label).width < x1 - x0 - 4) {
+              ctx.fillStyle = '#fff';
+              ctx.fillText(label, x0 + 2, y + ROW / 2);
+            }
+          }
+        }
+      }
+
+      var tooltip = document.getElementById('tooltip');
+      canvas.addEventListener('mousemove', function(event) {
+        var rect = canvas.getBoundingClientRect();
+        var x = event.clientX - rect.left, y = event.clientY - rect.top;
+        var row = Math.floor((y + chartContainer.scrollTop) / ROW);
+        tooltip.style.display = 'none';
+        if (row >= chartRows.length)
+          return;
+        var e = chartRows[row], t = getTransitions(e);
+        for (var j = 0; j < t.length; j += 3) {
+          var x0 = timeToX(t[j + 1], canvas.width), x1 = Math.max(x0 + 1, timeToX(t[j + 2], canvas.width));
+          if (x >= x0 && x <= x1) {
+            tooltip.textContent = meta.names[e] + ': ' + meta.transitions[t[j]] + ' ' +
+                                  formatTime(t[j + 2] - t[j + 1]) + ' (' + t[j + 1] + ' - ' + t[j + 2] + ')';
+            tooltip.style.left = (event.clientX + 12) + 'px';
+            tooltip.style.top = (event.clientY + 12) + 'px';
+            tooltip.style.display = 'block';
+            return;
+          }
+        }
+      });
+      canvas.addEventListener('mouseleave', function() { tooltip.style.display = 'none'; });
 
-    output_mode = 'timeline'
-    if output_mode == 'timeline':
-        print output_html_timeline_chart(data)
+      menu.setCount(menuRows.length);
+    </script>
+  </body>
+</html>
+"""
+
+# Elements whose transitions are stored in each json chunk of the viewer
+VIEWER_CHUNK_SIZE = 1024
+
+def _write_json_script(out, script_id, value):
+    # '</' would end the script element
+    out.write('    <script type="application/json" id="%s">' % script_id)
+    out.write(json.dumps(value, separators=(',', ':')).replace('</', '<\\/'))
+    out.write('</script>\n')
+
+def output_html_viewer(elements, out):
+    ''' Writes a self contained html viewer of elements to the file object
+    out, it needs no network access and only renders what is in view '''
+    # by object, the ptr of a freed element can be reused by another one
+    index = dict([(id(e), i) for i, e in enumerate(elements)])
+
+    transition_names = {}
+    meta = {'names' : [], 'ptrs' : [], 'children' : [], 'roots' : [],
+            'transitions' : [], 'chunk' : VIEWER_CHUNK_SIZE}
+    for i, e in enumerate(elements):
+        meta['names'].append(e.element)
+        meta['ptrs'].append(e.ptr)
+        # children that were filtered out have nothing to draw
+        meta['children'].append([index[id(c)] for c in e.child_timings if id(c) in index])
+        if e.parent is None:
+            meta['roots'].append(i)
+
+    out.write(VIEWER_HTML_HEAD)
+    chunk = []
+    for i, e in enumerate(elements):
+        transitions = []
+        for t in e.transitions:
+            if not t.is_upwards():
+                continue
+            name = t.get_transition_name()
+            name_ix = transition_names.get(name)
+            if name_ix is None:
+                name_ix = transition_names[name] = len(meta['transitions'])
+                meta['transitions'].append(name)
+            transitions += [name_ix, t.transition_start_ts, t.transition_end_ts]
+        chunk.append(transitions)
+        if len(chunk) == VIEWER_CHUNK_SIZE:
+            _write_json_script(out, 'transitions-%d' % (i / VIEWER_CHUNK_SIZE), chunk)
+            chunk = []
+    if chunk:
+        _write_json_script(out, 'transitions-%d' % (len(elements) / VIEWER_CHUNK_SIZE), chunk)
+    _write_json_script(out, 'elements', meta)
+    out.write(VIEWER_HTML_TAIL)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyzes state changes from statechange tracer logs')
+    parser.add_argument('input_file', nargs='?',
+                        help='GST_DEBUG log with the statechange tracer lines, '
+                             'can be gzip, xz or zstd compressed, '
+                             '\'-\' for stdin, can be left out with --approx-merge')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the %s sidecar cache' % \
+                             gsttracercache.CACHE_SUFFIX)
+    parser.add_argument('--format', choices=['timeline', 'viewer', 'text', 'critical-path',
+                                             'stats'],
+                        default='timeline',
+                        help='timeline: html chart drawn with the Google Charts API, '
+                             'viewer: self contained html viewer for large logs, '
+                             'text: the transitions of each element, '
+                             'critical-path: the elements that gated each preroll '
+                             'of the pipelines, stats: the count, mean, percentiles, '
+                             'max and log2 histogram of each transition '
+                             '(default: %(default)s)')
+    parser.add_argument('--approx', action='store_true',
+                        help='only keep fixed size sketches of the transition '
+                             'durations and print them as the stats format does, '
+                             'with percentiles within 1%%')
+    parser.add_argument('--approx-save', metavar='FILE',
+                        help='save the --approx sketches to FILE, implies --approx')
+    parser.add_argument('--approx-merge', metavar='FILE', action='append',
+                        help='merge the --approx sketches saved to FILE by another '
+                             'run, can be repeated, implies --approx')
+    gsttracerwindow.add_arguments(parser, pad=False)
+    args = parser.parse_args()
+
+    if args.approx_save or args.approx_merge:
+        args.approx = True
+    if args.input_file is None and not args.approx_merge:
+        parser.error('an input file is needed unless --approx-merge is given')
+    if args.approx and args.element:
+        parser.error('--element needs the children of the bins, --approx does not keep them')
+    if args.input_file is not None:
+        try:
+            gsttracerinput.check_log(args.input_file)
+        except gsttracerinput.LogInputException, e:
+            parser.error(str(e))
+
+    input_file = args.input_file
+
+    if args.approx:
+        tracker = ApproxTransitionTracker(gsttracerwindow.window_from_args(args))
+        if input_file is not None:
+            try:
+                process_file(input_file, not args.no_cache, tracker)
+            except (gsttracerinput.LogInputException, IOError), e:
+                sys.exit(str(e))
+        try:
+            for path in args.approx_merge or []:
+                tracker.durations.merge(gsttracersketch.DurationSketches.from_dict(
+                    gsttracersketch.load(path, SKETCH_TOOL)))
+        except gsttracersketch.SketchException, e:
+            sys.exit(str(e))
+        if args.approx_save:
+            gsttracersketch.save(args.approx_save, SKETCH_TOOL, tracker.durations.to_dict())
+        output_approx_transition_stats(tracker.durations, sys.stdout)
+        sys.exit(0)
+
+    try:
+        data = process_file (input_file, not args.no_cache)
+    except (gsttracerinput.LogInputException, IOError), e:
+        sys.exit(str(e))
+    data = filter_elements(data, gsttracerwindow.window_from_args(args), args.element)
+
+    if args.format == 'timeline':
+        output_html_timeline_chart(data, sys.stdout)
+        print
+    elif args.format == 'viewer':
+        output_html_viewer(data, sys.stdout)
+    elif args.format == 'critical-path':
+        output_critical_paths(data, sys.stdout)
+    elif args.format == 'stats':
+        output_transition_stats(data, sys.stdout)
     else:
-        for e in sorted(old_elements + elements.values(), key=lambda x: x.ts):
+        for e in data:
             print e.element
             print '  Created at: %d' % e.ts
             for t in e.transitions:
@@ -0,0 +1,79 @@
+"""
+Exports the caps queries and the state changes of a tracer log as a
+Chrome trace event file, to look at both on a single timeline in
+chrome://tracing or ui.perfetto.dev.
+"""
+
+import argparse
+import os
+import sys
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import gsttracercache
+import gsttracerengine
+import gsttracerexport
+import gsttracerinput
+import gsttracertools
+
+def add_query_exporter(engine, writer):
+    analyzer = gsttracertools.load_negotiation_analyzer()
+    processor = analyzer.GstCapsNegoProcessor()
+
+    # trees are written as they are closed, the elements and pads are
+    # known by then as they are created before being queried
+    def element_name(ix):
+        return processor.elements.get(ix, str(ix))
+
+    def pad_name(ix):
+        return processor.pads.get(ix, str(ix))
+
+    exporter = gsttracerexport.QueryTreeExporter(writer, element_name, pad_name,
+                                                 analyzer.caps_table.to_string)
+    processor.tree_callback = exporter.add_tree
+    engine.add_analyzer(analyzer.GstCapsNegoAnalyzer(processor))
+
+def add_state_change_analyzer(engine):
+    analyzer = gsttracertools.load_statechange_analyzer().StateChangeAnalyzer()
+    engine.add_analyzer(analyzer)
+    return analyzer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports tracer logs in the Chrome trace event format')
+    parser.add_argument('input_file', help='GST_DEBUG log with the stats and statechange '
+                                           'tracer lines, can be gzip, xz or zstd '
+                                           'compressed, \'-\' for stdin')
+    parser.add_argument('-o', '--output', help='trace file to write (default: stdout)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes used to parse the log')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the %s sidecar cache' % \
+                             gsttracercache.CACHE_SUFFIX)
+    parser.add_argument('--no-queries', action='store_true',
+                        help='do not export the caps queries')
+    parser.add_argument('--no-state-changes', action='store_true',
+                        help='do not export the state changes')
+    args = parser.parse_args()
+    try:
+        gsttracerinput.check_log(args.input_file)
+    except gsttracerinput.LogInputException, e:
+        parser.error(str(e))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    writer = gsttracerexport.TraceEventWriter(out)
+    # both are fed from a single read of the log
+    engine = gsttracerengine.GstTracerEngine(args.input_file, args.jobs, not args.no_cache)
+    if not args.no_queries:
+        add_query_exporter(engine, writer)
+    state_changes = None
+    if not args.no_state_changes:
+        state_changes = add_state_change_analyzer(engine)
+    try:
+        engine.run()
+    except (gsttracerinput.LogInputException, IOError), e:
+        sys.exit(str(e))
+    if state_changes:
+        gsttracerexport.export_state_changes(writer, state_changes.elements)
+    writer.close()
+    if args.output:
+        out.close()
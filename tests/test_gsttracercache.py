@@ -0,0 +1,107 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gsttracercache
+
+SCHEMA = {'events' : 'ts INTEGER, name TEXT'}
+
+class TracerLogCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, 'tracer.log')
+        self.write_log('0:00:00.000000001 line\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_log(self, text, mtime=1000):
+        with open(self.log, 'w') as f:
+            f.write(text)
+        os.utime(self.log, (mtime, mtime))
+
+    def fill(self, rows, tool='test', version=1):
+        cache = gsttracercache.open_cache(self.log)
+        writer = cache.writer(tool, version, SCHEMA)
+        for row in rows:
+            writer.add('events', row)
+        writer.commit()
+        cache.close()
+
+    def test_rows(self):
+        rows = [(i, 'event%d' % i) for i in range(gsttracercache.BATCH_SIZE + 10)]
+        self.fill(rows)
+        cache = gsttracercache.open_cache(self.log)
+        self.assertTrue(cache.is_valid('test', 1))
+        self.assertEqual([tuple(row) for row in cache.rows('events')], rows)
+        self.assertEqual([tuple(row) for row in cache.rows('events', 3)], rows[2:])
+
+    def test_no_log(self):
+        self.assertIsNone(gsttracercache.open_cache(os.path.join(self.dir, 'missing.log')))
+
+    def test_other_tool_or_version(self):
+        self.fill([(1, 'a')])
+        cache = gsttracercache.open_cache(self.log)
+        self.assertFalse(cache.is_valid('test', 2))
+        self.assertFalse(cache.is_valid('other', 1))
+
+    def test_log_changed(self):
+        self.fill([(1, 'a')])
+        # same size and mtime, other content
+        self.write_log('0:00:00.000000002 line\n')
+        self.assertFalse(gsttracercache.open_cache(self.log).is_valid('test', 1))
+
+    def test_log_touched(self):
+        self.fill([(1, 'a')])
+        self.write_log('0:00:00.000000001 line\n', mtime=2000)
+        self.assertFalse(gsttracercache.open_cache(self.log).is_valid('test', 1))
+
+    def test_log_appended(self):
+        self.fill([(1, 'a')])
+        self.write_log('0:00:00.000000001 line\n0:00:00.000000002 line\n')
+        self.assertFalse(gsttracercache.open_cache(self.log).is_valid('test', 1))
+
+    def test_rewritten(self):
+        self.fill([(1, 'a')])
+        self.write_log('0:00:00.000000002 line\n')
+        self.fill([(2, 'b')])
+        cache = gsttracercache.open_cache(self.log)
+        self.assertTrue(cache.is_valid('test', 1))
+        self.assertEqual([tuple(row) for row in cache.rows('events')], [(2, 'b')])
+
+    def test_abort(self):
+        self.fill([(1, 'a')])
+        cache = gsttracercache.open_cache(self.log)
+        writer = cache.writer('test', 1, SCHEMA)
+        other = cache.writer('other', 1, {'other_events' : 'ts INTEGER'})
+        writer.add('events', (2, 'b'))
+        writer.abort()
+        # the rows of the other writer went with the rollback
+        other.add('other_events', (1,))
+        other.commit()
+        cache.close()
+        cache = gsttracercache.open_cache(self.log)
+        self.assertFalse(cache.is_valid('test', 1))
+        self.assertFalse(cache.is_valid('other', 1))
+
+    def test_locked(self):
+        self.fill([(1, 'a')])
+        cache = gsttracercache.open_cache(self.log)
+        lock = sqlite3.connect(self.log + gsttracercache.CACHE_SUFFIX, timeout=0)
+        lock.execute('BEGIN IMMEDIATE')
+        cache.db.execute('PRAGMA busy_timeout = 0')
+        try:
+            self.assertIsNone(cache.writer('test', 1, SCHEMA))
+        finally:
+            lock.rollback()
+            lock.close()
+        self.assertTrue(cache.is_valid('test', 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gsttracerengine
+import gsttracertools
+
+# A log of the benchmark generator, 15 query trees and 2 pipelines:
+#   gsttracer-benchmark.py generate --elements 5 --threads 3 --trees 15 \
+#       --instances 2 --bins 2 --bin-children 2 --noise 1 small.log
+SMALL_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'small.log')
+
+class SplitFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, 'tracer.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_log(self, text):
+        with open(self.log, 'wb') as f:
+            f.write(text)
+        return text
+
+    def split(self, chunk_bytes):
+        chunks = list(gsttracerengine.split_file(self.log, chunk_bytes))
+        for input_file, start, end in chunks:
+            self.assertEqual(input_file, self.log)
+        return [(start, end) for input_file, start, end in chunks]
+
+    def check_ranges(self, text, ranges):
+        # contiguous, covering the file, each one made of whole lines
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(text))
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+        for start, end in ranges:
+            self.assertLess(start, end)
+            self.assertTrue(start == 0 or text[start - 1] == '\n')
+
+    def test_line_boundaries(self):
+        text = self.write_log(''.join(['line %d\n' % i for i in range(1000)]))
+        for chunk_bytes in (1, 7, 8, 9, 100, 4096, len(text), len(text) + 1):
+            ranges = self.split(chunk_bytes)
+            self.check_ranges(text, ranges)
+            for start, end in ranges:
+                # a chunk only goes past chunk_bytes to finish its last line
+                self.assertLessEqual(end - start, max(chunk_bytes, 1) + 8)
+
+    def test_chunk_on_line_end(self):
+        # 'aaa\n' fills the first chunk exactly, the next line starts the next one
+        text = self.write_log('aaa\nbbb\nccc\n')
+        self.assertEqual(self.split(4), [(0, 4), (4, 8), (8, 12)])
+
+    def test_long_lines(self):
+        text = self.write_log('x' * 1000 + '\n' + 'short\n' + 'y' * 500 + '\n')
+        ranges = self.split(64)
+        self.check_ranges(text, ranges)
+        # the second chunk ends within the last line and takes all of it
+        self.assertEqual(ranges, [(0, 1001), (1001, 1508)])
+
+    def test_no_final_newline(self):
+        text = self.write_log('aaa\nbbb\nccc')
+        ranges = self.split(2)
+        self.check_ranges(text, ranges)
+        self.assertEqual(ranges[-1], (8, 11))
+
+    def test_empty(self):
+        self.write_log('')
+        self.assertEqual(self.split(10), [])
+
+class ParallelEquivalenceTest(unittest.TestCase):
+    ''' A --jobs run gives the same results as a serial one '''
+
+    def setUp(self):
+        self.chunk_bytes = gsttracerengine.CHUNK_BYTES
+        # small chunks, so the query trees and the threads' pending
+        # queries span chunk boundaries
+        gsttracerengine.CHUNK_BYTES = 4096
+
+    def tearDown(self):
+        gsttracerengine.CHUNK_BYTES = self.chunk_bytes
+
+    def process(self, jobs):
+        analyzer = gsttracertools.load_negotiation_analyzer()
+        data = analyzer.process_file(SMALL_LOG, jobs, use_cache=False)
+        return {'trees' : [t.get_pretty_string() for t in data['queries']],
+                'elements' : data['elements'], 'pads' : data['pads'],
+                'preroll-time' : data['preroll-time']}
+
+    def test_negotiation(self):
+        serial = self.process(1)
+        self.assertEqual(len(serial['trees']), 15)
+        self.assertGreater(len(list(gsttracerengine.split_file(SMALL_LOG, 4096))), 10)
+        for jobs in (2, 3):
+            self.assertEqual(self.process(jobs), serial)
+
+if __name__ == '__main__':
+    unittest.main()
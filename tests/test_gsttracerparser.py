@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gsttracerparser
+from gsttracerparser import caps_key, parse_caps, parse_structure
+
+class ParseStructureTest(unittest.TestCase):
+    def test_typed_fields(self):
+        s = parse_structure('caps-query, thread-id=(uint)123, ts=(guint64)456, '
+                            'name=(string)"a\\ b", ok=(boolean)true, ratio=(double)0.5;')
+        self.assertEqual(s.get_name(), 'caps-query')
+        self.assertEqual(s.get_value('thread-id'), 123)
+        self.assertEqual(s.get_value('ts'), 456)
+        self.assertEqual(s.get_value('name'), 'a b')
+        self.assertIs(s.get_value('ok'), True)
+        self.assertEqual(s.get_value('ratio'), 0.5)
+
+    def test_collections(self):
+        s = parse_structure('s, l={ 1, 2 }, r=[ 1, 5 ], a=< 3, 4 >;')
+        self.assertIsInstance(s['l'], gsttracerparser.ValueList)
+        self.assertEqual(s['l'], (1, 2))
+        self.assertIsInstance(s['r'], gsttracerparser.ValueRange)
+        self.assertEqual(s['r'], (1, 5))
+        self.assertIsInstance(s['a'], gsttracerparser.ValueArray)
+        self.assertEqual(s['a'], (3, 4))
+
+    def test_nested_caps(self):
+        s = parse_structure('s, caps=(GstCaps)"video/x-raw\\,\\ format\\=\\(string\\)I420";')
+        self.assertIsInstance(s['caps'], gsttracerparser.Caps)
+        self.assertEqual(s['caps'].to_string(), 'video/x-raw, format=(string)I420')
+
+    def test_invalid(self):
+        self.assertRaises(gsttracerparser.GstStructureParsingException,
+                          parse_structure, 's, =1')
+
+class ParseCapsTest(unittest.TestCase):
+    def test_any_and_empty(self):
+        self.assertIsNone(parse_caps('ANY'))
+        self.assertEqual(parse_caps('EMPTY'), [])
+        self.assertEqual(parse_caps(''), [])
+
+    def test_structures(self):
+        caps = parse_caps('video/x-raw, format=(string){ I420, NV12 }; '
+                          'audio/x-raw(memory:SystemMemory), rate=(int)44100')
+        self.assertEqual(len(caps), 2)
+        self.assertEqual(caps[0].get_name(), 'video/x-raw')
+        self.assertEqual(caps[0]['format'], ('I420', 'NV12'))
+        self.assertEqual(caps[1]['rate'], 44100)
+
+class CapsKeyTest(unittest.TestCase):
+    def assertSameKey(self, a, b):
+        self.assertEqual(caps_key(a), caps_key(b))
+
+    def assertOtherKey(self, a, b):
+        self.assertNotEqual(caps_key(a), caps_key(b))
+
+    def test_field_and_structure_order(self):
+        self.assertSameKey('video/x-raw, width=(int)320, height=(int)240',
+                           'video/x-raw, height=(int)240, width=(int)320')
+        self.assertSameKey('video/x-raw; audio/x-raw', 'audio/x-raw; video/x-raw')
+        self.assertSameKey('video/x-raw; video/x-raw', 'video/x-raw')
+
+    def test_list_order(self):
+        self.assertSameKey('video/x-raw, format=(string){ I420, NV12 }',
+                           'video/x-raw, format=(string){ NV12, I420 }')
+
+    def test_default_features(self):
+        self.assertSameKey('video/x-raw(memory:SystemMemory), width=(int)1',
+                           'video/x-raw, width=(int)1')
+
+    def test_single_values(self):
+        self.assertSameKey('video/x-raw, format=(string){ I420 }',
+                           'video/x-raw, format=(string)I420')
+        self.assertSameKey('video/x-raw, width=(int)[ 1, 1 ]', 'video/x-raw, width=(int)1')
+
+    def test_fractions(self):
+        self.assertSameKey('video/x-raw, framerate=(fraction)60/2',
+                           'video/x-raw, framerate=(fraction)30/1')
+        self.assertSameKey('video/x-raw, framerate=(fraction)[ 0/2, 60/1 ]',
+                           'video/x-raw, framerate=(fraction)[ 0/1, 60/1 ]')
+        self.assertOtherKey('video/x-raw, framerate=(fraction)30/1',
+                            'video/x-raw, framerate=(fraction)25/1')
+
+    def test_any(self):
+        self.assertEqual(caps_key('ANY'), 'ANY')
+        self.assertOtherKey('ANY', 'EMPTY')
+
+    def test_no_subset_checks(self):
+        # equal as sets of formats, but not as text
+        self.assertOtherKey('video/x-raw, width=(int)[ 1, 2 ]',
+                            'video/x-raw, width=(int){ 1, 2 }')
+
+    def test_caps_objects(self):
+        a = gsttracerparser.Caps('video/x-raw, width=(int)1, height=(int)2')
+        b = gsttracerparser.Caps('video/x-raw,height=(int)2,width=(int)1')
+        self.assertEqual(a.key, b.key)
+        self.assertTrue(a.is_equal(b))
+
+if __name__ == '__main__':
+    unittest.main()
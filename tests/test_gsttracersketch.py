@@ -0,0 +1,175 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gsttracerstats
+import gsttracersketch
+from gsttracersketch import FrequentItems, QuantileSketch, ReservoirSample
+
+def durations(count, seed):
+    rand = random.Random(seed)
+    # ns to tens of ms, as the caps queries and state changes
+    return [int(rand.lognormvariate(10, 3)) for i in range(count)]
+
+class QuantileSketchTest(unittest.TestCase):
+    def assertWithinAccuracy(self, sketch, values, percentiles=(1, 10, 25, 50, 75, 90, 99, 100)):
+        values = sorted(values)
+        accuracy = sketch.relative_accuracy
+        for percentile in percentiles:
+            exact = values[gsttracerstats.percentile_rank(percentile, len(values))]
+            estimate = sketch.get_percentile(percentile)
+            self.assertTrue(abs(estimate - exact) <= accuracy * exact + 1,
+                            'p%d: %d is not within %s of %d' %
+                            (percentile, estimate, accuracy, exact))
+
+    def test_relative_error(self):
+        values = durations(10000, 1) + [0, 0, 1]
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        self.assertWithinAccuracy(sketch, values)
+        self.assertEqual((sketch.count, sketch.total), (len(values), sum(values)))
+        self.assertEqual((sketch.min, sketch.max), (min(values), max(values)))
+
+    def test_merge(self):
+        a, b = durations(5000, 2), durations(5000, 3)
+        sketch, other, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in a:
+            sketch.add(value)
+            whole.add(value)
+        for value in b:
+            other.add(value)
+            whole.add(value)
+        sketch.merge(other)
+        self.assertEqual(sketch.to_dict(), whole.to_dict())
+        self.assertWithinAccuracy(sketch, a + b)
+
+    def test_merge_empty(self):
+        sketch = QuantileSketch()
+        sketch.add(10)
+        sketch.merge(QuantileSketch())
+        self.assertEqual((sketch.count, sketch.min, sketch.max), (1, 10, 10))
+
+    def test_merge_other_accuracy(self):
+        self.assertRaises(gsttracersketch.SketchException,
+                          QuantileSketch().merge, QuantileSketch(0.05))
+
+    def test_collapse(self):
+        sketch = QuantileSketch(max_bins=16)
+        values = [2 ** i for i in range(40)]
+        for value in values:
+            sketch.add(value)
+        self.assertEqual(len(sketch.bins), 16)
+        # only the lowest buckets are folded, the high percentiles hold
+        self.assertWithinAccuracy(sketch, values, (75, 90, 99, 100))
+
+    def test_summarize(self):
+        sketch = QuantileSketch()
+        for value in (0, 1000, 1000, 3000):
+            sketch.add(value)
+        summary = sketch.summarize('key')
+        self.assertEqual((summary.key, summary.count, summary.total, summary.max),
+                         ('key', 4, 5000, 3000))
+        self.assertEqual(summary.histogram, {0 : 1, 10 : 2, 12 : 1})
+
+class FrequentItemsTest(unittest.TestCase):
+    def feed(self, items, counts):
+        for key, count in counts:
+            for i in range(count):
+                items.add(gsttracersketch.stable_hash(key), key)
+
+    def test_top(self):
+        items = FrequentItems(capacity=3, width=64)
+        counts = [('a', 50), ('b', 30), ('c', 20)] + [('x%d' % i, 1) for i in range(40)]
+        self.feed(items, counts)
+        top = items.get_top()
+        self.assertEqual([item for count, item in top], ['a', 'b', 'c'])
+        for (estimate, item), (key, count) in zip(top, counts):
+            # never under, and over by at most the error bound here
+            self.assertTrue(count <= estimate <= count + items.get_error())
+
+    def test_merge(self):
+        items, other = FrequentItems(capacity=2), FrequentItems(capacity=2)
+        self.feed(items, [('a', 10), ('b', 3)])
+        self.feed(other, [('b', 10), ('c', 1)])
+        items.merge(other)
+        self.assertEqual(items.get_top(), [(13, 'b'), (10, 'a')])
+        self.assertEqual(items.total, 24)
+
+    def test_save(self):
+        items = FrequentItems(capacity=2)
+        self.feed(items, [('a', 10), ('b', 3)])
+        loaded = FrequentItems.from_dict(items.to_dict())
+        self.assertEqual(loaded.get_top(), items.get_top())
+
+    def test_stable_hash(self):
+        self.assertEqual(gsttracersketch.stable_hash('video/x-raw'),
+                         int('99463690432cf6ed', 16))
+
+class ReservoirSampleTest(unittest.TestCase):
+    def test_fill(self):
+        sample = ReservoirSample(10)
+        for i in range(5):
+            sample.add(i)
+        self.assertEqual(sample.items, range(5))
+
+    def test_uniform(self):
+        # each of 20 items is kept 5 times out of 20 in about 4000 runs
+        kept = [0] * 20
+        for seed in range(4000):
+            sample = ReservoirSample(5, seed)
+            for i in range(20):
+                sample.add(i)
+            for i in sample.items:
+                kept[i] += 1
+        for count in kept:
+            self.assertTrue(800 <= count <= 1200, kept)
+
+    def test_merge(self):
+        sample, other = ReservoirSample(10), ReservoirSample(10)
+        for i in range(100):
+            sample.add(i)
+        for i in range(100, 300):
+            other.add(i)
+        sample.merge(other)
+        self.assertEqual(len(sample.items), 10)
+        self.assertEqual(sample.seen, 300)
+        self.assertTrue(set(sample.items) <= set(range(300)))
+
+class SaveTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sketches.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        sketches = gsttracersketch.DurationSketches()
+        sketches.add(('src', 'caps'), 1000)
+        sketches.add(('src', 'caps'), 2000)
+        sketches.add('other', 5)
+        gsttracersketch.save(self.path, 'negotiation', {'durations' : sketches.to_dict()})
+        state = gsttracersketch.load(self.path, 'negotiation')
+        loaded = gsttracersketch.DurationSketches.from_dict(state['durations'])
+        self.assertEqual(loaded.keys, [('src', 'caps'), 'other'])
+        self.assertEqual(loaded.to_dict(), sketches.to_dict())
+        self.assertIsInstance(loaded.keys[0][0], str)
+
+    def test_other_tool(self):
+        gsttracersketch.save(self.path, 'negotiation', {})
+        self.assertRaises(gsttracersketch.SketchException,
+                          gsttracersketch.load, self.path, 'statechange')
+
+    def test_missing(self):
+        self.assertRaises(gsttracersketch.SketchException,
+                          gsttracersketch.load, self.path, 'negotiation')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+# the shared modules live in the top level directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gsttracerstats
+from gsttracerstats import false_discoveries, increase_p_value
+
+class DurationStatsTest(unittest.TestCase):
+    def make_stats(self):
+        stats = gsttracerstats.DurationStats()
+        for duration in range(100, 0, -1):
+            stats.add('a', duration)
+        stats.add('b', 0)
+        stats.add('b', 1024)
+        return stats
+
+    def check_summaries(self, summaries):
+        a, b = summaries
+        self.assertEqual((a.key, a.count, a.total, a.max), ('a', 100, 5050, 100))
+        self.assertEqual(a.percentiles, {50 : 50, 90 : 90, 99 : 99})
+        # [1, 2), [2, 4), ..., [64, 128)
+        self.assertEqual(a.histogram, {1 : 1, 2 : 2, 3 : 4, 4 : 8, 5 : 16, 6 : 32, 7 : 37})
+        self.assertEqual(b.histogram, {0 : 1, 11 : 1})
+        self.assertEqual(b.percentiles[50], 0)
+
+    def test_python(self):
+        self.check_summaries(self.make_stats()._summarize_python())
+
+    @unittest.skipIf(gsttracerstats.numpy is None, 'needs NumPy')
+    def test_numpy(self):
+        self.check_summaries(self.make_stats()._summarize_numpy())
+
+    def test_percentile_rank(self):
+        self.assertEqual(gsttracerstats.percentile_rank(50, 1), 0)
+        self.assertEqual(gsttracerstats.percentile_rank(50, 10), 4)
+        self.assertEqual(gsttracerstats.percentile_rank(99, 10), 9)
+
+class IncreasePValueTest(unittest.TestCase):
+    baseline = [10, 11, 9, 10, 12]
+
+    def test_student_t_sf(self):
+        self.assertAlmostEqual(gsttracerstats.student_t_sf(0, 5), 0.5)
+        # the 95th percentile of t with 5 degrees of freedom
+        self.assertAlmostEqual(gsttracerstats.student_t_sf(2.015, 5), 0.05, places=4)
+        self.assertAlmostEqual(gsttracerstats.student_t_sf(-2.015, 5), 0.95, places=4)
+
+    def test_increase(self):
+        self.assertLess(increase_p_value(self.baseline, [20, 21, 19, 22]), 0.001)
+
+    def test_no_increase(self):
+        self.assertGreater(increase_p_value(self.baseline, [9, 10, 11, 10]), 0.5)
+        self.assertGreater(increase_p_value(self.baseline, [1, 2, 1, 2]), 0.99)
+
+    def test_single_candidate(self):
+        self.assertLess(increase_p_value(self.baseline, [30]), 0.001)
+        self.assertGreater(increase_p_value(self.baseline, [10]), 0.4)
+
+    def test_constant_values(self):
+        self.assertEqual(increase_p_value([5, 5, 5], [6, 6]), 0.0)
+        self.assertEqual(increase_p_value([5, 5, 5], [5, 5]), 1.0)
+        self.assertEqual(increase_p_value([5, 5, 5], [4]), 1.0)
+
+class FalseDiscoveriesTest(unittest.TestCase):
+    def test_benjamini_hochberg(self):
+        # thresholds 0.0125, 0.025, 0.0375 and 0.05 by rank
+        self.assertEqual(false_discoveries([0.01, 0.04, 0.03, 0.5], 0.05), set([0]))
+        self.assertEqual(false_discoveries([0.04, 0.01, 0.02, 0.03], 0.05), set([0, 1, 2, 3]))
+
+    def test_step_up(self):
+        # the second smallest is over its threshold, 0.033, but the third
+        # is under its own and takes it along
+        self.assertEqual(false_discoveries([0.04, 0.001, 0.045], 0.05), set([0, 1, 2]))
+
+    def test_none(self):
+        self.assertEqual(false_discoveries([0.2, 0.5], 0.05), set())
+        self.assertEqual(false_discoveries([], 0.05), set())
+
+if __name__ == '__main__':
+    unittest.main()